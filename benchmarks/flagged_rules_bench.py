@@ -0,0 +1,66 @@
+"""Microbenchmark for flagged_rules.RuleIndex: cost per Server header as the rule count grows.
+
+    Run with PYTHONPATH=scanner python benchmarks/flagged_rules_bench.py
+    Uncached cost should stay roughly flat from tens to thousands of rules.
+"""
+import argparse
+import json
+import random
+import timeit
+
+import flagged_rules
+
+_RULE_COUNTS = (10, 100, 1000, 5000)
+_DISTINCT_HEADERS = 300
+
+
+def make_rules(count: int, rng: random.Random) -> list[flagged_rules.RULE_TYPE]:
+    """count rules spread over a few products, a third each prefix, pattern and range."""
+    rules = []
+    for i in range(count):
+        product, flag_as = rng.choice([('nginx', 'nginx'), ('Microsoft-IIS', 'iis'),
+                                       (f'product{i % 50}', 'nginx')])
+        major, minor = rng.randrange(30), rng.randrange(30)
+        spec = (f'{major}.{minor}', f'{major}.{minor}.*',
+                f'>={major}.{minor},<{major}.{minor}.{rng.randrange(1, 9)}')[i % 3]
+        rules.append({'product': product, 'flag_as': flag_as, 'versions': [spec]})
+    return rules
+
+
+def make_headers(rng: random.Random) -> list[str]:
+    products = ['nginx', 'Microsoft-IIS', 'Apache', 'product7', 'cloudflare']
+    return [f'{rng.choice(products)}/{rng.randrange(30)}.{rng.randrange(30)}.{rng.randrange(10)}'
+            for _ in range(_DISTINCT_HEADERS)]
+
+
+def bench(count: int, repeat: int, rng: random.Random) -> dict[str, float]:
+    index = flagged_rules.RuleIndex(make_rules(count, rng))
+    headers = make_headers(rng)
+    # _classify is the compiled lookup without the per-header cache.
+    uncached = min(timeit.repeat(lambda: [index._classify(h) for h in headers],
+                                 number=repeat, repeat=3))
+    cached = min(timeit.repeat(lambda: [index.classify(h) for h in headers],
+                               number=repeat, repeat=3))
+    per_call = 1e9 / (repeat * len(headers))
+    return {'Rules': count, 'UncachedNsPerHeader': uncached * per_call,
+            'CachedNsPerHeader': cached * per_call}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    args = parser.parse_args()
+    rng = random.Random(0)
+    results = [bench(count, args.repeat, rng) for count in _RULE_COUNTS]
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    print(f'{"Rules":>8} {"Uncached ns/header":>20} {"Cached ns/header":>18}')
+    for result in results:
+        print(f'{result["Rules"]:>8} {result["UncachedNsPerHeader"]:>20.0f} '
+              f'{result["CachedNsPerHeader"]:>18.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""End to end benchmark of WebServerScanner against a local fleet of stand-in web servers.
+
+    Run with PYTHONPATH=scanner python benchmarks/fleet_bench.py --output results.json
+    The fleet runs in its own process on loopback, one port per server, with
+    a mix of flagged and unflagged Server headers, small and large pages,
+    slow responders, non-200s and black-holed ports. Each engine and target
+    count is scanned in a fresh process so peak RSS is its own. Results are
+    written as JSON with the commit they were measured at, to compare
+    between commits.
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import time
+from typing import Iterator
+
+import tcp_sweep
+import web_server_scanner
+
+_COUNTS = (100, 500)
+_ENGINES = web_server_scanner.ENGINES
+_DEFAULT_SERVERS = 200
+_SLOW_DELAY = 0.25 # seconds
+_INDEX_PAGE = b'<html><head><title>Index of /</title></head><body>'
+_PLAIN_PAGE = b'<html><head><title>Welcome</title></head><body>'
+
+# (name, share of the fleet, status, Server header, page, page padding bytes, delay)
+# Black-holed ports accept nothing, so requests to them time out.
+_PROFILES = (
+    ('flagged_nginx_index', 20, 200, 'nginx/1.2.1', _INDEX_PAGE, 1024, 0),
+    ('unflagged_apache', 25, 200, 'Apache/2.4.57', _PLAIN_PAGE, 4096, 0),
+    ('flagged_iis_large', 10, 200, 'Microsoft-IIS/7.0', _PLAIN_PAGE, 256 * 1024, 0),
+    ('unflagged_nginx_huge_index', 5, 200, 'nginx/1.25.3', _PLAIN_PAGE, 4 * 1024 * 1024, 0),
+    ('no_server_header', 10, 200, None, _PLAIN_PAGE, 512, 0),
+    ('slow', 5, 200, 'nginx/1.2.9', _INDEX_PAGE, 1024, _SLOW_DELAY),
+    ('not_found', 10, 404, 'nginx/1.18.0', b'', 0, 0),
+    ('server_error', 7, 500, 'Apache/2.4.57', b'', 0, 0),
+    ('redirect', 7, 301, 'nginx/1.2.1', b'', 0, 0),
+    ('black_holed', 1, None, None, b'', 0, 0),
+)
+
+
+def _response(status: int, server: str, page: bytes, padding: int,
+              keep_alive: bool = False) -> bytes:
+    body = page + b'x' * padding if page else b''
+    head = [f'HTTP/1.1 {status} X', f'Content-Length: {len(body)}',
+            f'Connection: {"keep-alive" if keep_alive else "close"}']
+    if server is not None:
+        head.append(f'Server: {server}')
+    if status == 301:
+        head.append('Location: /elsewhere')
+    return ('\r\n'.join(head) + '\r\n\r\n').encode() + body
+
+
+def _fleet_ports(servers: int) -> list[str]:
+    """Profile names for each of servers ports, in proportion to their shares and shuffled."""
+    total = sum(profile[1] for profile in _PROFILES)
+    names = []
+    for name, share, *_ in _PROFILES:
+        names.extend([name] * max(1, round(servers * share / total)))
+    # Seeded so every run scans the same fleet in the same order.
+    random.Random(0).shuffle(names)
+    return names
+
+
+async def _serve_fleet(servers: int, conn) -> None:
+    profiles = {profile[0]: profile for profile in _PROFILES}
+    listening, fleet = [], []
+    for name in _fleet_ports(servers):
+        _, _, status, server, page, padding, delay = profiles[name]
+        if status is None:
+            # Never accepted, so connections hang until the client times out.
+            sock = socket.socket()
+            sock.bind(('127.0.0.1', 0))
+            sock.listen(0)
+            listening.append(sock)
+            fleet.append((sock.getsockname()[1], name))
+            continue
+        responses = (_response(status, server, page, padding),
+                     _response(status, server, page, padding, keep_alive=True))
+
+        async def handle(reader, writer, responses=responses, delay=delay):
+            # Keeps answering on the connection until the client asks to close it.
+            try:
+                while True:
+                    request = await reader.readuntil(b'\r\n\r\n')
+                    keep_alive = b'connection: close' not in request.lower()
+                    if delay:
+                        await asyncio.sleep(delay)
+                    writer.write(responses[keep_alive])
+                    await writer.drain()
+                    if not keep_alive:
+                        break
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                writer.close()
+
+        listening.append(await asyncio.start_server(handle, '127.0.0.1', 0, backlog=1024))
+        fleet.append((listening[-1].sockets[0].getsockname()[1], name))
+    conn.send(fleet)
+    await asyncio.Event().wait()
+
+
+def _run_fleet(servers: int, conn) -> None:
+    asyncio.run(_serve_fleet(servers, conn))
+
+
+def start_fleet(servers: int) -> tuple[multiprocessing.Process, list[tuple[int, str]]]:
+    """Starts the fleet in a daemon process. Returns it and its (port, profile name)s."""
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_run_fleet, args=(servers, child_conn), daemon=True)
+    process.start()
+    return process, parent_conn.recv()
+
+
+def make_targets(fleet: list[tuple[int, str]], count: int) -> list[str]:
+    """count targets round robin over the fleet."""
+    return [f'http://127.0.0.1:{fleet[i % len(fleet)][0]}' for i in range(count)]
+
+
+def run_scan(engine: str, ips: list[str], max_in_flight: int, sweep: bool = False,
+             probes: tuple[str, ...] = (), keep_alive: bool = True) -> dict:
+    """Runs in a fresh process. Scans ips and returns what was measured."""
+    sweeper = tcp_sweep.TcpSweeper() if sweep else None
+    scanner = web_server_scanner.WebServerScanner([], log_level='CRITICAL', engine=engine,
+                                                  max_in_flight=max_in_flight, sweeper=sweeper,
+                                                  probes=probes, keep_alive=keep_alive)
+    started: dict[str, collections.deque] = collections.defaultdict(collections.deque)
+
+    def pull() -> Iterator[str]:
+        # Timed from when the scanner takes the target, so queueing isn't counted.
+        for ip in ips:
+            started[ip].append(time.perf_counter())
+            yield ip
+
+    latencies, statuses = [], collections.Counter()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    for ip, result in scanner.iter_scan(pull()):
+        latencies.append(time.perf_counter() - started[ip].popleft())
+        statuses[result['Status'].name] += 1
+    seconds = time.perf_counter() - start
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (end_usage.ru_utime - usage.ru_utime) + (end_usage.ru_stime - usage.ru_stime)
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {'Engine': engine, 'TcpSweep': sweep, 'Probes': list(probes),
+            'KeepAlive': keep_alive, 'Targets': len(ips), 'Seconds': seconds,
+            'HostsPerSecond': len(ips) / seconds,
+            'P50Ms': percentiles[49] * 1000, 'P99Ms': percentiles[98] * 1000,
+            # ru_maxrss is in KiB on Linux.
+            'PeakRssMb': end_usage.ru_maxrss / 1024,
+            'CpuMsPerHost': cpu * 1000 / len(ips), 'Statuses': dict(statuses)}
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=_COUNTS,
+                        help='Target counts to scan, each at least 2.')
+    parser.add_argument('--engines', choices=_ENGINES, nargs='+', default=_ENGINES)
+    parser.add_argument('--servers', type=int, default=_DEFAULT_SERVERS,
+                        help='Ports in the fleet, targets go round robin over them.')
+    parser.add_argument('--max-in-flight', type=int,
+                        default=web_server_scanner._DEFAULT_MAX_IN_FLIGHT)
+    parser.add_argument('--tcp-sweep', action='store_true',
+                        help='TCP sweep each target before sending HTTP requests.')
+    parser.add_argument('--probes', nargs='+', default=(), metavar='PATH',
+                        help='Paths to probe on each target after /.')
+    parser.add_argument('--no-keep-alive', action='store_false', dest='keep_alive',
+                        help='Open a new connection for every request.')
+    parser.add_argument('--output', type=str, metavar='PATH', help='Write results as JSON here.')
+    args = parser.parse_args()
+
+    fleet_process, fleet = start_fleet(args.servers)
+    runs = []
+    # Spawned, so each run starts from a clean process and its own peak RSS.
+    context = multiprocessing.get_context('spawn')
+    try:
+        for count in args.counts:
+            for engine in args.engines:
+                with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+                    run = pool.submit(run_scan, engine, make_targets(fleet, count),
+                                      args.max_in_flight, args.tcp_sweep, tuple(args.probes),
+                                      args.keep_alive).result()
+                runs.append(run)
+                print(f'{run["Engine"]:>6} {run["Targets"]:>7} targets: '
+                      f'{run["HostsPerSecond"]:>8.1f} hosts/s, p50 {run["P50Ms"]:.1f}ms, '
+                      f'p99 {run["P99Ms"]:.1f}ms, {run["PeakRssMb"]:.1f}MB peak RSS, '
+                      f'{run["CpuMsPerHost"]:.2f}ms CPU/host')
+    finally:
+        fleet_process.terminate()
+
+    if args.output:
+        report = {'Commit': _commit(), 'Python': platform.python_version(),
+                  'Platform': platform.platform(), 'Time': time.time(),
+                  'Servers': len(fleet),
+                  'Fleet': dict(collections.Counter(name for _, name in fleet)),
+                  'Runs': runs}
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Memory per host of the old nested-dict ip_map against result_store.ResultStore.
+
+    Run with PYTHONPATH=scanner python benchmarks/result_store_bench.py
+    Measured with tracemalloc over a mix of results like a real scan's:
+    mostly good, some shared timeouts and some errors unique to the host.
+"""
+import argparse
+import collections
+import gc
+import json
+import tracemalloc
+from typing import Callable, Iterator
+
+import result_store
+import web_server_scanner
+from utils import WebSrvEnum, DirListEnum, StatusEnum
+
+_HOSTS = (10000, 100000)
+_ERROR_MSG = web_server_scanner._ERROR_STATUS_MSG
+
+
+def make_results(hosts: int) -> Iterator[tuple[str, dict]]:
+    """Every 10th host times out (a shared message), every 50th fails with its own."""
+    for i in range(hosts):
+        ip = f'http://10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:80'
+        if i % 50 == 0:
+            result = (WebSrvEnum.err, DirListEnum.err, StatusEnum.response_err,
+                      _ERROR_MSG.format(f"HTTPConnectionPool(host='{ip[7:-3]}', port=80): "
+                                        'Max retries exceeded with url: /'))
+        elif i % 10 == 0:
+            result = (WebSrvEnum.err, DirListEnum.err, StatusEnum.response_err,
+                      _ERROR_MSG.format('timed out'))
+        else:
+            result = (WebSrvEnum.other, DirListEnum.unavailable, StatusEnum.good, None)
+        yield ip, dict(zip(web_server_scanner._RESULT_KEYS, result))
+
+
+def nested_dict(hosts: int) -> collections.defaultdict:
+    """The ip_map as it was before ResultStore."""
+    ip_map = collections.defaultdict(lambda: {'WebServerSoftware': WebSrvEnum,
+                                              'RootListing': DirListEnum,
+                                              'Status': StatusEnum,
+                                              'ErrorMsg': None})
+    for ip, result in make_results(hosts):
+        ip_map[ip].update(result)
+    return ip_map
+
+
+def result_store_map(hosts: int) -> result_store.ResultStore:
+    return result_store.ResultStore(make_results(hosts))
+
+
+def bytes_per_host(build: Callable[[int], object], hosts: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    built = build(hosts)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del built
+    return size / hosts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hosts', type=int, nargs='+', default=_HOSTS)
+    parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+    args = parser.parse_args()
+    results = [{'Hosts': hosts, 'DictBytesPerHost': bytes_per_host(nested_dict, hosts),
+                'StoreBytesPerHost': bytes_per_host(result_store_map, hosts)} for hosts in args.hosts]
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    print(f'{"Hosts":>8} {"Dict bytes/host":>16} {"Store bytes/host":>17}')
+    for result in results:
+        print(f'{result["Hosts"]:>8} {result["DictBytesPerHost"]:>16.1f} '
+              f'{result["StoreBytesPerHost"]:>17.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import time
 import requests
 
 url = 'http://127.0.0.1:5000/scan'
@@ -12,7 +13,12 @@ payload = {
 
 response = requests.post(url, json=payload)
 
-if response.status_code == 200:
-    print(response.json())
+if response.status_code == 202:
+    job_url = f'{url}/{response.json()["JobId"]}'
+    job = requests.get(job_url).json()
+    while job['Status'] in ('queued', 'running'):
+        time.sleep(1)
+        job = requests.get(job_url).json()
+    print(job['Results'])
 else:
-    print(f'Request failed with status code {response.status_code}')
\ No newline at end of file
+    print(f'Request failed with status code {response.status_code}')
@@ -1,9 +1,26 @@
+import json
 import logging
+import os
 import flask
 
-from scanner import web_server_scanner
+from scanner import job_queue, result_cache, scan_metrics, web_server_scanner
 
 app = flask.Flask(__name__)
+# Keep result pages in input order.
+app.json.sort_keys = False
+# Shared by every request. Set IP_SCANNER_CACHE to a SQLite file path to enable.
+_cache_path = os.environ.get('IP_SCANNER_CACHE')
+cache = result_cache.ResultCache(_cache_path) if _cache_path else None
+# Set IP_SCANNER_METRICS to time every scan and serve the results at /metrics.
+metrics = scan_metrics.ScanMetrics() if os.environ.get('IP_SCANNER_METRICS') else None
+# Scans run here, IP_SCANNER_JOB_WORKERS at a time. Past IP_SCANNER_MAX_QUEUED
+# waiting jobs, POST /scan is turned away with a 429.
+jobs = job_queue.JobQueue(int(os.environ.get('IP_SCANNER_JOB_WORKERS',
+                                             job_queue._DEFAULT_WORKERS)),
+                          int(os.environ.get('IP_SCANNER_MAX_QUEUED',
+                                             job_queue._DEFAULT_MAX_QUEUED)))
+_DEFAULT_PAGE_SIZE = 1000
+_RETRY_AFTER = 5 # seconds
 
 @app.route('/scan', methods=['POST'])
 def scan_web_servers():
@@ -14,11 +31,77 @@ def scan_web_servers():
     scan_root = data.get('scan_root', True)
     preserve_ips = data.get('preserve_ips', True)
     log_level = data.get('log_level', 'WARNING')
+    engine = data.get('engine', 'sync')
+    max_in_flight = data.get('max_in_flight', web_server_scanner._DEFAULT_MAX_IN_FLIGHT)
+    max_body_bytes = data.get('max_body_bytes', web_server_scanner._DEFAULT_MAX_BODY_BYTES)
+    use_cache = data.get('use_cache', True)
 
-    result = web_server_scanner.WebServerScanner(ips, scan_software, scan_root,
-                                                 preserve_ips, log_level)()
+    try:
+        scanner = web_server_scanner.WebServerScanner(ips, scan_software, scan_root,
+                                                      preserve_ips, log_level,
+                                                      engine, max_in_flight, max_body_bytes,
+                                                      cache=cache if use_cache else None,
+                                                      metrics=metrics)
+        # Bad args raise here, before the job is queued.
+        results = scanner.iter_scan(order='input')
+    except ValueError as e:
+        return flask.jsonify({'Error': str(e)}), 400
+    try:
+        job = jobs.submit(results, len(ips))
+    except job_queue.QueueFullError as e:
+        return flask.jsonify({'Error': str(e)}), 429, {'Retry-After': str(_RETRY_AFTER)}
 
-    return flask.jsonify(result)
+    return flask.jsonify(job.summary()), 202, {'Location': flask.url_for('scan_job', job_id=job.id)}
+
+@app.route('/scan/<job_id>', methods=['GET'])
+def scan_job(job_id):
+    """Status and progress of a job, with results[offset:offset + limit]."""
+    job = _get_job(job_id)
+    offset = flask.request.args.get('offset', 0, type=int)
+    limit = flask.request.args.get('limit', _DEFAULT_PAGE_SIZE, type=int)
+    if offset < 0 or limit < 1:
+        return flask.jsonify({'Error': 'offset must be at least 0 and limit at least 1.'}), 400
+    return flask.jsonify(job.page(offset, limit))
+
+@app.route('/scan/<job_id>/stream', methods=['GET'])
+def stream_scan_job(job_id):
+    """One JSON line per result as each finishes, ending when the job does."""
+    job = _get_job(job_id)
+    offset = flask.request.args.get('offset', 0, type=int)
+    return flask.Response(_stream_ndjson(job.iter_results(offset)),
+                          mimetype='application/x-ndjson')
+
+def _get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        flask.abort(404, f'No job {job_id}.')
+    return job
+
+def _stream_ndjson(results):
+    for ip, result in results:
+        yield json.dumps({'Ip': ip, 'Result': result}) + '\n'
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Scan timings and counts, plus jobs by status, for Prometheus to scrape."""
+    if metrics is None:
+        flask.abort(404, 'Metrics are off, set IP_SCANNER_METRICS to turn them on.')
+    lines = ['# HELP ip_scanner_jobs Scan jobs known to the API, by status.',
+             '# TYPE ip_scanner_jobs gauge']
+    lines += [f'ip_scanner_jobs{{status="{status.lower()}"}} {count}'
+              for status, count in jobs.stats().items()]
+    return flask.Response(metrics.to_prometheus() + '\n'.join(lines) + '\n',
+                          mimetype='text/plain; version=0.0.4')
+
+@app.route('/jobs', methods=['GET'])
+def job_stats():
+    return flask.jsonify({'Workers': jobs.workers, 'MaxQueued': jobs.max_queued, **jobs.stats()})
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    if cache is None:
+        return flask.jsonify({'Enabled': False})
+    return flask.jsonify({'Enabled': True, **cache.stats()})
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
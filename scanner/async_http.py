@@ -0,0 +1,376 @@
+"Minimal asyncio HTTP/1.1 client for the async scan engine. Only does what the scanner needs."
+import asyncio
+import collections
+import contextlib
+import ssl
+import time
+from typing import AsyncIterator, Iterator, Optional, Union
+from urllib.parse import urlsplit
+
+from requests.structures import CaseInsensitiveDict
+
+_USER_AGENT = 'ip-scanner-project'
+_DEFAULT_ENCODING = 'utf-8'
+_READ_SIZE = 65536
+_DEFAULT_POOL_SIZE = 2 # idle connections kept per host
+_DEFAULT_POOL_HOSTS = 64
+# Unread body left after the scanner is done with a response that is still
+# read off to reuse the connection. Past it, the connection is closed.
+_MAX_DRAIN_BYTES = 65536
+# Responses to these never have a body.
+_NO_BODY_STATUS_CODES = (204, 304)
+
+
+class RequestError(Exception):
+    """Any failure to get a response. Plays the role of requests' RequestException."""
+
+
+class ConnectTimeout(RequestError):
+    pass
+
+
+class ConnectError(RequestError):
+    pass
+
+
+class ReadTimeout(RequestError):
+    pass
+
+
+class InvalidResponse(RequestError):
+    pass
+
+
+class AsyncResponse():
+    """Just enough of requests.Response for the classifiers: status_code, headers, text."""
+    def __init__(self, url: str, status_code: int, headers: CaseInsensitiveDict,
+                 content: bytes) -> None:
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def encoding(self) -> str:
+        """Charset from Content-Type if given, else utf-8."""
+        content_type = self.headers.get('Content-Type', '')
+        for param in content_type.split(';')[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'charset' and value:
+                return value.strip('"\'')
+        return _DEFAULT_ENCODING
+
+    @property
+    def text(self) -> str:
+        try:
+            return self.content.decode(self.encoding, errors='replace')
+        except LookupError:
+            # Unknown charset given by the server.
+            return self.content.decode(_DEFAULT_ENCODING, errors='replace')
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        """Same as requests. The body was already read (up to any limit) by get()."""
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self) -> None:
+        """Nothing to release, get() already closed the connection or gave it back."""
+
+
+_CONNECTION_TYPE = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+_POOL_KEY_TYPE = tuple[bool, str, int]
+
+
+class ConnectionPool():
+    """Keep-alive connections left open between requests, per (https, host, port).
+
+        Pass the same one to get() for every request on an event loop, so
+        several requests to one host share a connection. Not thread safe,
+        use one per event loop, and close() it before the loop is closed.
+    """
+    def __init__(self, size: int = _DEFAULT_POOL_SIZE,
+                 max_hosts: int = _DEFAULT_POOL_HOSTS) -> None:
+        if size < 1 or max_hosts < 1:
+            raise ValueError('size and max_hosts must be at least 1.')
+        self.size = size
+        self.max_hosts = max_hosts
+        # Connections opened and requests sent on one already open, for stats.
+        self.opened = 0
+        self.reused = 0
+        self._idle: collections.OrderedDict[_POOL_KEY_TYPE, list[_CONNECTION_TYPE]] = \
+            collections.OrderedDict()
+
+    def take(self, key: _POOL_KEY_TYPE) -> Optional[_CONNECTION_TYPE]:
+        """An idle connection to key the server hasn't closed, or None."""
+        idle = self._idle.get(key, [])
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return None
+
+    def give_back(self, key: _POOL_KEY_TYPE, connection: _CONNECTION_TYPE) -> None:
+        """Keeps connection for the next request to key, closing the least recent if full."""
+        idle = self._idle.setdefault(key, [])
+        self._idle.move_to_end(key)
+        if len(idle) >= self.size:
+            idle.pop(0)[1].close()
+        idle.append(connection)
+        while len(self._idle) > self.max_hosts:
+            for _, writer in self._idle.popitem(last=False)[1]:
+                writer.close()
+
+    def close(self) -> None:
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {'Opened': self.opened, 'Reused': self.reused}
+
+
+async def get(url: str, timeout: Union[float, tuple[float, float]], read_body: bool = True,
+              max_body_bytes: Optional[int] = None,
+              stop_at: Optional[bytes] = None,
+              timings: Optional[dict[str, float]] = None,
+              pool: Optional[ConnectionPool] = None) -> AsyncResponse:
+    """Sends a GET request for url without following redirects. Raises RequestError.
+
+        timeout applies to the connect and to each read separately, like
+        requests, and can be a (connect, read) tuple.
+        If read_body is False the body isn't kept. Otherwise it is read until
+        stop_at is seen, max_body_bytes have been read, or it ends, whichever
+        is first. If timings is given, seconds spent on 'connect',
+        'first_byte' and 'body' are added to it ('connect' only if a new
+        connection was opened).
+        Without a pool the connection is closed after the response. With one,
+        an idle connection to the same host is used if there is one, and the
+        connection is given back afterwards if the server allows it and any
+        unread body is under _MAX_DRAIN_BYTES.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise RequestError(f'Unsupported URL: {url}')
+    https = parts.scheme == 'https'
+    host = parts.hostname
+    port = parts.port or (443 if https else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    connect_timeout, timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    key = (https, host, port)
+
+    connection = pool.take(key) if pool is not None else None
+    if connection is not None:
+        pool.reused += 1
+        try:
+            return await _exchange(url, connection, host, port, https, path, timeout, read_body,
+                                   max_body_bytes, stop_at, timings, pool, key, reused=True)
+        except _StaleConnection:
+            # Closed by the server while idle, try once more on a new one.
+            pass
+    connection = await _connect(host, port, https, connect_timeout, timings)
+    if pool is not None:
+        pool.opened += 1
+    try:
+        return await _exchange(url, connection, host, port, https, path, timeout, read_body,
+                               max_body_bytes, stop_at, timings, pool, key)
+    except _StaleConnection as e:
+        raise InvalidResponse(f'{host}:{port}: Bad response: {e.__cause__!r}') from e.__cause__
+
+
+class _StaleConnection(Exception):
+    """A reused connection failed before any of the response was read."""
+
+
+async def _connect(host: str, port: int, https: bool, connect_timeout: float,
+                   timings: Optional[dict[str, float]]) -> _CONNECTION_TYPE:
+    ssl_context = ssl.create_default_context() if https else None
+    lap = _Lap(timings)
+    try:
+        return await asyncio.wait_for(asyncio.open_connection(host, port, ssl=ssl_context),
+                                      connect_timeout)
+    except asyncio.TimeoutError:
+        raise ConnectTimeout(f'{host}:{port}: Connect timed out. '
+                             f'(timeout={connect_timeout})') from None
+    except OSError as e:
+        raise ConnectError(f'{host}:{port}: Failed to establish a new connection: {e}') from e
+    finally:
+        lap('connect')
+
+
+async def _exchange(url: str, connection: _CONNECTION_TYPE, host: str, port: int, https: bool,
+                    path: str, timeout: float, read_body: bool, max_body_bytes: Optional[int],
+                    stop_at: Optional[bytes], timings: Optional[dict[str, float]],
+                    pool: Optional[ConnectionPool], key: _POOL_KEY_TYPE,
+                    reused: bool = False) -> AsyncResponse:
+    """Sends the request on connection and reads the response, then closes or pools it."""
+    reader, writer = connection
+    lap = _Lap(timings)
+    reusable = False
+    status_code = None
+    # Whatever happens, the time goes to the phase it happened in.
+    phase = 'first_byte'
+    try:
+        writer.write(_build_request(host, port, https, path, keep_alive=pool is not None))
+        await asyncio.wait_for(writer.drain(), timeout)
+        status_code = await _read_status_line(reader, timeout)
+        headers = await _read_headers(reader, timeout)
+        lap(phase)
+        phase = 'body'
+        if status_code in _NO_BODY_STATUS_CODES:
+            content, complete = b'', True
+        else:
+            content, complete = await _read_body(reader, headers, timeout,
+                                                 max_body_bytes if read_body else 0,
+                                                 stop_at if read_body else None,
+                                                 drain=pool is not None)
+        reusable = (pool is not None and complete and _has_length(headers)
+                    and 'close' not in headers.get('Connection', '').lower())
+    except asyncio.TimeoutError:
+        raise ReadTimeout(f'{host}:{port}: Read timed out. (timeout={timeout})') from None
+    except (OSError, EOFError, ValueError) as e:
+        if reused and status_code is None:
+            raise _StaleConnection() from e
+        raise InvalidResponse(f'{host}:{port}: Bad response: {e!r}') from e
+    finally:
+        lap(phase)
+        if reusable:
+            pool.give_back(key, connection)
+        else:
+            writer.close()
+
+    return AsyncResponse(url, status_code, headers, content)
+
+
+class _Lap():
+    """Adds the time since the last call to timings[phase]. Does nothing without timings."""
+    def __init__(self, timings: Optional[dict[str, float]]) -> None:
+        self.timings = timings
+        self.last = time.perf_counter() if timings is not None else 0.0
+
+    def __call__(self, phase: str) -> None:
+        if self.timings is not None:
+            now = time.perf_counter()
+            self.timings[phase] = self.timings.get(phase, 0.0) + now - self.last
+            self.last = now
+
+
+def _build_request(host: str, port: int, https: bool, path: str,
+                   keep_alive: bool = False) -> bytes:
+    default_port = 443 if https else 80
+    host_header = host if port == default_port else f'{host}:{port}'
+    return (f'GET {path} HTTP/1.1\r\n'
+            f'Host: {host_header}\r\n'
+            f'User-Agent: {_USER_AGENT}\r\n'
+            'Accept: */*\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n').encode('ascii')
+
+
+async def _read_line(reader: asyncio.StreamReader, timeout: float) -> bytes:
+    line = await asyncio.wait_for(reader.readline(), timeout)
+    if not line:
+        raise EOFError('Connection closed before response was complete.')
+    return line
+
+
+async def _read_status_line(reader: asyncio.StreamReader, timeout: float) -> int:
+    """Parses e.g. 'HTTP/1.1 200 OK' and returns 200. Raises ValueError if malformed."""
+    line = (await _read_line(reader, timeout)).decode('latin-1').strip()
+    version, _, rest = line.partition(' ')
+    if not version.startswith('HTTP/'):
+        raise ValueError(f'Malformed status line: {line!r}')
+    return int(rest.split(' ', 1)[0])
+
+
+async def _read_headers(reader: asyncio.StreamReader, timeout: float) -> CaseInsensitiveDict:
+    """Reads header lines until the blank line. Repeated headers are joined like urllib3."""
+    headers = CaseInsensitiveDict()
+    while True:
+        line = (await _read_line(reader, timeout)).decode('latin-1').rstrip('\r\n')
+        if not line:
+            return headers
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise ValueError(f'Malformed header line: {line!r}')
+        name, value = name.strip(), value.strip()
+        if name in headers:
+            headers[name] = f'{headers[name]}, {value}'
+        else:
+            headers[name] = value
+
+
+def _has_length(headers: CaseInsensitiveDict) -> bool:
+    """If the body's end is marked, rather than the server closing the connection."""
+    return ('chunked' in headers.get('Transfer-Encoding', '').lower()
+            or 'Content-Length' in headers)
+
+
+async def _read_body(reader: asyncio.StreamReader, headers: CaseInsensitiveDict,
+                     timeout: float, max_bytes: Optional[int],
+                     stop_at: Optional[bytes], drain: bool = False) -> tuple[bytes, bool]:
+    """Reads the body up to max_bytes or stop_at. Returns it and if the whole body was read.
+
+        With drain, the rest is then read and dropped, up to _MAX_DRAIN_BYTES,
+        so the connection can take another request.
+    """
+    body = bytearray()
+    keeping = max_bytes != 0
+    if not keeping and not drain:
+        return b'', False
+    drained = 0
+    async with contextlib.aclosing(_iter_body(reader, headers, timeout)) as chunks:
+        async for chunk in chunks:
+            if not keeping:
+                drained += len(chunk)
+                if drained > _MAX_DRAIN_BYTES:
+                    return bytes(body), False
+                continue
+            # Start the search far enough back to catch stop_at across chunks.
+            search_from = max(0, len(body) - len(stop_at) + 1) if stop_at else 0
+            body += chunk
+            if stop_at and body.find(stop_at, search_from) != -1:
+                keeping = False
+            elif max_bytes is not None and len(body) >= max_bytes:
+                del body[max_bytes:]
+                keeping = False
+            if not keeping and not drain:
+                return bytes(body), False
+    return bytes(body), True
+
+
+async def _iter_body(reader: asyncio.StreamReader, headers: CaseInsensitiveDict,
+                     timeout: float) -> AsyncIterator[bytes]:
+    """Yields the decoded body in pieces as it arrives."""
+    if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+        while True:
+            size_line = (await _read_line(reader, timeout)).split(b';', 1)[0].strip()
+            size = int(size_line, 16)
+            if size == 0:
+                # Trailers are skipped up to the blank line.
+                while await _read_line(reader, timeout) not in (b'\r\n', b'\n'):
+                    pass
+                return
+            async for chunk in _iter_exactly(reader, size, timeout):
+                yield chunk
+            await _read_line(reader, timeout)  # CRLF after each chunk
+    content_length: Optional[str] = headers.get('Content-Length')
+    if content_length is not None:
+        async for chunk in _iter_exactly(reader, int(content_length), timeout):
+            yield chunk
+        return
+    # No length given, server will close the connection when done.
+    while chunk := await asyncio.wait_for(reader.read(_READ_SIZE), timeout):
+        yield chunk
+
+
+async def _iter_exactly(reader: asyncio.StreamReader, size: int,
+                        timeout: float) -> AsyncIterator[bytes]:
+    while size > 0:
+        chunk = await asyncio.wait_for(reader.read(min(size, _READ_SIZE)), timeout)
+        if not chunk:
+            raise EOFError('Connection closed before response was complete.')
+        size -= len(chunk)
+        yield chunk
@@ -0,0 +1,96 @@
+"Append-only checkpoint log so an interrupted scan can pick up where it left off."
+import json
+import logging
+import os
+import time
+from typing import Iterable, Iterator
+
+from utils import dump_result, load_result
+
+_DEFAULT_FSYNC_EVERY = 1000 # results
+_DEFAULT_FSYNC_INTERVAL = 1.0 # seconds
+
+
+class CheckpointLog():
+    """One JSON line per finished target: {"Ip": key in the output, "Result": {...}}.
+
+        Lines are buffered and fsynced every fsync_every results or
+        fsync_interval seconds, whichever is first, so a crash loses at most
+        that much work. A line cut short by a crash is dropped on load.
+    """
+    def __init__(self, path: str, fsync_every: int = _DEFAULT_FSYNC_EVERY,
+                 fsync_interval: float = _DEFAULT_FSYNC_INTERVAL) -> None:
+        if fsync_every < 1:
+            raise ValueError('fsync_every must be at least 1.')
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def resume(self, scanner, ips: Iterable[str]) -> Iterator[tuple[str, dict]]:
+        """Yields logged results, then scans and logs every target not already done.
+
+            Scans in input order, so the log (and so the replay) is too, and
+            the combined output matches an uninterrupted run. scanner is a
+            WebServerScanner or ShardedScanner.
+        """
+        done = set()
+        try:
+            for ip, result in self._replay():
+                done.add(ip)
+                yield ip, result
+            if done:
+                logging.warning(f'Resuming from {self.path}, {len(done)} targets already done.')
+            pending = (ip for ip in ips if scanner.output_key(ip) not in done)
+            for ip, result in scanner.iter_scan(pending, order='input'):
+                self.append(ip, result)
+                yield ip, result
+        finally:
+            self.close()
+
+    def append(self, ip: str, result: dict) -> None:
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps({'Ip': ip, 'Result': dump_result(result)}) + '\n')
+        self._unsynced += 1
+        if (self._unsynced >= self.fsync_every
+                or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def sync(self) -> None:
+        """Flushes buffered lines and fsyncs them to disk."""
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            logging.debug(f'Checkpointed {self._unsynced} results to {self.path}.')
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        self.sync()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _replay(self) -> Iterator[tuple[str, dict]]:
+        """Yields every complete line in the log, dropping a partial last one."""
+        if not os.path.exists(self.path):
+            return
+        good_bytes = 0
+        with open(self.path, 'rb') as file:
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                good_bytes += len(line)
+                try:
+                    record = json.loads(line)
+                    entry = record['Ip'], load_result(record['Result'])
+                except (ValueError, KeyError, TypeError):
+                    logging.error(f'Skipping corrupt line in {self.path}: {line!r}')
+                    continue
+                yield entry
+        if good_bytes < os.path.getsize(self.path):
+            logging.warning(f'Dropping incomplete last line of {self.path}.')
+            os.truncate(self.path, good_bytes)
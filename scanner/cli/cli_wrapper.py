@@ -1,79 +1,464 @@
 "A CLI wrapper for web_server_scanner, takes IPs and returns flagged servers."
 import argparse
+import csv
+import os
 import sys
 import json
+import sqlite3
+from typing import Iterable, Iterator, TextIO
 from termcolor import colored as text_color
 
+import checkpoint
+import distributed
+import flagged_rules
+import result_cache
+import scan_metrics
+import scan_scheduler
+import tcp_sweep
+import sharded_scanner
+import snapshot
+import targets
 import utils
 import web_server_scanner
 
+OUTPUT_METHODS = ('HUMAN', 'JSON', 'NDJSON', 'CSV')
+_OUTPUT_BUFFER_SIZE = 1 << 16 # bytes
+_CSV_FIELDS = ('Ip', *web_server_scanner._RESULT_KEYS)
+
 def main():
     parser = argparse.ArgumentParser(description='Checks if provided IPs match '
                                      'server type and version from '
-                                     f'{utils.get_flagged_versions()}. '
+                                     f'{utils.get_flagged_versions()} '
+                                     '(or --rules-file). '
                                      'Also runs a very simple, unreliable '
                                      'check to see if a listing of files is '
                                      'available at root (ip + /).')
-    parser.add_argument('--ips', nargs='+', type=str, help='Space separated IP addresses to scan.')
-    parser.add_argument('--ip-file', type=str, help='Text file containing IP addresses (one per line).')
+    parser.add_argument('--ips', nargs='+', type=str, help='Space separated IP addresses to scan. '
+                        'CIDR blocks, ranges and port lists are expanded, e.g. 10.0.0.0/16:80,8080.')
+    parser.add_argument('--ip-file', type=str, help='Text file containing IP addresses (one per line), '
+                        'expanded like --ips.')
     parser.add_argument('--disable-scan-software', action='store_false', help='Disable scan for web server software.')
     parser.add_argument('--disable-scan-root', action='store_false', help='Disable scan for directory listings at root.')
     parser.add_argument('--preserve-ips', action='store_true', help='Preserve original IPs in output.')
     parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         default='CRITICAL', help='Set the log level.')
-    parser.add_argument('--output-method', choices=['HUMAN', 'JSON'],
-                        default='HUMAN', help='How to print output to console.')
+    parser.add_argument('--output-method', choices=OUTPUT_METHODS,
+                        default='HUMAN', help='How to print output. NDJSON and CSV write '
+                        'one record per IP as it finishes.')
+    parser.add_argument('--output-file', type=str, metavar='PATH',
+                        help='Write output to this file instead of stdout.')
+    parser.add_argument('--engine', choices=web_server_scanner.ENGINES, default='sync',
+                        help='Scan IPs one at a time (sync) or concurrently (async).')
+    parser.add_argument('--max-in-flight', type=int, default=web_server_scanner._DEFAULT_MAX_IN_FLIGHT,
+                        help='Max concurrent requests for the async engine.')
+    parser.add_argument('--max-body-bytes', type=int, default=web_server_scanner._DEFAULT_MAX_BODY_BYTES,
+                        help='Stop reading a page after this many bytes when checking root.')
+    parser.add_argument('--rules-file', type=str,
+                        help='JSON file of flagged software rules to use instead of the defaults.')
+    parser.add_argument('--cache', type=str, metavar='PATH',
+                        help='Reuse results from this SQLite cache file and add new ones to it.')
+    parser.add_argument('--cache-ttl', type=_parse_cache_ttl, action='append', default=[],
+                        metavar='STATUS=SECONDS',
+                        help='How long results with a status stay cached, e.g. response_err=60. '
+                        f'Defaults: {_format_ttls(result_cache.DEFAULT_TTLS)}.')
+    parser.add_argument('--checkpoint', type=str, metavar='PATH',
+                        help='Log results to this file as they finish. If it already exists, '
+                        'IPs logged in it are not scanned again and their results are reused.')
+    parser.add_argument('--snapshot', type=str, metavar='PATH',
+                        help='Record every result in this SQLite snapshot file, as a baseline '
+                        'for --diff-against.')
+    parser.add_argument('--diff-against', type=str, metavar='PATH',
+                        help='Only output targets that are new or whose software, listing, '
+                        'status or probes changed since this snapshot, then update it.')
+    parser.add_argument('--rescan-after', type=_parse_cache_ttl, action='append', default=[],
+                        metavar='STATUS=SECONDS',
+                        help='Skip stable targets with a status in the snapshot until this long '
+                        'after they were last scanned, e.g. good=604800. Defaults: '
+                        f'{_format_ttls(snapshot.DEFAULT_RESCAN_INTERVALS)}. '
+                        'Implied by the options below.')
+    parser.add_argument('--stable-after', type=int,
+                        help='Scans a result must hold for before its target is stable, '
+                        f'default {snapshot._DEFAULT_STABLE_AFTER}.')
+    parser.add_argument('--defer-stable', action='store_true',
+                        help='Scan stable targets that are due after all the others.')
+    parser.add_argument('--schedule', action='store_true',
+                        help='Interleave targets across /24s, adapt timeouts to observed RTTs '
+                        'and retry transient failures after the rest. Implied by the options below.')
+    parser.add_argument('--rate', type=float, help='Max requests per second overall.')
+    parser.add_argument('--subnet-rate', type=float, help='Max requests per second to each /24.')
+    parser.add_argument('--timeout-floor', type=float, default=scan_scheduler._DEFAULT_TIMEOUT_FLOOR,
+                        help='Shortest adaptive timeout, in seconds.')
+    parser.add_argument('--timeout-ceiling', type=float,
+                        default=scan_scheduler._DEFAULT_TIMEOUT_CEILING,
+                        help='Longest adaptive timeout, in seconds. Also used for retries.')
+    parser.add_argument('--retries', type=int, default=scan_scheduler._DEFAULT_MAX_RETRIES,
+                        help='Times to retry a target after a timeout, connection error, 429 or 503.')
+    parser.add_argument('--retry-budget', type=float, default=scan_scheduler._DEFAULT_RETRY_BUDGET,
+                        help='Max retries per target scanned, e.g. 0.1 for one in ten.')
+    parser.add_argument('--tcp-sweep', action='store_true',
+                        help='Check each port with a fast TCP connect first, and only send HTTP '
+                        'requests to open ones. Implied by the options below.')
+    parser.add_argument('--sweep-timeout', type=float,
+                        help='Seconds to wait for a connect in the TCP sweep, '
+                        f'default {tcp_sweep._DEFAULT_TIMEOUT}.')
+    parser.add_argument('--sweep-max-in-flight', type=int,
+                        help='Connects open at once in the TCP sweep, '
+                        f'default {tcp_sweep._DEFAULT_MAX_IN_FLIGHT}.')
+    parser.add_argument('--probe', type=str, action='append', default=[], metavar='PATH',
+                        help='Also check PATH (e.g. /files/) on each host for a listing, over '
+                        'the same connection as /. Can be given more than once.')
+    parser.add_argument('--follow-redirects', type=int, default=0, metavar='N',
+                        help='Follow up to N redirects on the same host, for / and probes.')
+    parser.add_argument('--no-keep-alive', action='store_false', dest='keep_alive',
+                        help='Open a new connection for every request.')
+    parser.add_argument('--pool-size', type=int, default=web_server_scanner._DEFAULT_POOL_SIZE,
+                        help='Idle connections kept open per host.')
+    parser.add_argument('--pool-hosts', type=int, default=web_server_scanner._DEFAULT_POOL_HOSTS,
+                        help='Hosts to keep idle connections open to.')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Scan each target once however it is spelled, e.g. 10.0.0.1, '
+                        'http://10.0.0.1 and 10.0.0.1:80. With --preserve-ips every spelling '
+                        'is still output, otherwise each target once as http://10.0.0.1:80.')
+    parser.add_argument('--metrics', action='store_true',
+                        help='Time each phase of every scan and print a summary at the end.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Split IPs across this many worker processes.')
+    parser.add_argument('--shard-size', type=int, default=sharded_scanner._DEFAULT_SHARD_SIZE,
+                        help='IPs per shard handed to a worker when --workers > 1.')
+    parser.add_argument('--coordinator', type=_parse_address, metavar='HOST:PORT',
+                        help='Listen on HOST:PORT and hand the IPs out in leases to workers '
+                        'started with --worker, on this or other machines.')
+    parser.add_argument('--local-workers', type=int, default=0,
+                        help='Worker processes to start on this machine with --coordinator.')
+    parser.add_argument('--lease-size', type=int, default=distributed._DEFAULT_LEASE_SIZE,
+                        help='IPs handed to a worker at a time with --coordinator.')
+    parser.add_argument('--lease-timeout', type=float,
+                        default=distributed._DEFAULT_LEASE_TIMEOUT,
+                        help='Seconds a worker can go silent before its leases are handed out '
+                        'again.')
+    parser.add_argument('--worker', type=_parse_address, metavar='HOST:PORT',
+                        help='Scan leases from the coordinator at HOST:PORT instead of IPs given '
+                        'here. Scan options that change results come from the coordinator.')
+    parser.add_argument('--token', type=str, default=os.environ.get('SCANNER_TOKEN'),
+                        help='Shared secret workers must give the coordinator. Defaults to '
+                        'the SCANNER_TOKEN environment variable.')
     args = parser.parse_args()
     
     if args.ips and args.ip_file:
         print('Both --ips and --ip-file cannot be provided together.')
         sys.exit(1)
+    if args.worker and args.coordinator:
+        print('Both --worker and --coordinator cannot be provided together.')
+        sys.exit(1)
+    snapshot_path = args.diff_against or args.snapshot
+    if args.snapshot and args.diff_against:
+        print('Both --snapshot and --diff-against cannot be provided together.')
+        sys.exit(1)
+    if snapshot_path and args.checkpoint:
+        print('Both a snapshot and --checkpoint cannot be provided together.')
+        sys.exit(1)
+    rescan = args.rescan_after or args.stable_after or args.defer_stable
+    if rescan and not snapshot_path:
+        print('Rescan options need --snapshot or --diff-against.')
+        sys.exit(1)
 
-    if args.ips:
-        ips = args.ips
+    # Expanded lazily, so a /8 starts scanning straight away.
+    if args.worker:
+        ips = None
+    elif args.ips:
+        ips = targets.expand_targets(args.ips)
     elif args.ip_file:
-        ips = _read_ip_file(args.ip_file)
+        ips = targets.expand_targets(_read_ip_file(args.ip_file))
     else:
         print('IPs must be provided using either --ips or --ip-file.')
         sys.exit(1)
 
-    print('Running scan.')
-    result = web_server_scanner.WebServerScanner(ips,
-                                                args.disable_scan_software,
-                                                args.disable_scan_root,
-                                                args.preserve_ips,
-                                                args.log_level)()
-    if args.output_method == 'HUMAN':
-        _print_human(result)
-    if args.output_method == 'JSON':
-        _print_json(result)
-
-def _read_ip_file(file_path: str) -> list[str]:
+    rules = None
+    if args.rules_file:
+        try:
+            rules = flagged_rules.RuleIndex.from_file(args.rules_file)
+        except (OSError, ValueError) as e:
+            print(f'Could not load rules file: {e}')
+            sys.exit(1)
+
+    cache = None
+    if args.cache:
+        try:
+            cache = result_cache.ResultCache(args.cache, {**result_cache.DEFAULT_TTLS,
+                                                          **dict(args.cache_ttl)})
+        except sqlite3.Error as e:
+            print(f'Could not open cache: {e}')
+            sys.exit(1)
+
+    baseline = None
+    if snapshot_path and not args.worker:
+        try:
+            policy = snapshot.RescanPolicy(
+                {**snapshot.DEFAULT_RESCAN_INTERVALS, **dict(args.rescan_after)},
+                args.stable_after or snapshot._DEFAULT_STABLE_AFTER,
+                args.defer_stable) if rescan else None
+            baseline = snapshot.Snapshot(snapshot_path)
+        except ValueError as e:
+            print(f'Invalid rescan policy: {e}')
+            sys.exit(1)
+        except sqlite3.Error as e:
+            print(f'Could not open snapshot: {e}')
+            sys.exit(1)
+
+    # stdout is already block buffered when piped, and line buffered on a terminal.
+    if args.output_file:
+        try:
+            out = open(args.output_file, 'w', encoding='utf-8', buffering=_OUTPUT_BUFFER_SIZE)
+        except OSError as e:
+            print(f'Could not open output file: {e}')
+            sys.exit(1)
+    else:
+        out = sys.stdout
+
+    metrics = scan_metrics.ScanMetrics() if args.metrics else None
+
+    scheduler = None
+    if args.schedule or args.rate or args.subnet_rate:
+        try:
+            scheduler = scan_scheduler.Scheduler(args.rate, args.subnet_rate,
+                                                 timeout_floor=args.timeout_floor,
+                                                 timeout_ceiling=args.timeout_ceiling,
+                                                 max_retries=args.retries,
+                                                 retry_budget=args.retry_budget)
+        except ValueError as e:
+            print(f'Invalid schedule: {e}')
+            sys.exit(1)
+
+    sweeper = None
+    if args.tcp_sweep or args.sweep_timeout or args.sweep_max_in_flight:
+        try:
+            sweeper = tcp_sweep.TcpSweeper(args.sweep_timeout or tcp_sweep._DEFAULT_TIMEOUT,
+                                           args.sweep_max_in_flight
+                                           or tcp_sweep._DEFAULT_MAX_IN_FLIGHT)
+        except ValueError as e:
+            print(f'Invalid TCP sweep: {e}')
+            sys.exit(1)
+
+    scanner_kwargs = dict(scan_software=args.disable_scan_software,
+                          scan_root=args.disable_scan_root,
+                          preserve_ips=args.preserve_ips,
+                          log_level=args.log_level,
+                          engine=args.engine,
+                          max_in_flight=args.max_in_flight,
+                          max_body_bytes=args.max_body_bytes,
+                          rules=rules,
+                          cache=cache,
+                          metrics=metrics,
+                          scheduler=scheduler,
+                          sweeper=sweeper,
+                          probes=args.probe,
+                          follow_redirects=args.follow_redirects,
+                          keep_alive=args.keep_alive,
+                          pool_size=args.pool_size,
+                          pool_hosts=args.pool_hosts,
+                          dedup=args.dedup)
+    if args.worker:
+        print(f'Running worker for {args.worker[0]}:{args.worker[1]}.', file=sys.stderr)
+        try:
+            stats = distributed.run_worker(args.worker, args.token, **scanner_kwargs)
+        except (OSError, ValueError) as e:
+            print(f'Worker failed: {e}')
+            sys.exit(1)
+        _print_worker_stats({os.getpid(): stats})
+        if metrics is not None:
+            _print_metrics(metrics.snapshot())
+        if cache is not None:
+            cache.close()
+        return
+
+    # stderr so piped output is only results.
+    print('Running scan.', file=sys.stderr)
+    try:
+        if args.coordinator:
+            scanner = distributed.Coordinator(ips, args.coordinator, args.lease_size,
+                                              args.lease_timeout, args.token,
+                                              args.local_workers, **scanner_kwargs)
+        elif args.workers > 1:
+            scanner = sharded_scanner.ShardedScanner(ips, args.workers, args.shard_size,
+                                                     **scanner_kwargs)
+        else:
+            scanner = web_server_scanner.WebServerScanner(ips, **scanner_kwargs)
+    except ValueError as e:
+        print(f'Invalid options: {e}')
+        sys.exit(1)
+    # Streamed so output can start as soon as the first IP is done.
+    if baseline is not None:
+        results = baseline.scan(scanner, ips, diff=bool(args.diff_against), policy=policy)
+    elif args.checkpoint:
+        results = checkpoint.CheckpointLog(args.checkpoint).resume(scanner, ips)
+    else:
+        try:
+            results = scanner.iter_scan(ips, order='input')
+        except OSError as e:
+            # Only the coordinator listens before scanning.
+            print(f'Could not listen on {args.coordinator[0]}:{args.coordinator[1]}: {e}')
+            sys.exit(1)
+    if args.coordinator:
+        print(f'Waiting for workers on {scanner.address[0]}:{scanner.address[1]}.',
+              file=sys.stderr)
     try:
-        with open(file_path, 'r') as file:
-            ips = [line.strip() for line in file.readlines()]
-        return ips
+        if args.output_method == 'HUMAN':
+            _print_human(results, out)
+        if args.output_method == 'JSON':
+            _print_json(results, out)
+        if args.output_method == 'NDJSON':
+            _write_ndjson(results, out)
+        if args.output_method == 'CSV':
+            _write_csv(results, out, cached=cache is not None, probes=bool(args.probe),
+                       previous=bool(args.diff_against))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    distributed_scan = args.workers > 1 or args.coordinator
+    if distributed_scan:
+        _print_worker_stats(scanner.worker_stats)
+    if args.coordinator:
+        _print_coordinator_stats(scanner.scan_stats)
+    if scheduler is not None and not distributed_scan:
+        _print_schedule_stats(scheduler.stats())
+    if metrics is not None:
+        _print_metrics(scanner.metrics.snapshot())
+    if cache is not None:
+        _print_cache_stats(scanner.cache_stats if distributed_scan else cache.stats())
+        cache.close()
+    if baseline is not None:
+        _print_snapshot_stats(baseline.stats)
+        baseline.close()
+
+def _parse_cache_ttl(value: str) -> tuple[utils.StatusEnum, float]:
+    status, _, seconds = value.partition('=')
+    try:
+        return utils.StatusEnum[status], float(seconds)
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError(f'expected STATUS=SECONDS with STATUS one of '
+                                         f'{[status.name for status in utils.StatusEnum]}')
+
+def _parse_address(value: str) -> tuple[str, int]:
+    host, _, port = value.rpartition(':')
+    try:
+        return host or '0.0.0.0', int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected HOST:PORT, e.g. 0.0.0.0:7000')
+
+def _format_ttls(ttls: dict[utils.StatusEnum, float]) -> str:
+    return ', '.join(f'{status.name}={seconds:g}' for status, seconds in ttls.items())
+
+def _read_ip_file(file_path: str) -> Iterator[str]:
+    # Opened here so a missing file is reported before the scan starts.
+    try:
+        file = open(file_path, 'r')
     except FileNotFoundError:
         print(f'File not found: {file_path}')
         sys.exit(1)
+    return _iter_lines(file)
+
+def _iter_lines(file: TextIO) -> Iterator[str]:
+    with file:
+        for line in file:
+            yield line.strip()
 
-def _print_human(result: web_server_scanner.IP_MAP_TYPE):
-    msg = ''
-    for ip, v in result.items():
+def _print_human(results: Iterable[tuple[str, web_server_scanner.RESULT_TYPE]], out: TextIO):
+    for ip, v in results:
         # Get enum value for each item except for status which is a string.
         sw_type, root_listing, status = (enum_member.value for enum_member in list(v.values())[:3])
         error_msg = v['ErrorMsg']
-        msg += (f'\n\n{text_color(ip, color="cyan", attrs=["bold"])}' 
+        msg = (f'\n\n{text_color(ip, color="cyan", attrs=["bold"])}' 
                f'\n{text_color("Web server software:", attrs=["bold"])} {sw_type}' 
                f'\n{text_color("Root listing:", attrs=["bold"])} {root_listing}')
         if status != utils.StatusEnum.good.value:
             msg += (f'\n{text_color("Error occurred during scan.", color="red", attrs=["bold"])}'
                     f'\n{text_color("Error name:", color="red", attrs=["bold"])} {status}'
                     f'\n{text_color("Error message:", color="red", attrs=["bold"])} {error_msg}')
-    print(msg)
+        for path, listing in v.get('Probes', {}).items():
+            msg += f'\n{text_color(f"Listing at {path}:", attrs=["bold"])} {listing.value}'
+        if 'Previous' in v:
+            msg += f'\n{text_color("Previously:", color="yellow", attrs=["bold"])} '
+            msg += ('not scanned' if v['Previous'] is None else
+                    ', '.join(value.value for value in list(v['Previous'].values())[:3]))
+        out.write(msg)
+    out.write('\n')
     
-def _print_json(result: web_server_scanner.IP_MAP_TYPE):
-    print(json.dumps(result, indent=4))
+def _print_json(results: Iterable[tuple[str, web_server_scanner.RESULT_TYPE]], out: TextIO):
+    # Written an entry at a time, like json.dumps(dict(results), indent=4) except that
+    # a target given more than once keeps its first result, so keys stay unique.
+    separator = '{\n'
+    written = set()
+    for ip, result in results:
+        if ip in written:
+            continue
+        written.add(ip)
+        # Strip the outer braces, leaving the entry indented as if nested.
+        out.write(separator + json.dumps({ip: result}, indent=4)[2:-2])
+        separator = ',\n'
+    out.write('{}\n' if separator == '{\n' else '\n}\n')
+
+def _write_ndjson(results: Iterable[tuple[str, web_server_scanner.RESULT_TYPE]], out: TextIO):
+    # One {"Ip": ..., "Result": {...}} per line, like the API's job stream.
+    for ip, result in results:
+        out.write(json.dumps({'Ip': ip, 'Result': result}) + '\n')
+
+def _write_csv(results: Iterable[tuple[str, web_server_scanner.RESULT_TYPE]], out: TextIO,
+               cached: bool = False, probes: bool = False, previous: bool = False):
+    # Enum values as in the JSON output, with a Cached column if the cache is on,
+    # a Probes column of path=value;... if there are probes and a Previous column
+    # of software;listing;status (empty for new targets) when diffing.
+    fields = (_CSV_FIELDS + ('Cached',) * cached + ('Probes',) * probes
+              + ('Previous',) * previous)
+    # Keys without a column, e.g. Cached replayed from a checkpoint, are left out.
+    writer = csv.DictWriter(out, fields, lineterminator='\n', extrasaction='ignore')
+    writer.writeheader()
+    for ip, result in results:
+        row = {'Ip': ip, **{name: getattr(value, 'value', value)
+                            for name, value in result.items()}}
+        if probes:
+            row['Probes'] = ';'.join(f'{path}={listing.value}'
+                                     for path, listing in result.get('Probes', {}).items())
+        if previous and result['Previous'] is not None:
+            row['Previous'] = ';'.join(value.value for value in
+                                       list(result['Previous'].values())[:3])
+        writer.writerow(row)
+
+def _print_cache_stats(stats: dict[str, int]):
+    print(f'Cache: {stats["Hits"]} hits, {stats["Misses"]} misses', file=sys.stderr)
+
+def _print_snapshot_stats(stats: dict[str, int]):
+    print(f'Snapshot: {stats["Scanned"]} scanned, {stats["New"]} new, {stats["Changed"]} changed, '
+          f'{stats["Skipped"]} skipped, {stats["Deferred"]} deferred', file=sys.stderr)
+
+def _print_schedule_stats(stats: dict[str, float]):
+    print(f'Schedule: {stats["Retried"]} of {stats["Scanned"]} targets retried, timeouts '
+          f'{stats["ConnectTimeout"]:.2f}s connect, {stats["ReadTimeout"]:.2f}s read',
+          file=sys.stderr)
+
+def _print_metrics(snapshot: dict):
+    # Percentiles are bucket upper bounds, so approximate.
+    print(f'{"Phase":<12} {"Count":>8} {"Mean ms":>9} {"p50 ms":>8} {"p99 ms":>8}',
+          file=sys.stderr)
+    for phase, stats in snapshot['Phases'].items():
+        if stats['Count']:
+            print(f'{phase:<12} {stats["Count"]:>8} {stats["Sum"] * 1000 / stats["Count"]:>9.1f} '
+                  f'{stats["P50"] * 1000:>8g} {stats["P99"] * 1000:>8g}', file=sys.stderr)
+    for name in ('Statuses', 'Errors'):
+        if snapshot[name]:
+            counts = ', '.join(f'{key}={count}' for key, count in snapshot[name].items())
+            print(f'{name}: {counts}', file=sys.stderr)
+
+def _print_worker_stats(worker_stats: sharded_scanner.WORKER_STATS_TYPE
+                        | distributed.WORKER_STATS_TYPE):
+    # stderr so JSON output on stdout stays parseable.
+    for name, stats in worker_stats.items():
+        print(f'Worker {name}: {stats["Hosts"]} hosts in {stats["Seconds"]:.2f}s '
+              f'({stats["HostsPerSecond"]:.1f} hosts/s)', file=sys.stderr)
+
+def _print_coordinator_stats(stats: dict[str, float]):
+    print(f'Total: {stats["Hosts"]} hosts in {stats["Seconds"]:.2f}s '
+          f'({stats["HostsPerSecond"]:.1f} hosts/s), {stats["Requeued"]} leases requeued, '
+          f'{stats["Stolen"]} stolen', file=sys.stderr)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
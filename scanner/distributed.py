@@ -0,0 +1,557 @@
+"Coordinator that leases targets to scanner workers over TCP, and the workers that scan them."
+import collections
+import hmac
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import socket
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+
+import scan_metrics
+from sharded_scanner import ParallelScanner
+from utils import dump_result, load_result
+from web_server_scanner import RESULT_TYPE, WebServerScanner
+
+_DEFAULT_LEASE_SIZE = 500 # targets
+# A worker silent for this long has its leases handed out again.
+_DEFAULT_LEASE_TIMEOUT = 60.0 # seconds
+_HEARTBEAT_INTERVAL = 5.0 # seconds
+_WAIT_INTERVAL = 0.2 # seconds, for a worker to wait when there's nothing to lease yet
+_CHECK_INTERVAL = 0.5 # seconds, between checks for expired leases
+# An idle worker takes half of a lease still running if it has at least this many left.
+_MIN_STEAL = 2 # targets
+_LOCAL_WORKER_EXIT_TIMEOUT = 5.0 # seconds
+# Options that change the results, sent to every worker so they all scan alike.
+# The rest (engine, max_in_flight, rate limits...) are up to each worker.
+SHARED_OPTIONS = ('scan_software', 'scan_root', 'preserve_ips', 'max_body_bytes', 'probes',
+                  'follow_redirects')
+
+# {worker name: {'Hosts': int, 'Leases': int, 'Seconds': float, 'HostsPerSecond': float}}
+WORKER_STATS_TYPE = dict[str, dict[str, float]]
+
+
+class _Channel():
+    """JSON lines over a socket, each {"Type": ..., ...}. Any thread can send, one receives."""
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self._reader = sock.makefile('r', encoding='utf-8', newline='\n')
+        self._writer = sock.makefile('w', encoding='utf-8', newline='\n')
+        self._lock = threading.Lock()
+
+    def send(self, message_type: str, **fields) -> None:
+        line = json.dumps({'Type': message_type, **fields}) + '\n'
+        with self._lock:
+            self._writer.write(line)
+            self._writer.flush()
+
+    def receive(self) -> Optional[dict]:
+        """The next message, or None once the other end has closed."""
+        line = self._reader.readline()
+        return json.loads(line) if line else None
+
+    def close(self) -> None:
+        # Shut down first, closing the reader would wait for a thread blocked reading it.
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        for file in (self._reader, self._writer):
+            try:
+                file.close()
+            except OSError:
+                pass
+        self.sock.close()
+
+
+class _Lease():
+    """Targets handed out together. Only those without a result yet are kept."""
+    __slots__ = ('id', 'targets', 'worker')
+
+    def __init__(self, lease_id: int, targets: dict[int, str]) -> None:
+        self.id = lease_id
+        # {index in the input: ip}, in input order.
+        self.targets = targets
+        self.worker: Optional[_Worker] = None
+
+
+class _Worker():
+    """A connected worker, as the coordinator sees it."""
+    def __init__(self, name: str, channel: _Channel) -> None:
+        self.name = name
+        self.channel = channel
+        self.connected = self.last_seen = time.monotonic()
+        self.disconnected: Optional[float] = None
+        self.hosts = 0
+        self.leases = 0
+
+    def stats(self) -> dict[str, float]:
+        seconds = (self.disconnected or time.monotonic()) - self.connected
+        return {'Hosts': self.hosts, 'Leases': self.leases, 'Seconds': seconds,
+                'HostsPerSecond': self.hosts / seconds if seconds else 0.0}
+
+
+class Coordinator(ParallelScanner):
+    """Scans IPs on workers that connect over TCP. Takes the same kwargs as WebServerScanner.
+
+        IPs are read lazily into leases of lease_size. Each worker (see
+        run_worker, or the CLI's --worker) takes a lease at a time, scans it
+        with its own WebServerScanner and streams a result per target back.
+        A worker that disconnects, or is silent for lease_timeout, has what it
+        hadn't finished leased out again. When nothing is left to lease, an
+        idle worker takes the back half of the biggest lease still running,
+        so one slow worker can't hold up the end of the scan. A target's
+        first result is kept and any later ones (e.g. from a worker given up
+        on) are dropped, so each target is yielded exactly once.
+
+        local_workers worker processes are started on this machine, getting
+        every scanner kwarg. Remote workers get only SHARED_OPTIONS, and set
+        the rest themselves.
+    """
+    def __init__(self, ips: Iterable[str], address: tuple[str, int] = ('127.0.0.1', 0),
+                 lease_size: int = _DEFAULT_LEASE_SIZE,
+                 lease_timeout: float = _DEFAULT_LEASE_TIMEOUT, token: Optional[str] = None,
+                 local_workers: int = 0, **scanner_kwargs) -> None:
+        if lease_size < 1:
+            raise ValueError('lease_size must be at least 1.')
+        if lease_timeout <= 0:
+            raise ValueError('lease_timeout must be more than 0.')
+        if local_workers < 0:
+            raise ValueError('local_workers must be at least 0.')
+        if scanner_kwargs.get('dedup'):
+            # Workers must send a result per target for leases to finish.
+            raise ValueError('dedup is not supported with a coordinator.')
+        self.bind_address = address
+        self.lease_size = lease_size
+        self.lease_timeout = lease_timeout
+        self.token = token
+        self.local_workers = local_workers
+        self.shared_options = {name: scanner_kwargs[name] for name in SHARED_OPTIONS
+                               if name in scanner_kwargs}
+        if 'probes' in self.shared_options:
+            self.shared_options['probes'] = list(self.shared_options['probes'])
+        # Only local workers share this machine's rate limits.
+        super().__init__(ips, scanner_kwargs, local_workers)
+        # (host, port) listened on, once iter_scan has been called.
+        self.address: Optional[tuple[str, int]] = None
+        # Hosts, seconds and leases requeued (from lost or silent workers) or stolen.
+        self.scan_stats = {'Hosts': 0, 'Seconds': 0.0, 'HostsPerSecond': 0.0, 'Requeued': 0,
+                           'Stolen': 0}
+        self._changed = threading.Condition()
+        self._workers: list[_Worker] = []
+
+    @property
+    def worker_stats(self) -> WORKER_STATS_TYPE:
+        """Throughput of each worker that connected, by name."""
+        with self._changed:
+            return {worker.name: worker.stats() for worker in self._workers}
+
+    def iter_scan(self, ips: Optional[Iterable[str]] = None,
+                  order: str = 'input') -> Iterator[tuple[str, RESULT_TYPE]]:
+        """Yields (ip, result) as workers send them, like WebServerScanner.iter_scan.
+
+            Starts listening (and any local workers) straight away, so
+            self.address can be given to workers before iterating.
+
+            Raises:
+                ValueError: If the scanner kwargs indicate nothing to scan, or
+                    order is invalid.
+                OSError: If the address can't be listened on.
+        """
+        self._check_scan(order)
+        self._reset(self.ips if ips is None else ips)
+        server = socket.create_server(self.bind_address, backlog=128)
+        self.address = server.getsockname()[:2]
+        threading.Thread(target=self._accept, args=(server,), name='coordinator-accept',
+                         daemon=True).start()
+        logging.info(f'Coordinator listening on {self.address[0]}:{self.address[1]}.')
+        processes = self._start_local_workers()
+        return self._iter_scan(order, server, processes)
+
+    def _reset(self, ips: Iterable[str]) -> None:
+        with self._changed:
+            self._ips = iter(ips)
+            self._read = 0
+            self._exhausted = False
+            self._error: Optional[BaseException] = None
+            self._finished = False
+            self._lease_ids = itertools.count()
+            self._leases: dict[int, _Lease] = {}
+            self._pending: collections.deque[_Lease] = collections.deque()
+            # Lease of each target read but without a result yet.
+            self._owner: dict[int, _Lease] = {}
+            self._results: dict[int, tuple[str, RESULT_TYPE]] = {}
+            self._workers = []
+            self.scan_stats.update(Hosts=0, Seconds=0.0, HostsPerSecond=0.0, Requeued=0,
+                                   Stolen=0)
+
+    def _iter_scan(self, order: str, server: socket.socket,
+                   processes: list[multiprocessing.Process]
+                   ) -> Iterator[tuple[str, RESULT_TYPE]]:
+        started = time.monotonic()
+        next_index = 0
+        try:
+            while True:
+                with self._changed:
+                    self._changed.wait_for(
+                        lambda: (next_index in self._results if order == 'input'
+                                 else self._results)
+                        or self._error is not None or (self._exhausted and not self._owner),
+                        _CHECK_INTERVAL)
+                    if self._error is not None:
+                        raise self._error
+                    self._expire_leases()
+                    if order == 'completion':
+                        ready = list(self._results.values())
+                        self._results.clear()
+                    else:
+                        ready = []
+                        while next_index in self._results:
+                            ready.append(self._results.pop(next_index))
+                            next_index += 1
+                    done = self._exhausted and not self._owner and not self._results
+                self.scan_stats['Hosts'] += len(ready)
+                yield from ready
+                if done:
+                    return
+        finally:
+            with self._changed:
+                self._finished = True
+                workers = list(self._workers)
+            server.close()
+            for worker in workers:
+                if worker.disconnected is None:
+                    _send_in_background(worker, 'done')
+            for process in processes:
+                process.join(_LOCAL_WORKER_EXIT_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+            seconds = time.monotonic() - started
+            self.scan_stats['Seconds'] = seconds
+            self.scan_stats['HostsPerSecond'] = self.scan_stats['Hosts'] / seconds
+            for name, stats in self.worker_stats.items():
+                logging.info(f'Worker {name} scanned {stats["Hosts"]} hosts at '
+                             f'{stats["HostsPerSecond"]:.1f} hosts/s.')
+
+    def _start_local_workers(self) -> list[multiprocessing.Process]:
+        host, port = self.address
+        # Listening on every interface, local workers connect over loopback.
+        if host in ('', '0.0.0.0'):
+            host = '127.0.0.1'
+        processes = []
+        for i in range(self.local_workers):
+            # Pickled, so each worker opens its own connections (e.g. a ResultCache's)
+            # rather than sharing this process's across the fork.
+            process = multiprocessing.Process(
+                target=_run_local_worker,
+                args=((host, port), self.token, pickle.dumps(self.scanner_kwargs)),
+                name=f'scanner-worker-{i}', daemon=True)
+            process.start()
+            processes.append(process)
+        return processes
+
+    def _accept(self, server: socket.socket) -> None:
+        while True:
+            try:
+                sock, peer = server.accept()
+            except OSError:
+                # Closed at the end of the scan.
+                return
+            threading.Thread(target=self._serve, args=(sock, peer),
+                             name=f'coordinator-{peer[0]}:{peer[1]}', daemon=True).start()
+
+    def _serve(self, sock: socket.socket, peer: tuple[str, int]) -> None:
+        """Talks to one worker until it disconnects, then requeues what it hadn't finished."""
+        channel = _Channel(sock)
+        worker = None
+        try:
+            hello = channel.receive()
+            if hello is None or hello.get('Type') != 'hello' or not self._authorized(hello):
+                logging.warning(f'Refused worker at {peer[0]}:{peer[1]}.')
+                return
+            with self._changed:
+                names = {worker.name for worker in self._workers}
+                name = str(hello.get('Worker') or f'{peer[0]}:{peer[1]}')
+                if name in names:
+                    name = f'{name}#{len(self._workers)}'
+                worker = _Worker(name, channel)
+                self._workers.append(worker)
+            logging.info(f'Worker {name} connected from {peer[0]}:{peer[1]}.')
+            channel.send('options', Options=self.shared_options,
+                         Metrics=self.metrics is not None)
+            while (message := channel.receive()) is not None:
+                self._handle(worker, message)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f'Dropping worker at {peer[0]}:{peer[1]}: {e!r}.')
+        finally:
+            if worker is not None:
+                with self._changed:
+                    worker.disconnected = time.monotonic()
+                    self._requeue(lambda lease: lease.worker is worker)
+                    self._changed.notify_all()
+            channel.close()
+
+    def _authorized(self, hello: dict) -> bool:
+        if self.token is None:
+            return True
+        return hmac.compare_digest(str(hello.get('Token') or ''), self.token)
+
+    def _handle(self, worker: _Worker, message: dict) -> None:
+        message_type = message['Type']
+        # (worker, type, fields) to send once the lock is released, a worker
+        # slow to read them mustn't hold up the others.
+        outbox: list[tuple[_Worker, str, dict]] = []
+        with self._changed:
+            worker.last_seen = time.monotonic()
+            if message_type == 'lease':
+                lease = None if self._finished else self._take_lease(worker, outbox)
+                if lease is not None:
+                    worker.leases += 1
+                    outbox.append((worker, 'lease', {'Lease': lease.id,
+                                                     'Targets': list(lease.targets.items())}))
+                elif self._finished or (self._exhausted and not self._owner):
+                    outbox.append((worker, 'done', {}))
+                else:
+                    outbox.append((worker, 'wait', {'Seconds': _WAIT_INTERVAL}))
+            elif message_type == 'result':
+                lease = self._owner.pop(message['Index'], None)
+                if lease is None:
+                    # Already in from another worker.
+                    return
+                del lease.targets[message['Index']]
+                if not lease.targets:
+                    self._leases.pop(lease.id, None)
+                self._results[message['Index']] = (message['Ip'], load_result(message['Result']))
+                worker.hosts += 1
+                self._changed.notify_all()
+            elif message_type == 'complete':
+                self._add_cache_stats(message.get('Cache'))
+                if message.get('Metrics') is not None and self.metrics is not None:
+                    self.metrics.merge_state(_load_metrics(message['Metrics']))
+                lease = self._leases.get(message['Lease'])
+                if lease is not None and lease.worker is worker:
+                    logging.warning(f'Worker {worker.name} left {len(lease.targets)} targets '
+                                    f'of lease {lease.id} unscanned.')
+                    self._requeue(lambda other: other is lease)
+        for recipient, message_type, fields in outbox:
+            if recipient is worker:
+                worker.channel.send(message_type, **fields)
+            else:
+                # It may be the stalled worker this one is stealing from.
+                _send_in_background(recipient, message_type, **fields)
+
+    def _take_lease(self, worker: _Worker,
+                    outbox: list[tuple[_Worker, str, dict]]) -> Optional[_Lease]:
+        """Next lease for worker: a requeued one, new targets, or half of a running one."""
+        if not self._pending and not self._exhausted:
+            try:
+                ips = list(itertools.islice(self._ips, self.lease_size))
+            except Exception as e:
+                # Raised by the caller's iterator, passed on to them.
+                self._error = e
+                self._exhausted = True
+                self._changed.notify_all()
+                return None
+            if len(ips) < self.lease_size:
+                self._exhausted = True
+            if ips:
+                self._pending.append(self._new_lease(dict(enumerate(ips, self._read))))
+                self._read += len(ips)
+        lease = self._pending.popleft() if self._pending else self._steal(worker, outbox)
+        if lease is not None:
+            lease.worker = worker
+        return lease
+
+    def _new_lease(self, targets: dict[int, str]) -> _Lease:
+        lease = _Lease(next(self._lease_ids), targets)
+        self._leases[lease.id] = lease
+        for index in targets:
+            self._owner[index] = lease
+        return lease
+
+    def _steal(self, worker: _Worker,
+               outbox: list[tuple[_Worker, str, dict]]) -> Optional[_Lease]:
+        """Moves the back half of the biggest running lease to a new one, or returns None.
+
+            The worker running it is told to skip those targets, by a revoke
+            added to outbox. Any it already started are still accepted from
+            whichever worker is first.
+        """
+        victim = max((lease for lease in self._leases.values()
+                      if lease.worker is not None and lease.worker is not worker),
+                     key=lambda lease: len(lease.targets), default=None)
+        if victim is None or len(victim.targets) < _MIN_STEAL:
+            return None
+        indexes = list(victim.targets)[len(victim.targets) // 2:]
+        stolen = self._new_lease({index: victim.targets.pop(index) for index in indexes})
+        self.scan_stats['Stolen'] += 1
+        logging.info(f'Worker {worker.name} took {len(indexes)} targets from '
+                     f'{victim.worker.name}.')
+        outbox.append((victim.worker, 'revoke', {'Lease': victim.id, 'Indexes': indexes}))
+        return stolen
+
+    def _expire_leases(self) -> None:
+        deadline = time.monotonic() - self.lease_timeout
+        self._requeue(lambda lease: lease.worker is not None
+                      and lease.worker.last_seen < deadline)
+
+    def _requeue(self, matches) -> None:
+        """Puts running leases that match back at the front of the queue."""
+        for lease in [lease for lease in self._leases.values() if lease.worker is not None
+                      and matches(lease)]:
+            logging.warning(f'Requeueing {len(lease.targets)} targets of lease {lease.id} '
+                            f'from worker {lease.worker.name}.')
+            lease.worker = None
+            self._pending.appendleft(lease)
+            self.scan_stats['Requeued'] += 1
+
+
+def run_worker(address: tuple[str, int], token: Optional[str] = None,
+               name: Optional[str] = None, **scanner_kwargs) -> dict[str, float]:
+    """Connects to a Coordinator and scans leases from it until it says the scan is done.
+
+        scanner_kwargs are as for WebServerScanner, the coordinator's
+        SHARED_OPTIONS override them. This worker's metrics are merged into
+        their metrics, if any. Returns this worker's hosts, seconds and hosts
+        per second.
+
+        Raises:
+            ConnectionError: If the coordinator refused the connection.
+            OSError: If it can't be reached.
+    """
+    channel = _Channel(socket.create_connection(address))
+    name = name or f'{socket.gethostname()}:{os.getpid()}'
+    started = time.monotonic()
+    hosts = 0
+    local_metrics: Optional[scan_metrics.ScanMetrics] = scanner_kwargs.get('metrics')
+    stop = threading.Event()
+    try:
+        channel.send('hello', Worker=name, Token=token)
+        message = channel.receive()
+        if message is None or message['Type'] != 'options':
+            raise ConnectionError('The coordinator refused this worker.')
+        collect_metrics = message['Metrics']
+        # A result per target, the coordinator keeps track of which are done.
+        scanner = WebServerScanner([], **{**scanner_kwargs, **message['Options'],
+                                          'metrics': None, 'dedup': False})
+        inbox: queue.Queue = queue.Queue()
+        revoked: set[int] = set()
+        threading.Thread(target=_receive_messages, args=(channel, inbox, revoked),
+                         name='worker-receive', daemon=True).start()
+        threading.Thread(target=_send_heartbeats, args=(channel, stop), name='worker-heartbeat',
+                         daemon=True).start()
+        while True:
+            channel.send('lease')
+            message = inbox.get()
+            if message is None:
+                logging.warning('Lost the coordinator.')
+                break
+            if message['Type'] == 'done':
+                break
+            if message['Type'] == 'wait':
+                time.sleep(message['Seconds'])
+                continue
+            revoked.clear()
+            # Sent with each lease, so the coordinator's totals are only what's new.
+            scanner.metrics = (scan_metrics.ScanMetrics()
+                               if collect_metrics or local_metrics is not None else None)
+            cache_before = scanner.cache.stats() if scanner.cache is not None else None
+            hosts += _scan_lease(scanner, channel, message['Targets'], revoked)
+            cache = None
+            if cache_before is not None:
+                cache = {key: value - cache_before[key]
+                         for key, value in scanner.cache.stats().items()}
+            if local_metrics is not None:
+                local_metrics.merge(scanner.metrics)
+            metrics = _dump_metrics(scanner.metrics) if collect_metrics else None
+            channel.send('complete', Lease=message['Lease'], Cache=cache, Metrics=metrics)
+    finally:
+        stop.set()
+        channel.close()
+    seconds = time.monotonic() - started
+    logging.info(f'Worker {name} scanned {hosts} hosts in {seconds:.2f}s.')
+    return {'Hosts': hosts, 'Seconds': seconds, 'HostsPerSecond': hosts / seconds}
+
+
+def _run_local_worker(address: tuple[str, int], token: Optional[str],
+                      pickled_kwargs: bytes) -> None:
+    run_worker(address, token, **pickle.loads(pickled_kwargs))
+
+
+def _scan_lease(scanner: WebServerScanner, channel: _Channel, targets: list[list],
+                revoked: set[int]) -> int:
+    """Scans [index, ip] targets, skipping revoked ones, and sends each result. Returns how many."""
+    # Results come back by key, in whatever order the scanner finishes them.
+    indexes: dict[str, collections.deque[int]] = collections.defaultdict(collections.deque)
+
+    def pending() -> Iterator[str]:
+        for index, ip in targets:
+            if index not in revoked:
+                indexes[scanner.output_key(ip)].append(index)
+                yield ip
+
+    sent = 0
+    for ip, result in scanner.iter_scan(pending()):
+        channel.send('result', Index=indexes[ip].popleft(), Ip=ip, Result=dump_result(result))
+        sent += 1
+    return sent
+
+
+def _send_in_background(worker: _Worker, message_type: str, **fields) -> None:
+    """Sends to a worker without waiting, in case it has stopped reading."""
+    def send() -> None:
+        try:
+            worker.channel.send(message_type, **fields)
+        except (OSError, ValueError):
+            # It's gone, its other targets are requeued when its thread notices.
+            pass
+
+    threading.Thread(target=send, name=f'coordinator-send-{worker.name}', daemon=True).start()
+
+
+def _dump_metrics(metrics: scan_metrics.ScanMetrics) -> dict:
+    """ScanMetrics state as JSON-able dicts, see _load_metrics."""
+    state = metrics.__getstate__()
+    return {'Phases': {phase: {'Buckets': histogram.buckets, 'Count': histogram.count,
+                               'Sum': histogram.sum}
+                       for phase, histogram in state['phases'].items()},
+            'Statuses': dict(state['statuses']), 'Errors': dict(state['errors'])}
+
+
+def _load_metrics(dumped: dict) -> dict:
+    """State for ScanMetrics.merge_state from _dump_metrics' output."""
+    phases = {}
+    for phase, values in dumped['Phases'].items():
+        histogram = phases[phase] = scan_metrics.Histogram()
+        histogram.buckets = values['Buckets']
+        histogram.count = values['Count']
+        histogram.sum = values['Sum']
+    return {'phases': phases, 'statuses': dumped['Statuses'], 'errors': dumped['Errors']}
+
+
+def _receive_messages(channel: _Channel, inbox: queue.Queue, revoked: set[int]) -> None:
+    """Handles revokes as they come, while a lease is being scanned. Queues the rest."""
+    try:
+        while (message := channel.receive()) is not None:
+            if message['Type'] == 'revoke':
+                revoked.update(message['Indexes'])
+            else:
+                inbox.put(message)
+    except (OSError, ValueError):
+        pass
+    finally:
+        inbox.put(None)
+
+
+def _send_heartbeats(channel: _Channel, stop: threading.Event) -> None:
+    """Tells the coordinator this worker is alive while a slow lease is scanned."""
+    while not stop.wait(_HEARTBEAT_INTERVAL):
+        try:
+            channel.send('heartbeat')
+        except (OSError, ValueError):
+            return
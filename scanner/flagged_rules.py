@@ -0,0 +1,211 @@
+"Loads flagged server software rules and compiles them into an index for Server headers."
+import bisect
+import fnmatch
+import functools
+import hashlib
+import json
+import math
+import re
+from typing import Iterable, Optional
+
+from utils import WebSrvEnum, NGINX_FLAGGED_VERSIONS, IIS_FLAGGED_VERSIONS
+
+# A rule as written in a rules file:
+# {"product": "nginx", "flag_as": "nginx", "versions": ["1.2", "1.3.*", ">=1.4,<1.6"]}
+RULE_TYPE = dict[str, object]
+VERSION_TYPE = tuple[int, ...]
+
+_CACHE_SIZE = 4096
+_FINGERPRINT_CHARS = 16
+_FLAGGABLE = (WebSrvEnum.nginx, WebSrvEnum.iis)
+# Server header product names for the defaults in utils.
+_DEFAULT_PRODUCTS = {WebSrvEnum.nginx: 'nginx', WebSrvEnum.iis: 'Microsoft-IIS'}
+_VERSION_PATTERN = re.compile(r'\d+(?:\.\d+)*')
+_COMPARATOR_PATTERN = re.compile(r'^(>=|<=|>|<|==)\s*(\d+(?:\.\d+)*)$')
+_WILDCARD_CHARS = ('*', '?', '[')
+# Bounds are keyed as (version, side) so inclusive and exclusive ends sort
+# correctly around a looked up version, which is keyed as (version, 1).
+_LOWER_INCLUSIVE, _POINT, _LOWER_EXCLUSIVE = 0, 1, 2
+_UPPER_EXCLUSIVE, _UPPER_INCLUSIVE = 0, 2
+_UNBOUNDED_LOW: VERSION_TYPE = ()
+_UNBOUNDED_HIGH = (math.inf,)
+
+
+def default_rules() -> list[RULE_TYPE]:
+    """The built in rules, from the flagged versions in utils."""
+    return [{'product': _DEFAULT_PRODUCTS[software], 'flag_as': software.name,
+             'versions': list(versions)}
+            for software, versions in ((WebSrvEnum.nginx, NGINX_FLAGGED_VERSIONS),
+                                       (WebSrvEnum.iis, IIS_FLAGGED_VERSIONS))]
+
+
+def parse_server_header(server_field: str) -> tuple[str, str]:
+    """Splits e.g. 'Apache/2.4.1 (Unix)' into ('apache', '2.4.1'). Version may be ''."""
+    product, _, version = server_field.strip().split(' ', 1)[0].partition('/')
+    return product.lower(), version
+
+
+class _ProductRules():
+    """Every version spec for one product, compiled so a lookup doesn't depend on how many."""
+    def __init__(self, flag_as: WebSrvEnum) -> None:
+        self.flag_as = flag_as
+        self.prefixes: set[VERSION_TYPE] = set()
+        # Patterns are bucketed by their first version component when it has
+        # no wildcards, so a lookup only tries the ones that could match.
+        self.patterns: dict[Optional[str], list[str]] = {}
+        self.ranges: list[tuple[tuple, tuple]] = []
+        self.pattern_regexes: dict[Optional[str], re.Pattern] = {}
+        self.range_lows: list[tuple] = []
+        self.range_highs: list[tuple] = []
+
+    def add(self, spec: str) -> None:
+        """Adds a version spec. Raises ValueError if it can't be parsed.
+
+            '1.2' matches 1.2 and anything under it (1.2.1), like the original
+            major.minor check. '1.2.*' and friends are fnmatch patterns on the
+            version string. '>=1.3,<1.5' is a range, trailing zeros ignored.
+        """
+        spec = spec.strip()
+        if any(char in spec for char in _WILDCARD_CHARS):
+            first, sep, _ = spec.partition('.')
+            bucket = first if sep and not any(char in first for char in _WILDCARD_CHARS) else None
+            self.patterns.setdefault(bucket, []).append(spec)
+        elif spec[:1] in ('<', '>', '='):
+            self.ranges.append(_parse_range(spec))
+        elif _VERSION_PATTERN.fullmatch(spec):
+            self.prefixes.add(_to_version(spec))
+        else:
+            raise ValueError(f'Invalid version spec: {spec}')
+
+    def compile(self) -> None:
+        self.pattern_regexes = {bucket: re.compile('|'.join(fnmatch.translate(pattern)
+                                                            for pattern in patterns))
+                                for bucket, patterns in self.patterns.items()}
+        # Merge overlapping ranges so one bisect answers any lookup.
+        merged: list[list[tuple]] = []
+        for low, high in sorted(self.ranges):
+            if merged and low <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], high)
+            else:
+                merged.append([low, high])
+        self.range_lows = [low for low, _ in merged]
+        self.range_highs = [high for _, high in merged]
+
+    def matches(self, version: str) -> bool:
+        for bucket in (version.partition('.')[0], None):
+            regex = self.pattern_regexes.get(bucket)
+            if regex and regex.match(version):
+                return True
+        numeric = _VERSION_PATTERN.match(version)
+        if not numeric:
+            return False
+        parsed = _to_version(numeric.group())
+        if any(parsed[:i] in self.prefixes for i in range(1, len(parsed) + 1)):
+            return True
+        if self.range_lows:
+            key = (_strip_zeros(parsed), _POINT)
+            i = bisect.bisect_right(self.range_lows, key) - 1
+            return i >= 0 and key <= self.range_highs[i]
+        return False
+
+
+class RuleIndex():
+    """Classifies Server headers against flagged rules with one dict lookup per header.
+
+        Results are cached by header string, since a big scan sees far fewer
+        distinct headers than hosts. Picklable, so it can go to worker processes.
+    """
+    def __init__(self, rules: Optional[Iterable[RULE_TYPE]] = None) -> None:
+        self.rules = list(default_rules() if rules is None else rules)
+        # Tells rule sets apart in cache keys, the same for the same rules in any run.
+        rules_json = json.dumps(self.rules, sort_keys=True, default=str)
+        self.fingerprint = hashlib.sha256(rules_json.encode()).hexdigest()[:_FINGERPRINT_CHARS]
+        self._products: dict[str, _ProductRules] = {}
+        for rule in self.rules:
+            self._add_rule(rule)
+        for product_rules in self._products.values():
+            product_rules.compile()
+        self.classify = functools.lru_cache(maxsize=_CACHE_SIZE)(self._classify)
+
+    @classmethod
+    def from_file(cls, path: str) -> 'RuleIndex':
+        """Loads a JSON list of rules. Raises OSError or ValueError."""
+        with open(path, 'r') as file:
+            rules = json.load(file)
+        if not isinstance(rules, list):
+            raise ValueError(f'{path} should contain a list of rules.')
+        return cls(rules)
+
+    def __getstate__(self) -> dict:
+        return {'rules': self.rules}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['rules'])
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def _classify(self, server_field: str) -> WebSrvEnum:
+        """Returns the flagged WebSrvEnum for a Server header, or WebSrvEnum.other."""
+        product, version = parse_server_header(server_field)
+        product_rules = self._products.get(product)
+        if product_rules and version and product_rules.matches(version):
+            return product_rules.flag_as
+        return WebSrvEnum.other
+
+    def _add_rule(self, rule: RULE_TYPE) -> None:
+        try:
+            product = str(rule['product']).lower()
+            flag_as = WebSrvEnum[rule['flag_as']]
+            versions = rule['versions']
+        except (KeyError, TypeError) as e:
+            raise ValueError(f'Invalid rule {rule}, needs product, flag_as and versions.') from e
+        if flag_as not in _FLAGGABLE:
+            raise ValueError(f'Invalid rule {rule}, flag_as must be one of '
+                             f'{[software.name for software in _FLAGGABLE]}.')
+        if isinstance(versions, str):
+            versions = [versions]
+        if not isinstance(versions, list) or not all(isinstance(v, str) for v in versions):
+            raise ValueError(f'Invalid rule {rule}, versions must be a list of strings.')
+        product_rules = self._products.setdefault(product, _ProductRules(flag_as))
+        if product_rules.flag_as != flag_as:
+            raise ValueError(f'{rule["product"]} is flagged as both '
+                             f'{product_rules.flag_as.name} and {flag_as.name}.')
+        for spec in versions:
+            product_rules.add(spec)
+
+
+def _to_version(version: str) -> VERSION_TYPE:
+    return tuple(int(part) for part in version.split('.'))
+
+
+def _strip_zeros(version: VERSION_TYPE) -> VERSION_TYPE:
+    """So 1.2 and 1.2.0 compare equal in ranges."""
+    end = len(version)
+    while end and version[end - 1] == 0:
+        end -= 1
+    return version[:end]
+
+
+def _parse_range(spec: str) -> tuple[tuple, tuple]:
+    """Parses e.g. '>=1.3,<1.5' into (low key, high key). Raises ValueError."""
+    low, high = (_UNBOUNDED_LOW, _LOWER_INCLUSIVE), (_UNBOUNDED_HIGH, _UPPER_INCLUSIVE)
+    for comparator in spec.split(','):
+        match = _COMPARATOR_PATTERN.match(comparator.strip())
+        if not match:
+            raise ValueError(f'Invalid version range: {spec}')
+        op, version = match.group(1), _strip_zeros(_to_version(match.group(2)))
+        if op in ('>=', '=='):
+            low = max(low, (version, _LOWER_INCLUSIVE))
+        if op == '>':
+            low = max(low, (version, _LOWER_EXCLUSIVE))
+        if op in ('<=', '=='):
+            high = min(high, (version, _UPPER_INCLUSIVE))
+        if op == '<':
+            high = min(high, (version, _UPPER_EXCLUSIVE))
+    if low > high:
+        raise ValueError(f'Version range {spec} is empty.')
+    return low, high
+
+
+DEFAULT_RULES = RuleIndex()
@@ -0,0 +1,141 @@
+"Runs scans in the background on a fixed pool of threads, for the API."
+import logging
+import queue
+import threading
+import time
+import uuid
+from typing import Iterator, Optional
+
+from web_server_scanner import RESULT_TYPE
+
+_DEFAULT_WORKERS = 4
+_DEFAULT_MAX_QUEUED = 100
+_DEFAULT_KEEP_FINISHED_FOR = 3600 # seconds
+_WAIT_INTERVAL = 1.0 # seconds, between checks while waiting on a running job
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class QueueFullError(Exception):
+    """Raised by submit when max_queued jobs are already waiting."""
+
+
+class Job():
+    """One scan. Results are kept in input order and can be read while it runs."""
+    def __init__(self, results: Iterator[tuple[str, RESULT_TYPE]], total: int) -> None:
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.total = total
+        self.error: Optional[str] = None
+        self.submitted = time.time()
+        self.finished: Optional[float] = None
+        self.results: list[tuple[str, RESULT_TYPE]] = []
+        self._pending = results
+        self._changed = threading.Condition()
+
+    @property
+    def finished_running(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def run(self) -> None:
+        self._set_status(RUNNING)
+        try:
+            for ip, result in self._pending:
+                with self._changed:
+                    self.results.append((ip, result))
+                    self._changed.notify_all()
+        except Exception as e:
+            logging.exception(f'Job {self.id} failed.')
+            self.error = str(e)
+            self._set_status(FAILED)
+        else:
+            self._set_status(DONE)
+        finally:
+            self._pending = None
+
+    def summary(self) -> dict:
+        return {'JobId': self.id, 'Status': self.status, 'Total': self.total,
+                'Completed': len(self.results), 'Error': self.error}
+
+    def page(self, offset: int, limit: int) -> dict:
+        """Summary plus results[offset:offset + limit] as {ip: result}."""
+        page = self.results[offset:offset + limit]
+        next_offset = offset + len(page)
+        return {**self.summary(), 'Offset': offset, 'Results': dict(page),
+                'NextOffset': next_offset if next_offset < self.total else None}
+
+    def iter_results(self, offset: int = 0) -> Iterator[tuple[str, RESULT_TYPE]]:
+        """Yields results from offset on, waiting for new ones until the job finishes."""
+        while True:
+            with self._changed:
+                while offset >= len(self.results) and not self.finished_running:
+                    self._changed.wait(_WAIT_INTERVAL)
+                available = self.results[offset:]
+                finished = self.finished_running
+            yield from available
+            offset += len(available)
+            if finished and offset >= len(self.results):
+                return
+
+    def _set_status(self, status: str) -> None:
+        with self._changed:
+            self.status = status
+            if self.finished_running:
+                self.finished = time.time()
+            self._changed.notify_all()
+
+
+class JobQueue():
+    """At most max_queued jobs wait for one of workers threads, each running one job at a time.
+
+        A huge job only ever holds one worker, so it can slow others down but
+        not stop them. Finished jobs are forgotten after keep_finished_for.
+    """
+    def __init__(self, workers: int = _DEFAULT_WORKERS, max_queued: int = _DEFAULT_MAX_QUEUED,
+                 keep_finished_for: float = _DEFAULT_KEEP_FINISHED_FOR) -> None:
+        if workers < 1:
+            raise ValueError('workers must be at least 1.')
+        if max_queued < 1:
+            raise ValueError('max_queued must be at least 1.')
+        self.workers = workers
+        self.max_queued = max_queued
+        self.keep_finished_for = keep_finished_for
+        self._queue: queue.Queue[Job] = queue.Queue(maxsize=max_queued)
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f'scan-job-worker-{i}', daemon=True).start()
+
+    def submit(self, results: Iterator[tuple[str, RESULT_TYPE]], total: int) -> Job:
+        """Queues a job over results, e.g. from iter_scan. Raises QueueFullError."""
+        job = Job(results, total)
+        self._forget_finished()
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFullError(f'{self.max_queued} jobs are already queued.') from None
+            self._jobs[job.id] = job
+        logging.info(f'Queued job {job.id} with {total} targets.')
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status.capitalize(): statuses.count(status)
+                for status in (QUEUED, RUNNING, DONE, FAILED)}
+
+    def _work(self) -> None:
+        while True:
+            self._queue.get().run()
+
+    def _forget_finished(self) -> None:
+        cutoff = time.time() - self.keep_finished_for
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job.finished is not None and job.finished < cutoff]:
+                del self._jobs[job_id]
@@ -0,0 +1,95 @@
+"Opt-in cache of scan results: an in-process LRU in front of a SQLite file, with TTLs per status."
+import collections
+import time
+from typing import Optional
+
+from sqlite_store import SQLiteStore
+from utils import WebSrvEnum, DirListEnum, StatusEnum
+
+# Statuses not listed aren't cached. Errors expire sooner as they're often transient.
+DEFAULT_TTLS = {StatusEnum.good: 3600, StatusEnum.response_err: 300} # seconds
+_DEFAULT_MAX_ENTRIES = 100000
+
+# {'WebServerSoftware': enum, 'RootListing': enum, 'Status': enum, 'ErrorMsg': str}
+CACHED_RESULT_TYPE = dict[str, object]
+
+
+class ResultCache(SQLiteStore):
+    """Maps a cache key (normalized target + scan options) to its last result until it expires.
+
+        Can be shared between threads. Picklable, each process gets its own
+        connection and LRU but the same SQLite file.
+    """
+    def __init__(self, path: str = ':memory:', ttls: Optional[dict[StatusEnum, float]] = None,
+                 max_entries: int = _DEFAULT_MAX_ENTRIES) -> None:
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least 1.')
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lru: collections.OrderedDict[str, tuple[float, CACHED_RESULT_TYPE]] = \
+            collections.OrderedDict()
+        super().__init__(path, 'CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, '
+                         'software TEXT, root_listing TEXT, status TEXT, error_msg TEXT, '
+                         'expires REAL)')
+
+    def __getstate__(self) -> dict:
+        return {'path': self.path, 'ttls': self.ttls, 'max_entries': self.max_entries}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['path'], state['ttls'], state['max_entries'])
+
+    def get(self, key: str) -> Optional[CACHED_RESULT_TYPE]:
+        """Returns a copy of the cached result for key, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                row = self._db.execute('SELECT software, root_listing, status, error_msg, '
+                                       'expires FROM results WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    entry = (row[4], {'WebServerSoftware': WebSrvEnum[row[0]],
+                                      'RootListing': DirListEnum[row[1]],
+                                      'Status': StatusEnum[row[2]],
+                                      'ErrorMsg': row[3]})
+                    self._remember(key, entry)
+            else:
+                self._lru.move_to_end(key)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, key: str, result: CACHED_RESULT_TYPE) -> None:
+        """Caches result for its status' TTL. Does nothing if the status has no TTL."""
+        ttl = self.ttls.get(result['Status'])
+        if ttl is None:
+            return
+        expires = time.time() + ttl
+        entry = (expires, {name: result[name] for name in ('WebServerSoftware', 'RootListing',
+                                                            'Status', 'ErrorMsg')})
+        with self._lock:
+            self._remember(key, entry)
+            self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                             (key, result['WebServerSoftware'].name, result['RootListing'].name,
+                              result['Status'].name, result['ErrorMsg'], expires))
+            self._wrote()
+
+    def purge_expired(self) -> int:
+        """Deletes expired rows from the file. Returns how many."""
+        with self._lock:
+            deleted = self._db.execute('DELETE FROM results WHERE expires <= ?',
+                                       (time.time(),)).rowcount
+            self._commit()
+        return deleted
+
+    def stats(self) -> dict[str, int]:
+        return {'Hits': self.hits, 'Misses': self.misses}
+
+    def _remember(self, key: str, entry: tuple[float, CACHED_RESULT_TYPE]) -> None:
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
@@ -0,0 +1,249 @@
+"Columnar store of scan results, read as a {ip: result} dict, and packing of target keys."
+import bisect
+import collections.abc
+import itertools
+import re
+from array import array
+from typing import Iterable, Iterator, Optional
+
+from utils import WebSrvEnum, DirListEnum, StatusEnum
+
+_ENUM_COLUMNS = (('WebServerSoftware', WebSrvEnum), ('RootListing', DirListEnum),
+                 ('Status', StatusEnum))
+_MEMBERS = tuple(list(enum) for _, enum in _ENUM_COLUMNS)
+# By name, so members of another import of utils (e.g. scanner.utils) match too.
+_CODES = tuple({member.name: code for code, member in enumerate(members)} for members in _MEMBERS)
+_DIR_LIST_MEMBERS = _MEMBERS[1]
+_DIR_LIST_CODES = _CODES[1]
+_SCHEMES = ('', 'http://', 'https://')
+_PACKABLE_KEY = re.compile(r'(https?://)?(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})'
+                           r'(?::([1-9]\d{0,4}))?')
+_MAX_PORT = 65535
+# Cached column, no 'Cached' key when the scanner had no cache.
+_NOT_CACHED, _CACHED, _NO_CACHE = 0, 1, 2
+# Keys added since the sorted index was built are looked up in a dict, until
+# there are more than this many or a 16th of the index, then merged into it.
+_MIN_RECENT = 1024
+_RECENT_SHIFT = 4
+
+
+def pack_key(ip: str) -> Optional[int]:
+    """Packs a canonical (http(s)://)IPv4(:port) into an int, or None if it can't be.
+
+        Canonical means it round trips exactly, so e.g. 010.0.0.1 or :080
+        aren't packed. The int is address << 18 | port << 2 | scheme, with
+        port 0 for none and scheme the index in ('', 'http://', 'https://').
+    """
+    match = _PACKABLE_KEY.fullmatch(ip)
+    if match is None:
+        return None
+    scheme, *octets, port = match.groups()
+    address = 0
+    for octet in octets:
+        if (len(octet) > 1 and octet[0] == '0') or int(octet) > 255:
+            return None
+        address = address << 8 | int(octet)
+    port = int(port) if port else 0
+    if port > _MAX_PORT:
+        return None
+    return address << 18 | port << 2 | _SCHEMES.index(scheme or '')
+
+
+def unpack_key(packed: int) -> str:
+    """Reverses pack_key."""
+    address, port = packed >> 18, packed >> 2 & 0xFFFF
+    host = f'{address >> 24}.{address >> 16 & 255}.{address >> 8 & 255}.{address & 255}'
+    return f'{_SCHEMES[packed & 3]}{host}:{port}' if port else f'{_SCHEMES[packed & 3]}{host}'
+
+
+
+class _ItemsView(collections.abc.ItemsView):
+    def __iter__(self) -> Iterator[tuple[str, dict]]:
+        return self._mapping._iter_items()
+
+
+class _ValuesView(collections.abc.ValuesView):
+    def __iter__(self) -> Iterator[dict]:
+        for _, result in self._mapping._iter_items():
+            yield result
+
+
+class ResultStore(dict):
+    """Results packed into arrays, around 30 bytes a host, read as a {ip: result} dict.
+
+        Keys that pack_key can pack are stored as one int, anything else
+        (e.g. a bad IP) as its string. Each enum is a byte, and error
+        messages and probes are stored once however many hosts share them.
+        Reading a key builds its result dict, so changing that dict doesn't
+        change the store. Adding a key again replaces its result but keeps
+        its position, like a dict, so iteration is in the order keys were
+        first added.
+
+        It's a dict, so json.dumps and flask.jsonify take it as is, but a
+        read-only one: use add(). The results aren't in the dict itself,
+        only the first key is, because the json module's C encoder checks
+        the dict's own size before asking for its items.
+    """
+    def __init__(self, results: Iterable[tuple[str, dict]] = ()) -> None:
+        super().__init__()
+        # Per row: packed key, or -1 - index into _other_keys.
+        self._keys = array('q')
+        self._enum_codes = tuple(array('B') for _ in _ENUM_COLUMNS)
+        self._message_codes = array('I')
+        self._cached = array('B')
+        self._messages: list[Optional[str]] = [None]
+        self._message_codes_by_text: dict[Optional[str], int] = {None: 0}
+        # Probes likewise, as ((path, DirListEnum code), ...). 0 for no Probes key.
+        self._probe_codes = array('I')
+        self._probe_sets: list[Optional[tuple[tuple[str, int], ...]]] = [None]
+        self._probe_codes_by_set: dict[Optional[tuple], int] = {None: 0}
+        self._other_keys: list[str] = []
+        self._other_codes: dict[str, int] = {}
+        # Rows sorted by key, and {key: row} for those added since it was sorted.
+        self._index = array('I')
+        self._recent: dict[int, int] = {}
+        for ip, result in results:
+            self.add(ip, result)
+
+    def add(self, ip: str, result: dict) -> None:
+        """Stores result (as yielded by iter_scan) under ip."""
+        key = pack_key(ip)
+        if key is None:
+            key = -1 - self._other_codes.setdefault(ip, len(self._other_keys))
+            if -1 - key == len(self._other_keys):
+                self._other_keys.append(ip)
+        probes = result.get('Probes')
+        if probes is not None:
+            probes = tuple((path, _DIR_LIST_CODES[listing.name])
+                           for path, listing in probes.items())
+        values = (*(codes[result[name].name] for (name, _), codes in zip(_ENUM_COLUMNS, _CODES)),
+                  self._code(result['ErrorMsg'], self._messages, self._message_codes_by_text),
+                  self._code(probes, self._probe_sets, self._probe_codes_by_set),
+                  _NO_CACHE if 'Cached' not in result else
+                  _CACHED if result['Cached'] else _NOT_CACHED)
+        columns = (*self._enum_codes, self._message_codes, self._probe_codes, self._cached)
+        row = self._find_key(key)
+        if row is not None:
+            for column, value in zip(columns, values):
+                column[row] = value
+            return
+        row = len(self._keys)
+        if not row:
+            dict.__setitem__(self, ip, row)
+        self._keys.append(key)
+        for column, value in zip(columns, values):
+            column.append(value)
+        self._recent[key] = row
+        if len(self._recent) > max(_MIN_RECENT, len(self._index) >> _RECENT_SHIFT):
+            self._merge_recent()
+
+    def __getitem__(self, ip: str) -> dict:
+        row = self._find(ip)
+        if row is None:
+            raise KeyError(ip)
+        return self._result(row)
+
+    def __contains__(self, ip: object) -> bool:
+        return isinstance(ip, str) and self._find(ip) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        # Defined so dict(store) and {**store} read results through __getitem__,
+        # rather than copying the dict itself.
+        for row in range(len(self._keys)):
+            yield self._key(row)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def get(self, ip: str, default: Optional[dict] = None) -> Optional[dict]:
+        row = self._find(ip)
+        return default if row is None else self._result(row)
+
+    def keys(self) -> collections.abc.KeysView:
+        return collections.abc.KeysView(self)
+
+    def items(self) -> _ItemsView:
+        return _ItemsView(self)
+
+    def values(self) -> _ValuesView:
+        return _ValuesView(self)
+
+    def copy(self) -> dict:
+        return dict(self.items())
+
+    def __eq__(self, other: object) -> bool:
+        return dict(self.items()) == other
+
+    def __ne__(self, other: object) -> bool:
+        return not self == other
+
+    def __or__(self, other: dict) -> dict:
+        return dict(self.items()) | other
+
+    def __ror__(self, other: dict) -> dict:
+        return other | dict(self.items())
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({dict(self.items())!r})'
+
+    def __reduce__(self) -> tuple:
+        return type(self), (list(self.items()),)
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('ResultStore is read-only, use add().')
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    pop = popitem = setdefault = update = clear = _read_only
+
+    def _iter_items(self) -> Iterator[tuple[str, dict]]:
+        for row in range(len(self._keys)):
+            yield self._key(row), self._result(row)
+
+    def _find(self, ip: str) -> Optional[int]:
+        """The row stored under ip, or None."""
+        key = pack_key(ip)
+        if key is None:
+            code = self._other_codes.get(ip)
+            if code is None:
+                return None
+            key = -1 - code
+        return self._find_key(key)
+
+    def _find_key(self, key: int) -> Optional[int]:
+        row = self._recent.get(key)
+        if row is not None:
+            return row
+        i = bisect.bisect_left(self._index, key, key=self._keys.__getitem__)
+        if i < len(self._index) and self._keys[self._index[i]] == key:
+            return self._index[i]
+        return None
+
+    def _merge_recent(self) -> None:
+        # The index is already sorted, so this is mostly a merge.
+        self._index = array('I', sorted(itertools.chain(self._index, self._recent.values()),
+                                        key=self._keys.__getitem__))
+        self._recent.clear()
+
+    @staticmethod
+    def _code(value, values: list, codes: dict) -> int:
+        """The number value is stored as, storing it if it's new."""
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def _key(self, row: int) -> str:
+        key = self._keys[row]
+        return self._other_keys[-1 - key] if key < 0 else unpack_key(key)
+
+    def _result(self, row: int) -> dict:
+        result = {name: members[column[row]] for (name, _), members, column
+                  in zip(_ENUM_COLUMNS, _MEMBERS, self._enum_codes)}
+        result['ErrorMsg'] = self._messages[self._message_codes[row]]
+        probes = self._probe_sets[self._probe_codes[row]]
+        if probes is not None:
+            result['Probes'] = {path: _DIR_LIST_MEMBERS[code] for path, code in probes}
+        if self._cached[row] != _NO_CACHE:
+            result['Cached'] = self._cached[row] == _CACHED
+        return result
@@ -0,0 +1,153 @@
+"Opt-in timings per scan phase and counts per status and error, as histograms or Prometheus text."
+import bisect
+import collections
+import threading
+import time
+from typing import Optional
+
+# validate: checking the IP. connect, first_byte: opening the connection and
+# waiting for the response headers (both under first_byte with the sync engine,
+# requests doesn't time them apart). body: reading the page, and with the sync
+# engine searching it too. classify: the checks on a response already read.
+# total: the whole target, cache lookups included.
+PHASES = ('validate', 'connect', 'first_byte', 'body', 'classify', 'total')
+# Bucket upper bounds in seconds, 100us to 10s.
+_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_PREFIX = 'ip_scanner'
+
+
+class Histogram():
+    """Counts of observations per bucket, plus their count and sum, like Prometheus."""
+    def __init__(self, bounds: tuple[float, ...] = _BOUNDS) -> None:
+        self.bounds = bounds
+        # The last bucket is everything over the last bound.
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.buckets[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other: 'Histogram') -> None:
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th (0 to 1) observation, None if empty."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """(upper bound, observations at or under it) per bucket, ending with inf."""
+        total, cumulative = 0, []
+        for bound, count in zip(self.bounds + (float('inf'),), self.buckets):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class Trace():
+    """Timings for one target. Each lap is the time since the previous lap or mark."""
+    __slots__ = ('timings', 'error', 'started', '_last')
+
+    def __init__(self) -> None:
+        self.timings: dict[str, float] = {}
+        # Exception class name if the request failed.
+        self.error: Optional[str] = None
+        self.started = self._last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.timings[phase] = self.timings.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def mark(self) -> None:
+        """Starts the next lap now, leaving time since the last one out."""
+        self._last = time.perf_counter()
+
+
+class ScanMetrics():
+    """Histograms per phase and counters per status and error type, shared between scans.
+
+        Pass one as WebServerScanner(metrics=...) to turn instrumentation on.
+        Safe to share between threads, and picklable so worker processes can
+        send theirs back to be merged.
+    """
+    def __init__(self) -> None:
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.statuses: collections.Counter[str] = collections.Counter()
+        self.errors: collections.Counter[str] = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        with self._lock:
+            return {'phases': self.phases, 'statuses': self.statuses, 'errors': self.errors}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__()
+        self.merge_state(state)
+
+    def record(self, trace: Trace, result: dict) -> None:
+        """Adds a finished target's timings, status and error, if any."""
+        trace.timings['total'] = time.perf_counter() - trace.started
+        with self._lock:
+            for phase, seconds in trace.timings.items():
+                self.phases[phase].observe(seconds)
+            self.statuses[result['Status'].name] += 1
+            if trace.error is not None:
+                self.errors[trace.error] += 1
+
+    def merge(self, other: 'ScanMetrics') -> None:
+        self.merge_state(other.__getstate__())
+
+    def merge_state(self, state: dict) -> None:
+        with self._lock:
+            for phase, histogram in state['phases'].items():
+                self.phases[phase].merge(histogram)
+            self.statuses.update(state['statuses'])
+            self.errors.update(state['errors'])
+
+    def snapshot(self) -> dict:
+        """Everything recorded so far, with p50/p90/p99 per phase (bucket upper bounds)."""
+        with self._lock:
+            return {'Phases': {phase: {'Count': histogram.count, 'Sum': histogram.sum,
+                                       'P50': histogram.percentile(0.5),
+                                       'P90': histogram.percentile(0.9),
+                                       'P99': histogram.percentile(0.99),
+                                       'Buckets': histogram.cumulative()}
+                               for phase, histogram in self.phases.items()},
+                    'Statuses': dict(self.statuses), 'Errors': dict(self.errors)}
+
+    def to_prometheus(self) -> str:
+        """Everything recorded so far in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [f'# HELP {_PREFIX}_phase_seconds Time spent in each phase of a scan.',
+                     f'# TYPE {_PREFIX}_phase_seconds histogram']
+            for phase, histogram in self.phases.items():
+                for bound, count in histogram.cumulative():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{_PREFIX}_phase_seconds_bucket{{phase="{phase}",le="{le}"}} '
+                                 f'{count}')
+                lines.append(f'{_PREFIX}_phase_seconds_sum{{phase="{phase}"}} {histogram.sum!r}')
+                lines.append(f'{_PREFIX}_phase_seconds_count{{phase="{phase}"}} '
+                             f'{histogram.count}')
+            lines += [f'# HELP {_PREFIX}_results_total Targets scanned, by status.',
+                      f'# TYPE {_PREFIX}_results_total counter']
+            lines += [f'{_PREFIX}_results_total{{status="{status}"}} {count}'
+                      for status, count in sorted(self.statuses.items())]
+            lines += [f'# HELP {_PREFIX}_errors_total Failed requests, by exception type.',
+                      f'# TYPE {_PREFIX}_errors_total counter']
+            lines += [f'{_PREFIX}_errors_total{{type="{error}"}} {count}'
+                      for error, count in sorted(self.errors.items())]
+        return '\n'.join(lines) + '\n'
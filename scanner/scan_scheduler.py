@@ -0,0 +1,258 @@
+"Spreads scans across subnets, rate limits them, adapts timeouts to observed RTTs and budgets retries."
+import collections
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+
+_DEFAULT_BURST = 10
+_DEFAULT_INTERLEAVE_WINDOW = 10000 # targets read ahead to mix subnets
+_DEFAULT_TIMEOUT_FLOOR = 0.5 # seconds
+_DEFAULT_TIMEOUT_CEILING = 3.0 # seconds, the fixed timeout used without a scheduler
+_DEFAULT_TIMEOUT_PERCENTILE = 0.95
+_DEFAULT_TIMEOUT_MULTIPLIER = 3.0
+_DEFAULT_MAX_RETRIES = 1
+_DEFAULT_RETRY_BUDGET = 0.1 # retries per target scanned
+_DEFAULT_RETRY_DELAY = 1.0 # seconds between a failure and its retry
+_MIN_RETRY_BUDGET = 10 # retries allowed however few targets were scanned
+_RTT_SAMPLES = 1000 # most recent kept
+_MIN_RTT_SAMPLES = 20 # before this many the ceiling is used
+_RECOMPUTE_EVERY = 50 # samples between timeout updates
+_MAX_TRACKED_SUBNETS = 65536 # idle ones are dropped past this
+
+
+def subnet(ip: str) -> str:
+    """The /24 of a (http(s)://)ip(:port), e.g. 10.0.0. Anything else is returned whole."""
+    host = ip.rpartition('://')[2].partition(':')[0]
+    prefix, sep, _ = host.rpartition('.')
+    return prefix if sep else ip
+
+
+def interleave_subnets(ips: Iterable[str],
+                       window: int = _DEFAULT_INTERLEAVE_WINDOW) -> Iterator[str]:
+    """Yields ips round robin across their /24s, reading at most window ahead.
+
+        A sorted list of a /16 comes out as one IP from each /24 in turn, so
+        no one network sees a burst. Memory is bounded by window.
+    """
+    if window < 1:
+        raise ValueError('window must be at least 1.')
+    ips = iter(ips)
+    buckets: collections.OrderedDict[str, collections.deque] = collections.OrderedDict()
+    held = 0
+    exhausted = False
+    while True:
+        while not exhausted and held < window:
+            try:
+                ip = next(ips)
+            except StopIteration:
+                exhausted = True
+                break
+            buckets.setdefault(subnet(ip), collections.deque()).append(ip)
+            held += 1
+        if not buckets:
+            return
+        key, bucket = next(iter(buckets.items()))
+        yield bucket.popleft()
+        held -= 1
+        if bucket:
+            buckets.move_to_end(key)
+        else:
+            del buckets[key]
+
+
+class _TokenBucket():
+    """rate tokens a second, up to burst at once. Times are when the next token is free (GCRA)."""
+    def __init__(self, rate: float, burst: int) -> None:
+        self.interval = 1 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.next_free = 0.0
+
+    def reserve(self, now: float) -> float:
+        """Takes a token, returns how long to wait before using it."""
+        next_free = max(self.next_free, now)
+        self.next_free = next_free + self.interval
+        return max(0.0, next_free - self.tolerance - now)
+
+
+class RateLimiter():
+    """Token buckets for all requests (rate) and for each /24 (subnet_rate), per second."""
+    def __init__(self, rate: Optional[float] = None, subnet_rate: Optional[float] = None,
+                 burst: int = _DEFAULT_BURST) -> None:
+        for name, value in (('rate', rate), ('subnet_rate', subnet_rate)):
+            if value is not None and value <= 0:
+                raise ValueError(f'{name} must be more than 0, or None for no limit.')
+        if burst < 1:
+            raise ValueError('burst must be at least 1.')
+        self.rate = rate
+        self.subnet_rate = subnet_rate
+        self.burst = burst
+        self._global = _TokenBucket(rate, burst) if rate is not None else None
+        self._subnets: dict[str, _TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, ip: str) -> float:
+        """Takes a token from each bucket ip falls under. Returns seconds to wait before sending."""
+        now = time.monotonic()
+        delay = 0.0
+        with self._lock:
+            if self._global is not None:
+                delay = self._global.reserve(now)
+            if self.subnet_rate is not None:
+                bucket = self._subnets.get(key := subnet(ip))
+                if bucket is None:
+                    if len(self._subnets) >= _MAX_TRACKED_SUBNETS:
+                        self._forget_idle(now)
+                    bucket = self._subnets[key] = _TokenBucket(self.subnet_rate, self.burst)
+                delay = max(delay, bucket.reserve(now))
+        return delay
+
+    def _forget_idle(self, now: float) -> None:
+        # An idle bucket is full, so a new one in its place behaves the same.
+        for key in [key for key, bucket in self._subnets.items() if bucket.next_free <= now]:
+            del self._subnets[key]
+
+
+class AdaptiveTimeout():
+    """Connect and read timeouts of multiplier x the percentile RTT seen, within floor and ceiling.
+
+        Only successful requests are sampled. The ceiling is used until
+        enough have been seen.
+    """
+    def __init__(self, floor: float = _DEFAULT_TIMEOUT_FLOOR,
+                 ceiling: float = _DEFAULT_TIMEOUT_CEILING,
+                 percentile: float = _DEFAULT_TIMEOUT_PERCENTILE,
+                 multiplier: float = _DEFAULT_TIMEOUT_MULTIPLIER) -> None:
+        if not 0 < floor <= ceiling:
+            raise ValueError('Expected 0 < floor <= ceiling.')
+        if not 0 < percentile <= 1:
+            raise ValueError('percentile must be more than 0 and at most 1.')
+        self.floor = floor
+        self.ceiling = ceiling
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self._connect_rtts: collections.deque[float] = collections.deque(maxlen=_RTT_SAMPLES)
+        self._read_rtts: collections.deque[float] = collections.deque(maxlen=_RTT_SAMPLES)
+        self._until_recompute = _MIN_RTT_SAMPLES
+        self._current = (ceiling, ceiling)
+        self._lock = threading.Lock()
+
+    def observe(self, connect: Optional[float], first_byte: float) -> None:
+        """Records a successful request's connect time and wait for the first byte, in seconds.
+
+            connect is None if the request reused an open connection.
+        """
+        with self._lock:
+            if connect is not None:
+                self._connect_rtts.append(connect)
+            self._read_rtts.append(first_byte)
+            self._until_recompute -= 1
+            if self._until_recompute <= 0:
+                self._current = (self._timeout(self._connect_rtts),
+                                 self._timeout(self._read_rtts))
+                self._until_recompute = _RECOMPUTE_EVERY
+
+    def current(self) -> tuple[float, float]:
+        """(connect, read) timeouts in seconds, as requests takes them."""
+        return self._current
+
+    def _timeout(self, rtts: Iterable[float]) -> float:
+        rtts = sorted(rtts)
+        if not rtts:
+            return self.ceiling
+        rtt = rtts[min(len(rtts) - 1, int(self.percentile * len(rtts)))]
+        return min(self.ceiling, max(self.floor, rtt * self.multiplier))
+
+
+class Scheduler():
+    """Decides the order, pace, timeouts and retries of a scan. Pass as WebServerScanner(scheduler=...).
+
+        Targets are interleaved across /24s (see interleave_subnets), requests
+        wait for a token from the global and per /24 RateLimiter, and
+        timeouts come from AdaptiveTimeout. Targets that fail in a way that
+        may be transient (timeouts, connection errors, 429 and 503) are
+        retried in a separate pass after the rest, up to max_retries times,
+        with retries capped at retry_budget per target scanned. Retries use
+        the timeout ceiling.
+
+        Picklable, each process gets fresh state. See split for sharing
+        limits between processes.
+    """
+    def __init__(self, rate: Optional[float] = None, subnet_rate: Optional[float] = None,
+                 burst: int = _DEFAULT_BURST,
+                 interleave_window: int = _DEFAULT_INTERLEAVE_WINDOW,
+                 adaptive_timeouts: bool = True,
+                 timeout_floor: float = _DEFAULT_TIMEOUT_FLOOR,
+                 timeout_ceiling: float = _DEFAULT_TIMEOUT_CEILING,
+                 max_retries: int = _DEFAULT_MAX_RETRIES,
+                 retry_budget: float = _DEFAULT_RETRY_BUDGET,
+                 retry_delay: float = _DEFAULT_RETRY_DELAY) -> None:
+        if interleave_window < 1:
+            raise ValueError('interleave_window must be at least 1.')
+        if max_retries < 0 or retry_budget < 0:
+            raise ValueError('max_retries and retry_budget must be at least 0.')
+        self._args = dict(rate=rate, subnet_rate=subnet_rate, burst=burst,
+                          interleave_window=interleave_window,
+                          adaptive_timeouts=adaptive_timeouts, timeout_floor=timeout_floor,
+                          timeout_ceiling=timeout_ceiling, max_retries=max_retries,
+                          retry_budget=retry_budget, retry_delay=retry_delay)
+        self.interleave_window = interleave_window
+        self.limiter = (RateLimiter(rate, subnet_rate, burst)
+                        if rate is not None or subnet_rate is not None else None)
+        self.timeouts = (AdaptiveTimeout(timeout_floor, timeout_ceiling)
+                         if adaptive_timeouts else None)
+        self.timeout_ceiling = timeout_ceiling
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget
+        self.retry_delay = retry_delay
+        self.scanned = 0
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        return self._args
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def split(self, workers: int) -> 'Scheduler':
+        """A copy for each of workers processes, with the rate limits divided between them."""
+        args = dict(self._args)
+        for name in ('rate', 'subnet_rate'):
+            if args[name] is not None:
+                args[name] /= workers
+        return Scheduler(**args)
+
+    def interleave(self, ips: Iterable[str]) -> Iterator[str]:
+        return interleave_subnets(ips, self.interleave_window)
+
+    def delay(self, ip: str) -> float:
+        """Seconds to wait before sending a request to ip."""
+        return self.limiter.reserve(ip) if self.limiter is not None else 0.0
+
+    def timeout(self, retrying: bool = False) -> tuple[float, float]:
+        """(connect, read) timeouts for the next request."""
+        if retrying or self.timeouts is None:
+            return (self.timeout_ceiling, self.timeout_ceiling)
+        return self.timeouts.current()
+
+    def observe(self, connect: Optional[float], first_byte: float) -> None:
+        if self.timeouts is not None:
+            self.timeouts.observe(connect, first_byte)
+
+    def count_scanned(self) -> None:
+        with self._lock:
+            self.scanned += 1
+
+    def allow_retry(self) -> bool:
+        """Spends a retry if the budget has one left."""
+        with self._lock:
+            if (not self.retry_budget
+                    or self.retried >= max(_MIN_RETRY_BUDGET, self.retry_budget * self.scanned)):
+                return False
+            self.retried += 1
+            return True
+
+    def stats(self) -> dict[str, float]:
+        timeouts = self.timeout()
+        return {'Scanned': self.scanned, 'Retried': self.retried,
+                'ConnectTimeout': timeouts[0], 'ReadTimeout': timeouts[1]}
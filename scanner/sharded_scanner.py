@@ -0,0 +1,177 @@
+"Splits a large IP list across worker processes, each running its own WebServerScanner."
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from typing import Iterable, Iterator, Optional
+
+import result_store
+import scan_metrics
+from web_server_scanner import IP_MAP_TYPE, ORDERS, RESULT_TYPE, WebServerScanner
+
+_DEFAULT_SHARD_SIZE = 1000
+# Shards in flight or finished but not yet yielded, per worker. Bounds input read ahead.
+_SHARDS_PER_WORKER = 2
+
+# {pid: {'Hosts': int, 'Seconds': float, 'HostsPerSecond': float}}
+WORKER_STATS_TYPE = dict[int, dict[str, float]]
+
+
+def _scan_shard(args: tuple[list, dict]) -> tuple[int, int, list, float, Optional[dict],
+                                                 Optional[scan_metrics.ScanMetrics]]:
+    """Runs in a worker process.
+
+        Returns its pid, host count, results, time taken, cache stats and
+        metrics for just this shard, to be merged by the parent.
+    """
+    ips, scanner_kwargs = args
+    start = time.perf_counter()
+    if scanner_kwargs.get('metrics') is not None:
+        scanner_kwargs = {**scanner_kwargs, 'metrics': scan_metrics.ScanMetrics()}
+    scanner = WebServerScanner(ips, **scanner_kwargs)
+    results = list(scanner.iter_scan(order='input'))
+    cache_stats = scanner.cache.stats() if scanner.cache is not None else None
+    return (os.getpid(), len(ips), results, time.perf_counter() - start, cache_stats,
+            scanner.metrics)
+
+
+class ParallelScanner():
+    """Base for scanners whose workers each scan with their own WebServerScanner.
+
+        scanner_kwargs are as for WebServerScanner. With a scheduler, each
+        of split_between workers gets its share of the rate limits.
+    """
+    def __init__(self, ips: Iterable[str], scanner_kwargs: dict, split_between: int) -> None:
+        self.ips = ips
+        if split_between and scanner_kwargs.get('scheduler') is not None:
+            scanner_kwargs['scheduler'] = scanner_kwargs['scheduler'].split(split_between)
+        self.scanner_kwargs = scanner_kwargs
+        self.ip_map: IP_MAP_TYPE = result_store.ResultStore()
+        # Totals from the workers' own caches, if they have one.
+        self.cache_stats = {'Hits': 0, 'Misses': 0}
+        # Workers' metrics are merged into this one, if one was passed in.
+        self.metrics: Optional[scan_metrics.ScanMetrics] = scanner_kwargs.get('metrics')
+        # Not used to scan, only for output_key.
+        self._key_scanner = WebServerScanner([], **scanner_kwargs)
+
+    def __call__(self) -> IP_MAP_TYPE:
+        """Scans every IP and merges the workers' results in input order.
+
+            Raises:
+                ValueError: If the scanner kwargs indicate nothing to scan.
+
+            Returns:
+                ResultStore: Same as WebServerScanner's ip_map. Per-worker
+                throughput is left in self.worker_stats.
+        """
+        for ip, result in self.iter_scan(self.ips, order='input'):
+            self.ip_map.add(ip, result)
+        return self.ip_map
+
+    def iter_scan(self, ips: Optional[Iterable[str]] = None,
+                  order: str = 'input') -> Iterator[tuple[str, RESULT_TYPE]]:
+        """Yields (ip, result) from the workers, like WebServerScanner.iter_scan."""
+        raise NotImplementedError
+
+    def output_key(self, ip: str) -> str:
+        """The key ip's result will be under, see WebServerScanner.output_key."""
+        return self._key_scanner.output_key(ip)
+
+    def _check_scan(self, order: str) -> None:
+        """Raises ValueError if the scanner kwargs indicate nothing to scan, or order is invalid."""
+        if (not self.scanner_kwargs.get('scan_root', True)
+                and not self.scanner_kwargs.get('scan_software', True)):
+            logging.error('Invalid args: Nothing to scan.')
+            raise ValueError('Invalid args: Nothing to scan.')
+        if order not in ORDERS:
+            raise ValueError(f'Invalid order {order}, expected one of {ORDERS}.')
+
+    def _add_cache_stats(self, stats: Optional[dict[str, int]]) -> None:
+        if stats is not None:
+            self.cache_stats['Hits'] += stats['Hits']
+            self.cache_stats['Misses'] += stats['Misses']
+
+
+class ShardedScanner(ParallelScanner):
+    """Scan IPs with a pool of processes. Takes the same kwargs as WebServerScanner."""
+    def __init__(self, ips: Iterable[str], workers: int = os.cpu_count() or 1,
+                 shard_size: int = _DEFAULT_SHARD_SIZE, **scanner_kwargs) -> None:
+        if workers < 1:
+            raise ValueError('workers must be at least 1.')
+        if shard_size < 1:
+            raise ValueError('shard_size must be at least 1.')
+        super().__init__(ips, scanner_kwargs, workers)
+        self.workers = workers
+        self.shard_size = shard_size
+        self.worker_stats: WORKER_STATS_TYPE = {}
+
+    def iter_scan(self, ips: Optional[Iterable[str]] = None,
+                  order: str = 'input') -> Iterator[tuple[str, RESULT_TYPE]]:
+        """Yields (ip, result) a shard at a time, like WebServerScanner.iter_scan.
+
+            order='input' yields shards in input order, 'completion' as each
+            shard finishes. Results within a shard are always in input order.
+
+            Raises:
+                ValueError: If the scanner kwargs indicate nothing to scan.
+        """
+        self._check_scan(order)
+        return self._iter_scan(self.ips if ips is None else ips, order)
+
+    def _iter_scan(self, ips: Iterable[str], order: str) -> Iterator[tuple[str, RESULT_TYPE]]:
+        # (index, shard's results, error) as each finishes, from the pool's result thread.
+        finished = queue.Queue()
+        # Finished out of turn, held until the shards before them are yielded.
+        waiting = {}
+        shards = self._shards(ips)
+        submitted = yielded = 0
+        with multiprocessing.Pool(self.workers) as pool:
+            def submit(shard: tuple[list, dict]) -> None:
+                nonlocal submitted
+                index = submitted
+                pool.apply_async(_scan_shard, (shard,),
+                                 callback=lambda done: finished.put((index, done, None)),
+                                 error_callback=lambda e: finished.put((index, None, e)))
+                submitted += 1
+
+            # imap would read every shard ahead of the workers, so shards are
+            # submitted a few at a time, and only once earlier ones are yielded.
+            for shard in itertools.islice(shards, _SHARDS_PER_WORKER * self.workers):
+                submit(shard)
+            while yielded < submitted:
+                index, done, error = finished.get()
+                if error is not None:
+                    raise error
+                waiting[index] = done
+                ready = [index] if order == 'completion' else []
+                while order == 'input' and yielded + len(ready) in waiting:
+                    ready.append(yielded + len(ready))
+                for index in ready:
+                    pid, hosts, results, seconds, cache_stats, metrics = waiting.pop(index)
+                    yielded += 1
+                    if (shard := next(shards, None)) is not None:
+                        submit(shard)
+                    self._record_worker(pid, hosts, seconds)
+                    self._add_cache_stats(cache_stats)
+                    if metrics is not None:
+                        self.metrics.merge(metrics)
+                    yield from results
+
+        for pid, stats in self.worker_stats.items():
+            logging.info(f'Worker {pid} scanned {stats["Hosts"]} hosts at '
+                         f'{stats["HostsPerSecond"]:.1f} hosts/s.')
+
+    def _shards(self, ips: Iterable[str]) -> Iterator[tuple[list, dict]]:
+        ips = iter(ips)
+        while shard := list(itertools.islice(ips, self.shard_size)):
+            yield shard, self.scanner_kwargs
+
+    def _record_worker(self, pid: int, hosts: int, seconds: float) -> None:
+        stats = self.worker_stats.setdefault(pid, {'Hosts': 0, 'Seconds': 0.0,
+                                                   'HostsPerSecond': 0.0})
+        stats['Hosts'] += hosts
+        stats['Seconds'] += seconds
+        if stats['Seconds']:
+            stats['HostsPerSecond'] = stats['Hosts'] / stats['Seconds']
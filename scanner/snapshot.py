@@ -0,0 +1,169 @@
+"Baseline snapshot of every target's last result, for scanning only what's due and reporting changes."
+import json
+import logging
+import tempfile
+import time
+from typing import Iterable, Iterator, Optional
+
+from sqlite_store import SQLiteStore
+from utils import WebSrvEnum, DirListEnum, StatusEnum
+
+# Stable targets with these statuses are rescanned this often, see RescanPolicy.
+DEFAULT_RESCAN_INTERVALS = {StatusEnum.good: 7 * 86400} # seconds
+_DEFAULT_STABLE_AFTER = 3 # scans
+# What counts as a change. Error messages vary run to run for the same failure.
+_COMPARED_KEYS = ('WebServerSoftware', 'RootListing', 'Status', 'Probes')
+
+# {'Result': result, 'Changed': time, 'Scanned': time, 'Stable': scans the result has held}
+ENTRY_TYPE = dict[str, object]
+
+
+class RescanPolicy():
+    """Which targets in a snapshot are worth scanning again.
+
+        A target is stable once its result has been the same for stable_after
+        scans in a row. A stable target whose status has an interval is
+        skipped until that long after it was last scanned. With defer, stable
+        targets that are due are scanned after everything else, so new and
+        changing targets are reported first. An interval of 0 defers without
+        skipping.
+    """
+    def __init__(self, intervals: Optional[dict[StatusEnum, float]] = None,
+                 stable_after: int = _DEFAULT_STABLE_AFTER, defer: bool = False) -> None:
+        if stable_after < 1:
+            raise ValueError('stable_after must be at least 1.')
+        intervals = dict(DEFAULT_RESCAN_INTERVALS if intervals is None else intervals)
+        if any(seconds < 0 for seconds in intervals.values()):
+            raise ValueError('Rescan intervals must be at least 0.')
+        # By name, so members of another import of utils match too.
+        self.intervals = {status.name: seconds for status, seconds in intervals.items()}
+        self.stable_after = stable_after
+        self.defer = defer
+
+    def stable(self, entry: ENTRY_TYPE) -> bool:
+        return (entry['Stable'] >= self.stable_after
+                and entry['Result']['Status'].name in self.intervals)
+
+    def due(self, entry: ENTRY_TYPE, now: float) -> bool:
+        """If a stable target should be scanned again by now."""
+        return now - entry['Scanned'] >= self.intervals[entry['Result']['Status'].name]
+
+
+class Snapshot(SQLiteStore):
+    """Last result of every target scanned, in a SQLite table indexed by output key.
+
+        Enums are stored by name, and each row also has when its result last
+        changed, when it was last scanned and for how many scans in a row it
+        has held. Can be shared between threads.
+    """
+    def __init__(self, path: str = ':memory:') -> None:
+        # Of the last scan: targets scanned, new, changed, and skipped or deferred by policy.
+        self.stats = {'Scanned': 0, 'New': 0, 'Changed': 0, 'Skipped': 0, 'Deferred': 0}
+        # Without a rowid the table is the key's index, with no second copy of it.
+        super().__init__(path, 'CREATE TABLE IF NOT EXISTS targets (key TEXT PRIMARY KEY, '
+                         'software TEXT, root_listing TEXT, status TEXT, error_msg TEXT, '
+                         'probes TEXT, changed REAL, scanned REAL, stable INTEGER) '
+                         'WITHOUT ROWID')
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM targets').fetchone()[0]
+
+    def get(self, key: str) -> Optional[ENTRY_TYPE]:
+        """The entry stored for key, or None."""
+        with self._lock:
+            row = self._db.execute('SELECT software, root_listing, status, error_msg, probes, '
+                                   'changed, scanned, stable FROM targets WHERE key = ?',
+                                   (key,)).fetchone()
+        if row is None:
+            return None
+        result = {'WebServerSoftware': WebSrvEnum[row[0]], 'RootListing': DirListEnum[row[1]],
+                  'Status': StatusEnum[row[2]], 'ErrorMsg': row[3]}
+        if row[4] is not None:
+            result['Probes'] = {path: DirListEnum[name]
+                                for path, name in json.loads(row[4]).items()}
+        return {'Result': result, 'Changed': row[5], 'Scanned': row[6], 'Stable': row[7]}
+
+    def record(self, key: str, result: dict,
+               now: Optional[float] = None) -> tuple[Optional[ENTRY_TYPE], bool]:
+        """Stores result as key's latest. Returns the entry it replaced and if it changed."""
+        now = time.time() if now is None else now
+        previous = self.get(key)
+        changed = previous is None or _changed(previous['Result'], result)
+        probes = result.get('Probes')
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO targets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, result['WebServerSoftware'].name, result['RootListing'].name,
+                 result['Status'].name, result['ErrorMsg'],
+                 None if probes is None else json.dumps({path: listing.name
+                                                         for path, listing in probes.items()}),
+                 now if changed else previous['Changed'], now,
+                 1 if changed else previous['Stable'] + 1))
+            self._wrote()
+        return previous, changed
+
+    def scan(self, scanner, ips: Iterable[str], diff: bool = False,
+             policy: Optional[RescanPolicy] = None) -> Iterator[tuple[str, dict]]:
+        """Scans ips with scanner, recording every result, and yields them as iter_scan does.
+
+            With diff, only new targets and those whose software, listing,
+            status or probes changed are yielded, each with a 'Previous' key
+            holding the result it had in the snapshot (None if new). With a
+            policy, stable targets it doesn't consider due are skipped, and
+            with defer the due ones are scanned last. scanner is a
+            WebServerScanner, ShardedScanner or Coordinator.
+        """
+        self.stats = dict.fromkeys(self.stats, 0)
+        now = time.time()
+        try:
+            results = scanner.iter_scan(self._due(scanner, ips, policy, now), order='input')
+            for ip, result in results:
+                previous, changed = self.record(ip, result, now)
+                self.stats['Scanned'] += 1
+                self.stats['New' if previous is None else 'Changed'] += changed
+                if not diff:
+                    yield ip, result
+                elif changed:
+                    result['Previous'] = None if previous is None else previous['Result']
+                    yield ip, result
+        finally:
+            self.flush()
+        logging.info(f'Snapshot {self.path}: {self.stats}.')
+
+    def _due(self, scanner, ips: Iterable[str], policy: Optional[RescanPolicy],
+             now: float) -> Iterator[str]:
+        """ips without those policy skips, and with those it defers at the end."""
+        if policy is None:
+            yield from ips
+            return
+        # Spilled to disk, there may be millions.
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as deferred:
+            for ip in ips:
+                entry = self.get(scanner.output_key(ip))
+                if entry is None or not policy.stable(entry):
+                    yield ip
+                elif not policy.due(entry, now):
+                    self.stats['Skipped'] += 1
+                elif policy.defer and '\n' not in ip:
+                    deferred.write(ip + '\n')
+                    self.stats['Deferred'] += 1
+                else:
+                    yield ip
+            deferred.seek(0)
+            for line in deferred:
+                yield line[:-1]
+
+
+def _changed(previous: dict, result: dict) -> bool:
+    for key in _COMPARED_KEYS:
+        before, after = previous.get(key), result.get(key)
+        # By name, so members of another import of utils match too.
+        if key == 'Probes':
+            before = None if before is None else {path: l.name for path, l in before.items()}
+            after = None if after is None else {path: l.name for path, l in after.items()}
+        elif before is not None and after is not None:
+            before, after = before.name, after.name
+        if before != after:
+            return True
+    return False
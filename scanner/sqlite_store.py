@@ -0,0 +1,46 @@
+"Base for the SQLite files results are kept in between runs, see result_cache and snapshot."
+import logging
+import sqlite3
+import threading
+
+# Writes are committed in batches, and on flush().
+_COMMIT_EVERY = 500
+_SQLITE_TIMEOUT = 30 # seconds, for other processes writing to the same file
+
+
+class SQLiteStore():
+    """A SQLite file with one table, created from schema if it's missing.
+
+        Can be shared between threads, and other processes can open the same
+        file. Subclasses hold self._lock around their queries, and call
+        _wrote() after each write.
+    """
+    def __init__(self, path: str, schema: str) -> None:
+        self.path = path
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=_SQLITE_TIMEOUT, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(schema)
+        self._db.commit()
+
+    def flush(self) -> None:
+        """Commits pending writes so other processes and later runs see them."""
+        with self._lock:
+            self._commit()
+
+    def close(self) -> None:
+        self.flush()
+        self._db.close()
+
+    def _wrote(self) -> None:
+        self._uncommitted += 1
+        if self._uncommitted >= _COMMIT_EVERY:
+            self._commit()
+
+    def _commit(self) -> None:
+        if self._uncommitted:
+            self._db.commit()
+            logging.debug(f'Committed {self._uncommitted} rows to {self.path}.')
+            self._uncommitted = 0
@@ -0,0 +1,180 @@
+"Compact index of targets seen in a scan, for scanning each (scheme, ip, port) once."
+import re
+import urllib.parse
+from array import array
+from typing import Optional, Union
+
+import targets
+
+_INITIAL_CAPACITY = 1 << 10 # slots, always a power of 2
+# Grows when this full, so probes stay short.
+_MAX_LOAD = 2 / 3
+# Fibonacci hashing, which spreads consecutive ints evenly. Packed keys are
+# rotated first so the address is lowest, and neighbouring IPs are consecutive.
+_MULTIPLIER = 0x9E3779B97F4A7C15
+_WORD_MASK = (1 << 64) - 1
+_ADDRESS_SHIFT = 18
+# Stand-ins for a target's host and port in the error messages ResultTable stores.
+_HOST_MARK = '\x00'
+_PORT_MARK = '\x01'
+# e.g. urllib3's <urllib3.connection.HTTPConnection object at 0x7f...>, new every
+# request, so left out when matching messages.
+_OBJECT_ADDRESS = re.compile(r' at 0x[0-9a-fA-F]+')
+
+
+class TargetIndex():
+    """Map of packed target keys (see result_store.pack_key) to ints under 2**32.
+
+        An open addressing hash table in two flat arrays, 12 bytes a slot and
+        at least a third full, so at most 36 bytes a target where a dict of
+        ints takes over 100. Keys can't be removed.
+    """
+    def __init__(self, capacity: int = _INITIAL_CAPACITY) -> None:
+        self._bits = max(capacity - 1, 1).bit_length()
+        # key + 1 per slot, 0 for empty.
+        self._keys = array('Q', bytes(8 << self._bits))
+        self._values = array('I', bytes(4 << self._bits))
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, key: int) -> bool:
+        return self._keys[self._slot(key)] != 0
+
+    def get(self, key: int, default: Optional[int] = None) -> Optional[int]:
+        slot = self._slot(key)
+        return self._values[slot] if self._keys[slot] else default
+
+    def __setitem__(self, key: int, value: int) -> None:
+        slot = self._slot(key)
+        if not self._keys[slot]:
+            slot = self._insert(key, slot)
+        self._values[slot] = value
+
+    def add(self, key: int, value: int) -> bool:
+        """Sets key to value unless it's already there. Returns if it was added."""
+        slot = self._slot(key)
+        if self._keys[slot]:
+            return False
+        # Inserting may grow the arrays, so look them up after.
+        slot = self._insert(key, slot)
+        self._values[slot] = value
+        return True
+
+    def _insert(self, key: int, slot: int) -> int:
+        """Puts a new key in its empty slot, or where it goes after growing. Returns that."""
+        if self._size + 1 > _MAX_LOAD * len(self._keys):
+            self._grow()
+            slot = self._slot(key)
+        self._keys[slot] = key + 1
+        self._size += 1
+        return slot
+
+    def _slot(self, key: int) -> int:
+        """The slot holding key, or the empty one it would go in."""
+        stored = key + 1
+        mask = len(self._keys) - 1
+        rotated = (key >> _ADDRESS_SHIFT | key << (64 - _ADDRESS_SHIFT)) & _WORD_MASK
+        slot = (rotated * _MULTIPLIER & _WORD_MASK) >> (64 - self._bits)
+        keys = self._keys
+        while keys[slot] != stored and keys[slot]:
+            slot = (slot + 1) & mask
+        return slot
+
+    def _grow(self) -> None:
+        keys, values = self._keys, self._values
+        self._bits += 1
+        self._keys = array('Q', bytes(8 << self._bits))
+        self._values = array('I', bytes(4 << self._bits))
+        for stored, value in zip(keys, values):
+            if stored:
+                slot = self._slot(stored - 1)
+                self._keys[slot] = stored
+                self._values[slot] = value
+
+
+class ResultTable():
+    """Distinct scan results, each stored once and referred to by a number.
+
+        An error message is stored with its target's host and port taken
+        out, and put back when read, so e.g. every host that timed out
+        shares one result. Messages that differ only in object addresses
+        are matched too, and read back with the first one's. Most hosts
+        share one of a handful of results, so a big scan's worth takes
+        little more than its distinct kinds of error.
+    """
+    def __init__(self) -> None:
+        self._results: list[tuple] = []
+        self._numbers: dict[tuple, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def add(self, result: dict, ip: Optional[str] = None) -> int:
+        """Stores ip's result if it's new. Returns its number, get it with the same ip."""
+        target = _host_and_port(ip)
+        frozen = tuple((name, tuple(value.items()) if isinstance(value, dict)
+                        else _without_target(value, target) if name == 'ErrorMsg' and value
+                        else value)
+                       for name, value in result.items())
+        key = tuple((name, _without_addresses(value) if name == 'ErrorMsg' else value)
+                    for name, value in frozen)
+        number = self._numbers.get(key)
+        if number is None:
+            number = self._numbers[key] = len(self._results)
+            self._results.append(frozen)
+        return number
+
+    def get(self, number: int, ip: Optional[str] = None) -> dict:
+        """A fresh copy of the result stored as number, for ip."""
+        result = dict(self._results[number])
+        # Probes is the only nested dict.
+        if 'Probes' in result:
+            result['Probes'] = dict(result['Probes'])
+        if isinstance(result.get('ErrorMsg'), tuple):
+            result['ErrorMsg'] = _with_target(result['ErrorMsg'], _host_and_port(ip))
+        return result
+
+
+def _host_and_port(ip: Optional[str]) -> Optional[tuple[str, str]]:
+    """The host and port a target such as http://10.0.0.1:8080 or 10.0.0.1 connects to."""
+    if not ip:
+        return None
+    split = urllib.parse.urlsplit(ip if '://' in ip else f'//{ip}')
+    try:
+        port = split.port or targets.DEFAULT_PORTS.get(split.scheme or 'http')
+    except ValueError:
+        return None
+    if not split.hostname or port is None:
+        return None
+    return split.hostname, str(port)
+
+
+def _without_target(message: str,
+                    target: Optional[tuple[str, str]]) -> Union[str, tuple[str]]:
+    """(message with target's host and port swapped for marks,), or message if it has neither.
+
+        _with_target puts them back, giving message exactly.
+    """
+    if target is None or _HOST_MARK in message or _PORT_MARK in message:
+        return message
+    host, port = target
+    # Only whole hosts, 10.0.0.1 isn't in 10.0.0.10.
+    template = re.sub(rf'(?<![\w.]){re.escape(host)}(?!\w|\.\w)', _HOST_MARK, message)
+    # requests' "host='10.0.0.1', port=80" and async_http's "10.0.0.1:80".
+    template = re.sub(rf'(port=|{_HOST_MARK}:){port}(?!\d)', rf'\g<1>{_PORT_MARK}', template)
+    return message if template == message else (template,)
+
+
+def _without_addresses(message: Union[None, str, tuple[str]]) -> Union[None, str, tuple[str]]:
+    """A stored message as it's matched, see _OBJECT_ADDRESS."""
+    if isinstance(message, tuple):
+        return (_OBJECT_ADDRESS.sub('', message[0]),)
+    return message and _OBJECT_ADDRESS.sub('', message)
+
+
+def _with_target(template: tuple[str], target: Optional[tuple[str, str]]) -> str:
+    """Reverses _without_target, for the same target."""
+    host, port = target or ('', '')
+    return template[0].replace(_HOST_MARK, host).replace(_PORT_MARK, port)
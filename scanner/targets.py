@@ -0,0 +1,110 @@
+"Expands target specs (IPs, CIDR blocks, dash ranges, port lists) lazily into IPs to scan."
+import ipaddress
+import logging
+from typing import Iterable, Iterator
+
+_SCHEMES = ('http://', 'https://')
+_MAX_PORT = 65535
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class Target(str):
+    """A target expand_target built from parsed parts, so the scanner needn't validate it again."""
+    __slots__ = ()
+
+
+def parse_port(port: str) -> int:
+    """Returns port as an int. Raises ValueError if it isn't a plain number from 1 to 65535."""
+    if not (port.isascii() and port.isdigit()) or not 0 < int(port) <= _MAX_PORT:
+        raise ValueError(f'{port} is not a valid port.')
+    return int(port)
+
+
+def normalize(formatted_ip: str) -> str:
+    """Canonical spelling of a target, with its scheme and port always given.
+
+        E.g. 10.0.0.1, http://10.0.0.1 and 10.0.0.1:080 all give
+        http://10.0.0.1:80. Expects a validated (http(s)://)ip(:port) as
+        the scanner formats them.
+    """
+    scheme, _, host = formatted_ip.rpartition('://')
+    scheme = scheme or 'http'
+    host, sep, port = host.partition(':')
+    return f'{scheme}://{host}:{int(port) if sep else DEFAULT_PORTS[scheme]}'
+
+
+def host_port(formatted_ip: str) -> tuple[str, int]:
+    """(ip, port) to connect to, e.g. https://10.0.0.1 -> ('10.0.0.1', 443)."""
+    host, _, port = normalize(formatted_ip).rpartition('://')[2].rpartition(':')
+    return host, int(port)
+
+
+def expand_targets(specs: Iterable[str]) -> Iterator[str]:
+    """Expands each spec in turn, see expand_target. Blank specs are skipped."""
+    for spec in specs:
+        spec = spec.strip()
+        if spec:
+            yield from expand_target(spec)
+
+
+def expand_target(spec: str) -> Iterator[str]:
+    """Yields every IP a spec covers, formatted as (scheme://)ip(:port).
+
+        A spec is (http(s)://)HOSTS(:PORTS) where HOSTS is an IPv4 address, a
+        CIDR block (10.0.0.0/16) or a dash range (10.0.0.1-10.0.0.50, or
+        10.0.0.1-50 for the last octet), and PORTS is a comma separated list
+        of ports or port ranges (80,8080-8090). Nothing is built up front, so
+        a /8 starts yielding at once and uses constant memory. Expanded
+        targets are Targets.
+
+        A plain IP with at most one port is yielded unchanged, and anything
+        that can't be parsed is too, so the scanner reports it as a bad IP.
+    """
+    scheme = next((s for s in _SCHEMES if spec.startswith(s)), '')
+    hosts, sep, ports = spec[len(scheme):].partition(':')
+    if '/' not in hosts and '-' not in hosts and ',' not in ports and '-' not in ports:
+        yield spec
+        return
+    try:
+        addresses = _parse_hosts(hosts)
+        port_list = _parse_ports(ports) if sep else [None]
+    except ValueError as e:
+        logging.error(f'Could not expand {spec}: {e}')
+        yield spec
+        return
+    for address in addresses:
+        for port in port_list:
+            yield Target(f'{scheme}{address}' if port is None
+                         else f'{scheme}{address}:{port}')
+
+
+def _parse_hosts(hosts: str) -> Iterator[ipaddress.IPv4Address]:
+    """Checks hosts now and returns a lazy iterator over it. Raises ValueError."""
+    if '/' in hosts:
+        # hosts() is lazy and leaves out the network and broadcast addresses.
+        return ipaddress.IPv4Network(hosts, strict=False).hosts()
+    if '-' in hosts:
+        start, end = hosts.split('-', 1)
+        if '.' not in end:
+            # Last octet shorthand, 10.0.0.1-50
+            end = f'{start.rsplit(".", 1)[0]}.{end}'
+        first, last = int(ipaddress.IPv4Address(start)), int(ipaddress.IPv4Address(end))
+        if first > last:
+            raise ValueError(f'Range {hosts} ends before it starts.')
+        return (ipaddress.IPv4Address(i) for i in range(first, last + 1))
+    return iter([ipaddress.IPv4Address(hosts)])
+
+
+def _parse_ports(ports: str) -> list[int]:
+    """Parses e.g. 80,8080-8090. Raises ValueError."""
+    port_list = []
+    for part in ports.split(','):
+        start, sep, end = part.partition('-')
+        if not sep:
+            port_list.append(parse_port(part))
+            continue
+        first, last = parse_port(start), parse_port(end)
+        if first > last:
+            raise ValueError(f'Port range {part} ends before it starts.')
+        port_list.extend(range(first, last + 1))
+    return port_list
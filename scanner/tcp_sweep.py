@@ -0,0 +1,121 @@
+"Non-blocking TCP connect sweep on a selector (epoll on Linux), to find open ports before HTTP."
+import collections
+import errno
+import selectors
+import socket
+import struct
+import time
+from typing import Hashable, Iterable, Iterator, Optional
+
+OPEN, REFUSED, FILTERED = 'open', 'refused', 'filtered'
+_DEFAULT_TIMEOUT = 0.5 # seconds
+_DEFAULT_MAX_IN_FLIGHT = 512 # sockets, keep under the open file limit
+_POLL_INTERVAL = 0.005 # seconds, when waiting for more targets
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+# Close with a reset, so swept sockets don't sit in TIME_WAIT.
+_LINGER_RESET = struct.pack('ii', 1, 0)
+
+# (tag, host, port). tag is handed back with the result.
+SWEEP_TARGET_TYPE = tuple[Hashable, str, int]
+
+
+class TcpSweeper():
+    """Tries a TCP connect to each target, up to max_in_flight at once, each for up to timeout.
+
+        Picklable, it holds no sockets between sweeps.
+    """
+    def __init__(self, timeout: float = _DEFAULT_TIMEOUT,
+                 max_in_flight: int = _DEFAULT_MAX_IN_FLIGHT) -> None:
+        if timeout <= 0:
+            raise ValueError('timeout must be more than 0.')
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1.')
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+
+    def sweep(self, targets: Iterable[Optional[SWEEP_TARGET_TYPE]]
+              ) -> Iterator[tuple[Hashable, str, float]]:
+        """Yields (tag, OPEN, REFUSED or FILTERED, seconds taken) as each connect finishes.
+
+            targets is read lazily, as sockets free up. It may yield None to
+            mean nothing is ready yet, and is asked again after a short poll.
+            Anything but a refusal or success (timeouts, unreachable
+            networks) counts as FILTERED. Connections are closed at once.
+        """
+        targets = iter(targets)
+        selector = selectors.DefaultSelector()
+        # Same timeout for all, so deadlines are in the order sockets were opened.
+        deadlines: collections.deque[tuple[float, socket.socket]] = collections.deque()
+        exhausted = False
+        try:
+            while True:
+                waiting = False
+                while not exhausted and len(selector.get_map()) < self.max_in_flight:
+                    try:
+                        target = next(targets)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if target is None:
+                        waiting = True
+                        break
+                    result = self._connect(selector, deadlines, *target)
+                    if result is not None:
+                        yield result
+                if exhausted and not selector.get_map():
+                    return
+
+                now = time.monotonic()
+                timeout = deadlines[0][0] - now if deadlines else _POLL_INTERVAL
+                if waiting or not exhausted and len(selector.get_map()) < self.max_in_flight:
+                    timeout = min(timeout, _POLL_INTERVAL)
+                for key, _ in selector.select(max(0.0, timeout)):
+                    yield self._finish(selector, key.fileobj, key.data)
+
+                now = time.monotonic()
+                while deadlines and deadlines[0][0] <= now:
+                    _, sock = deadlines.popleft()
+                    # Already finished sockets were closed, fileno -1.
+                    if sock.fileno() != -1:
+                        tag, started = selector.unregister(sock).data
+                        self._close(sock)
+                        yield tag, FILTERED, now - started
+        finally:
+            for key in list(selector.get_map().values()):
+                self._close(key.fileobj)
+            selector.close()
+
+    def _connect(self, selector: selectors.BaseSelector,
+                 deadlines: collections.deque, tag: Hashable, host: str,
+                 port: int) -> Optional[tuple[Hashable, str, float]]:
+        """Starts a connect. Returns a result if it finished (or failed) straight away."""
+        started = time.monotonic()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        code = sock.connect_ex((host, port))
+        if code in _IN_PROGRESS:
+            selector.register(sock, selectors.EVENT_WRITE, (tag, started))
+            deadlines.append((started + self.timeout, sock))
+            return None
+        self._close(sock)
+        return tag, self._state(code), time.monotonic() - started
+
+    def _finish(self, selector: selectors.BaseSelector, sock: socket.socket,
+                data: tuple[Hashable, float]) -> tuple[Hashable, str, float]:
+        tag, started = data
+        selector.unregister(sock)
+        code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        self._close(sock)
+        return tag, self._state(code), time.monotonic() - started
+
+    def _state(self, code: int) -> str:
+        if code == 0:
+            return OPEN
+        return REFUSED if code == errno.ECONNREFUSED else FILTERED
+
+    def _close(self, sock: socket.socket) -> None:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RESET)
+        except OSError:
+            pass
+        sock.close()
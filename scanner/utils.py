@@ -1,4 +1,4 @@
-"Utils for web_server_scanner. Provides enums and flagged versions."
+"Utils for web_server_scanner. Provides enums, flagged versions and result (de)serialization."
 import enum
 
 NGINX_FLAGGED_VERSIONS = ('1.2',)
@@ -26,4 +26,23 @@ class StatusEnum(str, enum.Enum):
     """Enum class for statuses. Format ruins enums so use another field for more detail."""
     good = 'Good'
     bad_ip = 'Bad IP given'
-    response_err = 'Failure in response, see logs or status...'
\ No newline at end of file
+    response_err = 'Failure in response, see logs or status...'
+    refused = 'Port closed, connection refused'
+    filtered = 'No answer to connect, port filtered or host down'
+
+_RESULT_ENUMS = {'WebServerSoftware': WebSrvEnum, 'RootListing': DirListEnum, 'Status': StatusEnum}
+
+def dump_result(result: dict) -> dict:
+    """Result dict with enums replaced by their names, for storing as JSON."""
+    dumped = {key: value.name if key in _RESULT_ENUMS else value for key, value in result.items()}
+    if 'Probes' in result:
+        dumped['Probes'] = {path: listing.name for path, listing in result['Probes'].items()}
+    return dumped
+
+def load_result(dumped: dict) -> dict:
+    """Reverses dump_result. Raises KeyError for unknown enum names."""
+    result = {key: _RESULT_ENUMS[key][value] if key in _RESULT_ENUMS else value
+              for key, value in dumped.items()}
+    if 'Probes' in dumped:
+        result['Probes'] = {path: DirListEnum[name] for path, name in dumped['Probes'].items()}
+    return result
@@ -1,33 +1,153 @@
 "Takes IPs, checks if server software and version are flagged, and root listing avail."
+import asyncio
+import codecs
+import queue
 import requests
+import requests.adapters
 import logging
-import re
-from typing import Optional, Union, Type
-from collections import defaultdict
+import ipaddress
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Sequence, Union
+from urllib.parse import urljoin, urlsplit
 
-from utils import WebSrvEnum, get_flagged_versions, DirListEnum, StatusEnum
+import async_http
+import flagged_rules
+import result_cache
+import result_store
+import scan_metrics
+import scan_scheduler
+import target_index
+import targets
+import tcp_sweep
+from utils import WebSrvEnum, DirListEnum, StatusEnum
 
-# Use a nested dict for easy JSON serialization. Last value is optional status msg.
-# {ip: {descriptor: enum, enum, enum, status}}
-IP_MAP_TYPE = defaultdict[str, dict[str, Union[Type[WebSrvEnum], Type[DirListEnum], Type[StatusEnum], Optional[str]]]]
+# A {ip: {descriptor: enum, enum, enum, status}} dict, but stored in columns so
+# millions of IPs fit in memory. JSON serializable as it is.
+IP_MAP_TYPE = result_store.ResultStore
+# A single {descriptor: enum, enum, enum, status} entry, as yielded by iter_scan.
+# With probes, also 'Probes': {path: DirListEnum}.
+RESULT_TYPE = dict[str, Union[WebSrvEnum, DirListEnum, StatusEnum, Optional[str],
+                              dict[str, DirListEnum]]]
+_RESULT_KEYS = ('WebServerSoftware', 'RootListing', 'Status', 'ErrorMsg')
+# Marks a failure the scheduler may retry. Never yielded.
+_RETRY_KEY = '_Retry'
+# With dedup, the only key of a placeholder result for a repeat of a target already
+# claimed in the scan, holding its packed key. Swapped for that target's result.
+_REPEAT_KEY = '_Repeat'
+# A claimed target's value in the dedup index until it has a result.
+_IN_FLIGHT = 0
+# Its value after, with preserve_ips=False. Otherwise its result's number + 1.
+_SCANNED = 1
+# Statuses meaning slow down or try later, retried like timeouts.
+_RETRYABLE_STATUS_CODES = (429, 503)
+_REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
 
 
 _ERROR_STATUS_MSG = 'Bad status... {}'
 _REQUEST_TIMEOUT = 3 # seconds
+ENGINES = ('sync', 'async')
+_DEFAULT_MAX_IN_FLIGHT = 500
+_DEFAULT_MAX_BODY_BYTES = 1024 * 1024
+_BODY_CHUNK_SIZE = 16384
+_ROOT_LISTING_MARKER = 'Index of'
+ORDERS = ('completion', 'input')
+_QUEUE_POLL_INTERVAL = 0.005 # seconds
+_DEFAULT_POOL_SIZE = async_http._DEFAULT_POOL_SIZE
+_DEFAULT_POOL_HOSTS = async_http._DEFAULT_POOL_HOSTS
+# Past this much unread body a connection is closed rather than read to the end for reuse.
+_MAX_DRAIN_BYTES = async_http._MAX_DRAIN_BYTES
+_DONE = object()
+
+_SCAN_RESULT_TYPE = tuple[str, RESULT_TYPE]
+
+
+class BadStatusError(ValueError):
+    """The server answered with a status other than 200."""
+    def __init__(self, status_code: int) -> None:
+        super().__init__(f'Bad response code: {status_code}')
+        self.status_code = status_code
 
 
 class WebServerScanner():
     """Scan web server from list of IPs to check web server type and / dir listing."""
+    # Class level so the checks work without __init__ (see tests).
+    max_body_bytes: Optional[int] = _DEFAULT_MAX_BODY_BYTES
+    rules: flagged_rules.RuleIndex = flagged_rules.DEFAULT_RULES
+    cache: Optional[result_cache.ResultCache] = None
+    metrics: Optional[scan_metrics.ScanMetrics] = None
+    scheduler: Optional[scan_scheduler.Scheduler] = None
+    sweeper: Optional[tcp_sweep.TcpSweeper] = None
+    probes: tuple[str, ...] = ()
+    follow_redirects = 0
+    keep_alive = True
+    pool_size = _DEFAULT_POOL_SIZE
+    pool_hosts = _DEFAULT_POOL_HOSTS
+    dedup = False
+    _local = threading.local()
+    _retrying = False
+    # Only during a scan with dedup, see _claim.
+    _claimed: Optional[target_index.TargetIndex] = None
+    _distinct: Optional[target_index.ResultTable] = None
+    _waiting: dict[int, list[str]] = {}
+    _dedup_lock = threading.Lock()
+
     def __init__(self, ips: list, scan_software: bool = True, scan_root: bool = True,
-                 preserve_ips: bool = True, log_level: str = 'WARNING') -> None:
+                 preserve_ips: bool = True, log_level: str = 'WARNING',
+                 engine: str = 'sync', max_in_flight: int = _DEFAULT_MAX_IN_FLIGHT,
+                 max_body_bytes: Optional[int] = _DEFAULT_MAX_BODY_BYTES,
+                 rules: Optional[flagged_rules.RuleIndex] = None,
+                 cache: Optional[result_cache.ResultCache] = None,
+                 metrics: Optional[scan_metrics.ScanMetrics] = None,
+                 scheduler: Optional[scan_scheduler.Scheduler] = None,
+                 sweeper: Optional[tcp_sweep.TcpSweeper] = None,
+                 probes: Sequence[str] = (), follow_redirects: int = 0,
+                 keep_alive: bool = True, pool_size: int = _DEFAULT_POOL_SIZE,
+                 pool_hosts: int = _DEFAULT_POOL_HOSTS, dedup: bool = False) -> None:
+        if engine not in ENGINES:
+            raise ValueError(f'Invalid engine {engine}, expected one of {ENGINES}.')
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1.')
+        if max_body_bytes is not None and max_body_bytes < 1:
+            raise ValueError('max_body_bytes must be at least 1, or None for no limit.')
+        for path in probes:
+            if not path.startswith('/'):
+                raise ValueError(f'Invalid probe path {path}, expected one starting with /.')
+        if probes and cache is not None:
+            raise ValueError('Results with probes are not cached, pass probes or cache.')
+        if follow_redirects < 0:
+            raise ValueError('follow_redirects must be at least 0.')
+        if pool_size < 1 or pool_hosts < 1:
+            raise ValueError('pool_size and pool_hosts must be at least 1.')
         self.ips = ips
         self.scan_software = scan_software
         self.scan_root = scan_root
         self.preserve_ips = preserve_ips
-        self.ip_map: IP_MAP_TYPE = defaultdict(lambda: {'WebServerSoftware': WebSrvEnum,
-                                                        'RootListing': DirListEnum,
-                                                        'Status': StatusEnum,
-                                                        'ErrorMsg': None})
+        self.engine = engine
+        self.max_in_flight = max_in_flight
+        self.max_body_bytes = max_body_bytes
+        if rules is not None:
+            self.rules = rules
+        # Opt in, results are only cached if one is given.
+        self.cache = cache
+        # Opt in too, scans aren't timed unless one is given.
+        self.metrics = metrics
+        # Without one, targets go in the order given with a fixed timeout and no retries.
+        self.scheduler = scheduler
+        # Without one, every valid target gets an HTTP request however dead it is.
+        self.sweeper = sweeper
+        # Paths checked for listings on each host after /, over the same connection.
+        self.probes = tuple(probes)
+        # On-host redirects followed, by / and the probes alike.
+        self.follow_redirects = follow_redirects
+        self.keep_alive = keep_alive
+        self.pool_size = pool_size
+        self.pool_hosts = pool_hosts
+        # Scan each (scheme, ip, port) once however it's spelled, see _iter_scan.
+        self.dedup = dedup
+        # A requests session per thread, see _session.
+        self._local = threading.local()
+        self.ip_map: IP_MAP_TYPE = result_store.ResultStore()
         logging.basicConfig(level=log_level)
         logging.debug(f'WebServerScanner() called with {locals()}.')
 
@@ -37,85 +157,798 @@ class WebServerScanner():
             Main logic. If something is wrong where a server cannot be checked
             at all, 3 bad enums will be returned (for consistent types). Else,
             check the specified parameters (server software and root listing),
-            and add enum values describing them to the ip_map.
+            and add enum values describing them to the ip_map. With
+            engine='async', up to max_in_flight IPs are scanned at once on an
+            asyncio event loop, the ip_map is the same either way.
             
             Raises:
                 ValueError: If the args to the class indicate nothing to scan.
             
             Returns:
-                dict: A dict containing a WebServerSoftwareEnum, DirListingEnum,
-                StatusEnum, and optional error status message if applicable
-                for each IP passed.
+                ResultStore: A read-only dict containing a
+                WebServerSoftwareEnum, DirListingEnum, StatusEnum, and optional
+                error status message if applicable for each IP passed.
+        """
+        for ip, result in self.iter_scan(self.ips, order='input'):
+            self._update_ip_map(ip, result)
+
+        return self.ip_map
+
+    def iter_scan(self, ips: Optional[Iterable[str]] = None, order: str = 'completion',
+                  reorder_buffer: Optional[int] = None) -> Iterator[tuple[str, RESULT_TYPE]]:
+        """Like __call__ but yields (ip, result) as each scan completes, keeping no ip_map.
+
+            ips can be any iterable (e.g. a generator reading a file) and is only
+            consumed as fast as IPs are scanned, so memory stays flat however
+            many there are. Defaults to the IPs given to __init__.
+
+            With dedup, each (scheme, ip, port) is scanned once however it's
+            spelled, e.g. 10.0.0.1, http://10.0.0.1 and 10.0.0.1:80. With
+            preserve_ips every spelling is still yielded, with the result of
+            the first. A repeat comes in its place in input order if that
+            result is ready by then, otherwise straight after it. Without
+            preserve_ips results are keyed by the canonical spelling
+            (http://10.0.0.1:80) and repeats aren't yielded. Seen targets are
+            kept in a TargetIndex, and their results in a ResultTable.
+
+            Args:
+                order: 'completion' yields results as soon as they are ready.
+                    'input' yields them in the order the IPs were given, holding
+                    at most reorder_buffer finished results back. Only matters
+                    for the async engine, sync is always in input order.
+                reorder_buffer: Defaults to 4 * max_in_flight. Scans in flight
+                    are also capped by it when order='input'.
+
+            Raises:
+                ValueError: If the args to the class indicate nothing to scan,
+                    or order/reorder_buffer are invalid.
         """
         if (not self.scan_root) and (not self.scan_software):
             logging.error('Invalid args: Nothing to scan.')
             raise ValueError('Invalid args: Nothing to scan.')
+        if order not in ORDERS:
+            raise ValueError(f'Invalid order {order}, expected one of {ORDERS}.')
+        if reorder_buffer is None:
+            reorder_buffer = 4 * self.max_in_flight
+        if reorder_buffer < 1:
+            raise ValueError('reorder_buffer must be at least 1.')
+        if ips is None:
+            ips = self.ips
+        # Checks above happen now, not on the first next().
+        return self._iter_scan(ips, order, reorder_buffer)
+
+    def _iter_scan(self, ips: Iterable[str], order: str,
+                   reorder_buffer: int) -> Iterator[tuple[str, RESULT_TYPE]]:
+        if self.scheduler is not None:
+            # 'input' order is then the interleaved order.
+            ips = self.scheduler.interleave(ips)
+        retry: list[str] = []
+        if self.dedup:
+            self._claimed = target_index.TargetIndex()
+            self._distinct = target_index.ResultTable()
+            self._waiting = {}
+            self._dedup_lock = threading.Lock()
+        try:
+            for ip, result in self._iter_results(ips, order, reorder_buffer):
+                if _REPEAT_KEY in result:
+                    yield from self._iter_repeat(ip, result[_REPEAT_KEY])
+                    continue
+                if self.scheduler is not None:
+                    self.scheduler.count_scanned()
+                if (result.pop(_RETRY_KEY, False) and self.scheduler.max_retries > 0
+                        and self.scheduler.allow_retry()):
+                    retry.append(ip)
+                    continue
+                yield from self._finish(ip, result)
+            if retry:
+                yield from self._iter_retries(retry, order, reorder_buffer)
+        finally:
+            self._retrying = False
+            self._claimed = self._distinct = None
+            self._waiting = {}
+            if self.cache is not None:
+                self.cache.flush()
+
+    def _finish(self, ip: str, result: RESULT_TYPE) -> Iterator[_SCAN_RESULT_TYPE]:
+        """Yields a target's final result, then those of any repeats waiting on it."""
+        self._log_scan_complete(ip, result)
+        waiting: list[str] = []
+        # Bad IPs are never claimed.
+        if self._claimed is not None and result['Status'].name != StatusEnum.bad_ip.name:
+            key = self._target_key(ip)
+            with self._dedup_lock:
+                number = self._claimed[key] = (self._distinct.add(result, ip) + 1
+                                               if self.preserve_ips else _SCANNED)
+                waiting = self._waiting.pop(key, [])
+        yield ip, result
+        for spelling in waiting:
+            yield spelling, self._distinct.get(number - 1, spelling)
+
+    def _iter_repeat(self, ip: str, key: int) -> Iterator[_SCAN_RESULT_TYPE]:
+        """Yields the result for a repeat of key, or holds it until that's ready."""
+        if not self.preserve_ips:
+            # Keyed the same as the first, which is yielded instead.
+            return
+        with self._dedup_lock:
+            number = self._claimed.get(key)
+            if number == _IN_FLIGHT:
+                self._waiting.setdefault(key, []).append(ip)
+                return
+        logging.debug(f'{ip} was already scanned, reusing its result.')
+        yield ip, self._distinct.get(number - 1, ip)
+
+    def _claim(self, ip: str) -> Optional[_SCAN_RESULT_TYPE]:
+        """With dedup, claims ip's target for this scan unless it already was.
+
+            Returns None if ip should be scanned, else a placeholder result for
+            _iter_scan to swap for the real one. Retries are never repeats.
+        """
+        if self._claimed is None or self._retrying:
+            return None
+        key = self._target_key(ip)
+        if key is None:
+            return None
+        with self._dedup_lock:
+            if self._claimed.add(key, _IN_FLIGHT):
+                return None
+        return (ip, {_REPEAT_KEY: key})
+
+    def _target_key(self, ip: str) -> Optional[int]:
+        """ip's (scheme, ip, port) packed into an int, or None if it isn't valid."""
+        try:
+            formatted_ip = self._format_and_validate_ip(ip)
+        except ValueError:
+            return None
+        return result_store.pack_key(targets.normalize(formatted_ip))
+
+    def _iter_retries(self, retry: list[str], order: str,
+                      reorder_buffer: int) -> Iterator[tuple[str, RESULT_TYPE]]:
+        """Rescans targets whose first try may have failed transiently, after everything else.
+
+            Keys from iter_scan rescan to the same key, so they're used as is.
+        """
+        self._retrying = True
+        for attempt in range(1, self.scheduler.max_retries + 1):
+            if not retry:
+                return
+            logging.info(f'Retrying {len(retry)} targets, attempt {attempt}.')
+            time.sleep(self.scheduler.retry_delay)
+            ips, retry = retry, []
+            for ip, result in self._iter_results(ips, order, reorder_buffer):
+                if (result.pop(_RETRY_KEY, False) and attempt < self.scheduler.max_retries
+                        and self.scheduler.allow_retry()):
+                    retry.append(ip)
+                    continue
+                yield from self._finish(ip, result)
+
+    def _iter_results(self, ips: Iterable[str], order: str,
+                      reorder_buffer: int) -> Iterator[_SCAN_RESULT_TYPE]:
+        if self.sweeper is not None:
+            return self._iter_results_swept(ips, order, reorder_buffer)
+        if self.engine == 'async':
+            return self._iter_results_async(ips, order, reorder_buffer)
+        return (self._claim(ip) or self._scan_ip(ip) for ip in ips)
 
-        for ip in self.ips:
-            logging.info(f'Starting scan on {ip}. IP may change if not preserved.')
-            # Check and format the IP, continue to next IP if invalid
+    def _iter_results_swept(self, ips: Iterable[str], order: str,
+                            reorder_buffer: int) -> Iterator[_SCAN_RESULT_TYPE]:
+        """TCP sweeps every target and sends only open ones on to HTTP, both stages at once.
+
+            The sweep runs on one thread and the HTTP stage (sync or async) on
+            another, so requests start as soon as a port answers. Refused and
+            filtered targets are yielded straight from the sweep. At most
+            reorder_buffer targets are between being read from ips and being
+            yielded, whatever the order.
+        """
+        window = threading.Semaphore(reorder_buffer)
+        # Both are bounded by the window.
+        out: queue.Queue = queue.Queue()
+        open_ips: queue.Queue = queue.Queue()
+        stop = threading.Event()
+        loop = asyncio.new_event_loop() if self.engine == 'async' else None
+        async_open_ips: Optional[asyncio.Queue] = None
+
+        def admitted() -> Iterator[Optional[tcp_sweep.SWEEP_TARGET_TYPE]]:
+            for index, ip in enumerate(ips):
+                # Never block the sweep, its sockets still need polling.
+                while not window.acquire(blocking=False):
+                    if stop.is_set():
+                        return
+                    yield None
+                try:
+                    formatted_ip = self._format_and_validate_ip(ip)
+                except ValueError:
+                    # Rejected again without a request, but timed and logged as usual.
+                    out.put((index, self._scan_ip(ip)))
+                    continue
+                # Repeats aren't swept either.
+                if repeat := self._claim(ip):
+                    out.put((index, repeat))
+                    continue
+                # A connect counts against the rate limits like a request does.
+                if self.scheduler is not None:
+                    send_at = time.monotonic() + self.scheduler.delay(formatted_ip)
+                    while time.monotonic() < send_at:
+                        if stop.is_set():
+                            return
+                        yield None
+                yield ((index, ip, formatted_ip), *targets.host_port(formatted_ip))
+
+        def hand_over(item: object) -> None:
+            if loop is None:
+                return open_ips.put(item)
+            try:
+                loop.call_soon_threadsafe(async_open_ips.put_nowait, item)
+            except RuntimeError:
+                # The loop was closed, the caller stopped early.
+                pass
+
+        def sweep() -> None:
+            try:
+                for (index, ip, formatted_ip), state, seconds in self.sweeper.sweep(admitted()):
+                    if stop.is_set():
+                        return
+                    if state == tcp_sweep.OPEN:
+                        hand_over((index, ip))
+                        continue
+                    expected_ip = self._expected_ip(ip, formatted_ip)
+                    out.put((index, self._unreachable_result(expected_ip, state, seconds)))
+            except BaseException as e:
+                out.put(e)
+            finally:
+                hand_over(_DONE)
+
+        def probe() -> None:
             try:
-                formatted_ip = self._format_and_validate_ip(ip)
+                if loop is None:
+                    while (item := open_ips.get()) is not _DONE and not stop.is_set():
+                        index, ip = item
+                        out.put((index, self._scan_ip(ip)))
+                else:
+                    loop.run_until_complete(probe_async())
+            except BaseException as e:
+                out.put(e)
+            finally:
+                out.put(_DONE)
+
+        async def probe_async() -> None:
+            pool = self._connection_pool()
+
+            async def worker() -> None:
+                while (item := await async_open_ips.get()) is not _DONE:
+                    index, ip = item
+                    out.put((index, await self._scan_ip_async(ip, pool)))
+                # Put it back for the other workers.
+                async_open_ips.put_nowait(_DONE)
+
+            try:
+                await asyncio.gather(*(worker() for _ in range(self.max_in_flight)))
+            finally:
+                if pool is not None:
+                    pool.close()
+
+        if loop is not None:
+            async_open_ips = asyncio.Queue()
+        threads = [threading.Thread(target=sweep, name='scanner-tcp-sweep', daemon=True),
+                   threading.Thread(target=probe, name='scanner-http-probe', daemon=True)]
+        for thread in threads:
+            thread.start()
+        held_back: dict[int, _SCAN_RESULT_TYPE] = {}
+        next_index = 0
+        try:
+            # The probe thread is done last, after the sweep handed it _DONE.
+            while (item := out.get()) is not _DONE:
+                if isinstance(item, BaseException):
+                    raise item
+                index, scan_result = item
+                if order == 'completion':
+                    window.release()
+                    yield scan_result
+                    continue
+                held_back[index] = scan_result
+                while next_index in held_back:
+                    window.release()
+                    yield held_back.pop(next_index)
+                    next_index += 1
+        finally:
+            stop.set()
+            if loop is not None:
+                try:
+                    loop.call_soon_threadsafe(self._cancel_all_tasks, loop)
+                except RuntimeError:
+                    # Already closed.
+                    pass
+                threads[1].join()
+                loop.close()
+
+    @staticmethod
+    def _cancel_all_tasks(loop: asyncio.AbstractEventLoop) -> None:
+        for task in asyncio.all_tasks(loop):
+            task.cancel()
+
+    def output_key(self, ip: str) -> str:
+        """The key ip's result will be under in the ip_map or from iter_scan."""
+        if not self.preserve_ips:
+            try:
+                return self._expected_ip(ip, self._format_and_validate_ip(ip))
             except ValueError:
-                self._update_ip_map(ip, WebSrvEnum.err, DirListEnum.err,
-                                    StatusEnum.bad_ip, 'Pass a valid IP.')
-                self._log_scan_complete(ip, success = False)
-                continue
-            # Return formatted IP or original IP if preserve_ips
-            expected_ip = ip if self.preserve_ips else formatted_ip
-
-            # Make the request, check status
+                pass
+        return ip
+
+    def _expected_ip(self, ip: str, formatted_ip: str) -> str:
+        """The key a valid ip's result is yielded under."""
+        if self.preserve_ips:
+            return ip
+        return targets.normalize(formatted_ip) if self.dedup else formatted_ip
+
+    def _scan_ip(self, ip: str) -> _SCAN_RESULT_TYPE:
+        """Scans a single IP with requests, blocking until done."""
+        if self.metrics is None:
+            return self._scan_ip_traced(ip, None)
+        trace = scan_metrics.Trace()
+        scan_result = self._scan_ip_traced(ip, trace)
+        self.metrics.record(trace, scan_result[1])
+        return scan_result
+
+    def _scan_ip_traced(self, ip: str, trace: Optional[scan_metrics.Trace]) -> _SCAN_RESULT_TYPE:
+        logging.info(f'Starting scan on {ip}. IP may change if not preserved.')
+        # Check and format the IP, skip the request if invalid
+        try:
+            formatted_ip = self._format_and_validate_ip(ip)
+        except ValueError:
+            return self._bad_ip_result(ip)
+        finally:
+            if trace is not None:
+                trace.lap('validate')
+        # Return formatted IP or original IP if preserve_ips
+        expected_ip = self._expected_ip(ip, formatted_ip)
+        cache_key = self._cache_key(formatted_ip)
+        if cached := self._cached_result(expected_ip, cache_key):
+            return cached
+
+        # Make the request, check status
+        if trace is not None:
+            trace.mark()
+        try:
+            resp = self._make_request(formatted_ip)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            if trace is not None:
+                trace.error = type(e).__name__
+                trace.lap('first_byte')
+            # Other paths may still be there if / wasn't.
+            return self._cache_result(cache_key, self._add_probes(
+                self._response_err_result(expected_ip, e), formatted_ip,
+                isinstance(e, BadStatusError)))
+        if trace is not None:
+            # requests doesn't time connecting apart from waiting on headers.
+            trace.lap('first_byte')
+
+        # The body is streamed, so release the connection whatever was read.
+        try:
+            scan_result = self._classify(expected_ip, resp, trace)
+        finally:
+            self._release(resp)
+        return self._cache_result(cache_key, self._add_probes(scan_result, formatted_ip))
+
+    def _iter_results_async(self, ips: Iterable[str], order: str,
+                            reorder_buffer: int) -> Iterator[_SCAN_RESULT_TYPE]:
+        """Runs the event loop in a thread, handing results back through a bounded queue.
+
+            The loop keeps scanning while the caller handles each result, and
+            stops (cancelling scans in flight) when the generator is closed.
+        """
+        out: queue.Queue = queue.Queue(maxsize=self.max_in_flight)
+        loop = asyncio.new_event_loop()
+        main = loop.create_task(self._produce_async(ips, order, reorder_buffer, out))
+
+        def run_loop() -> None:
             try:
-                resp = self._make_request(formatted_ip)
-            except (requests.exceptions.RequestException, ValueError) as e:
-                    self._update_ip_map(expected_ip, WebSrvEnum.err, DirListEnum.err,
-                                        StatusEnum.response_err, _ERROR_STATUS_MSG.format(e))
-                    self._log_scan_complete(expected_ip, success = False)
+                loop.run_until_complete(main)
+            except BaseException as e:
+                out.put(e)
+            out.put(_DONE)
+
+        thread = threading.Thread(target=run_loop, name='scanner-event-loop', daemon=True)
+        thread.start()
+        try:
+            while (item := out.get()) is not _DONE:
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            loop.call_soon_threadsafe(main.cancel)
+            # Drain so the loop thread isn't stuck on a full queue.
+            while thread.is_alive():
+                try:
+                    out.get(timeout=_QUEUE_POLL_INTERVAL)
+                except queue.Empty:
+                    pass
+            loop.close()
+
+    async def _produce_async(self, ips: Iterable[str], order: str, reorder_buffer: int,
+                             out: queue.Queue) -> None:
+        """Scans every IP with at most max_in_flight requests open, putting results in out."""
+        # Workers pull from a shared iterator so only max_in_flight tasks ever exist.
+        pending = enumerate(ips)
+        pool = self._connection_pool()
+        # In input order, a scan can't start until it is within reorder_buffer of
+        # the oldest unfinished one, which bounds the results held back.
+        window = asyncio.Semaphore(reorder_buffer)
+        held_back: dict[int, _SCAN_RESULT_TYPE] = {}
+        next_index = 0
+        emit_lock = asyncio.Lock()
+
+        async def put(result: _SCAN_RESULT_TYPE) -> None:
+            # Never block the loop on the caller, poll instead.
+            while True:
+                try:
+                    return out.put_nowait(result)
+                except queue.Full:
+                    await asyncio.sleep(_QUEUE_POLL_INTERVAL)
+
+        async def emit(index: int, result: _SCAN_RESULT_TYPE) -> None:
+            nonlocal next_index
+            async with emit_lock:
+                if order == 'completion':
+                    return await put(result)
+                held_back[index] = result
+                while next_index in held_back:
+                    await put(held_back.pop(next_index))
+                    window.release()
+                    next_index += 1
+
+        async def worker() -> None:
+            while True:
+                if order == 'input':
+                    await window.acquire()
+                try:
+                    index, ip = next(pending)
+                except StopIteration:
+                    # Pass the slot on so workers waiting on it see the end too.
+                    if order == 'input':
+                        window.release()
+                    return
+                await emit(index, self._claim(ip) or await self._scan_ip_async(ip, pool))
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.max_in_flight)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if pool is not None:
+                pool.close()
+
+    async def _scan_ip_async(self, ip: str, pool: Optional[async_http.ConnectionPool] = None
+                             ) -> _SCAN_RESULT_TYPE:
+        """Same as _scan_ip but awaits the request instead of blocking."""
+        if self.metrics is None:
+            return await self._scan_ip_async_traced(ip, None, pool)
+        trace = scan_metrics.Trace()
+        scan_result = await self._scan_ip_async_traced(ip, trace, pool)
+        self.metrics.record(trace, scan_result[1])
+        return scan_result
+
+    async def _scan_ip_async_traced(self, ip: str, trace: Optional[scan_metrics.Trace],
+                                    pool: Optional[async_http.ConnectionPool] = None
+                                    ) -> _SCAN_RESULT_TYPE:
+        logging.info(f'Starting scan on {ip}. IP may change if not preserved.')
+        try:
+            formatted_ip = self._format_and_validate_ip(ip)
+        except ValueError:
+            return self._bad_ip_result(ip)
+        finally:
+            if trace is not None:
+                trace.lap('validate')
+        expected_ip = self._expected_ip(ip, formatted_ip)
+        cache_key = self._cache_key(formatted_ip)
+        if cached := self._cached_result(expected_ip, cache_key):
+            return cached
+
+        try:
+            resp = await self._make_request_async(formatted_ip, trace, pool)
+        except (async_http.RequestError, ValueError) as e:
+            if trace is not None:
+                trace.error = type(e).__name__
+                trace.mark()
+            return self._cache_result(cache_key, await self._add_probes_async(
+                self._response_err_result(expected_ip, e), formatted_ip, pool,
+                isinstance(e, BadStatusError)))
+        if trace is not None:
+            trace.mark()
+
+        scan_result = self._classify(expected_ip, resp, trace)
+        return self._cache_result(cache_key,
+                                  await self._add_probes_async(scan_result, formatted_ip, pool))
+
+    def _add_probes(self, scan_result: _SCAN_RESULT_TYPE, formatted_ip: str,
+                    reachable: bool = True) -> _SCAN_RESULT_TYPE:
+        """Adds a listing check of each probe path to the result, if there are any.
+
+            Hosts that couldn't be reached get err for every path without trying.
+        """
+        if self.probes:
+            probes = dict.fromkeys(self.probes, DirListEnum.err)
+            for path in self.probes if reachable else ():
+                try:
+                    resp = self._make_request(formatted_ip, path)
+                except BadStatusError:
+                    probes[path] = DirListEnum.unavailable
                     continue
-    
-            if self.scan_software:
-                srv_type = self._server_software(resp)
-            else:
-                srv_type = WebSrvEnum.disabled
-            if self.scan_root:
-                root_listing = self._root_listing(resp)
-            else:
-                root_listing = DirListEnum.disabled
-            self._update_ip_map(expected_ip, srv_type, root_listing,
-                                StatusEnum.good, None)
-            self._log_scan_complete(expected_ip, success = True)
-            
-        return self.ip_map
-    
+                except (requests.exceptions.RequestException, ValueError):
+                    continue
+                try:
+                    probes[path] = self._root_listing(resp)
+                finally:
+                    self._release(resp)
+            scan_result[1]['Probes'] = probes
+        return scan_result
+
+    async def _add_probes_async(self, scan_result: _SCAN_RESULT_TYPE, formatted_ip: str,
+                                pool: Optional[async_http.ConnectionPool],
+                                reachable: bool = True) -> _SCAN_RESULT_TYPE:
+        """Async version of _add_probes."""
+        if self.probes:
+            probes = dict.fromkeys(self.probes, DirListEnum.err)
+            for path in self.probes if reachable else ():
+                try:
+                    resp = await self._make_request_async(formatted_ip, None, pool, path,
+                                                          read_body=True)
+                except BadStatusError:
+                    probes[path] = DirListEnum.unavailable
+                    continue
+                except (async_http.RequestError, ValueError):
+                    continue
+                probes[path] = self._root_listing(resp)
+            scan_result[1]['Probes'] = probes
+        return scan_result
+
+    def _cache_key(self, formatted_ip: str) -> Optional[str]:
+        """Normalized target plus the options and rules that change the result. None if not caching."""
+        if self.cache is None:
+            return None
+        return (f'{targets.normalize(formatted_ip)}|{int(self.scan_software)}{int(self.scan_root)}'
+                f'|{self.rules.fingerprint}')
+
+    def _cached_result(self, ip: str, cache_key: Optional[str]) -> Optional[_SCAN_RESULT_TYPE]:
+        if cache_key is None:
+            return None
+        result = self.cache.get(cache_key)
+        if result is None:
+            return None
+        logging.debug(f'Cache hit for {ip}, skipping request.')
+        result['Cached'] = True
+        return (ip, result)
+
+    def _cache_result(self, cache_key: Optional[str],
+                      scan_result: _SCAN_RESULT_TYPE) -> _SCAN_RESULT_TYPE:
+        """Stores a fresh result and marks it as not cached. Returns it."""
+        if cache_key is not None:
+            # Failures about to be retried are cached after the retry instead.
+            if not scan_result[1].get(_RETRY_KEY):
+                self.cache.put(cache_key, scan_result[1])
+            scan_result[1]['Cached'] = False
+        return scan_result
+
+    def _make_result(self, software: WebSrvEnum, root_listing: DirListEnum, status: StatusEnum,
+                     error_msg: Optional[str]) -> RESULT_TYPE:
+        return dict(zip(_RESULT_KEYS, (software, root_listing, status, error_msg)))
+
+    def _bad_ip_result(self, ip: str) -> _SCAN_RESULT_TYPE:
+        return (ip, self._make_result(WebSrvEnum.err, DirListEnum.err, StatusEnum.bad_ip,
+                                      'Pass a valid IP.'))
+
+    def _unreachable_result(self, ip: str, state: str, seconds: float) -> _SCAN_RESULT_TYPE:
+        """Result for a target the TCP sweep found refused or filtered."""
+        if state == tcp_sweep.REFUSED:
+            scan_result = (ip, self._make_result(WebSrvEnum.err, DirListEnum.err,
+                                                 StatusEnum.refused, 'Connection refused.'))
+        else:
+            scan_result = (ip, self._make_result(WebSrvEnum.err, DirListEnum.err,
+                                                 StatusEnum.filtered, 'Connect timed out.'))
+        if self.metrics is not None:
+            trace = scan_metrics.Trace()
+            trace.started -= seconds
+            trace.timings['connect'] = seconds
+            self.metrics.record(trace, scan_result[1])
+        return scan_result
+
+    def _response_err_result(self, ip: str, e: Exception) -> _SCAN_RESULT_TYPE:
+        result = self._make_result(WebSrvEnum.err, DirListEnum.err, StatusEnum.response_err,
+                                   _ERROR_STATUS_MSG.format(e))
+        if (self.scheduler is not None and self.scheduler.max_retries > 0
+                and self._retryable(e)):
+            result[_RETRY_KEY] = True
+        return (ip, result)
+
+    def _retryable(self, e: Exception) -> bool:
+        """If e may not happen again, e.g. a timeout or being told to slow down."""
+        if isinstance(e, BadStatusError):
+            return e.status_code in _RETRYABLE_STATUS_CODES
+        return isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                              async_http.ConnectTimeout, async_http.ConnectError,
+                              async_http.ReadTimeout))
+
+    def _classify(self, ip: str, resp: Union[requests.Response, async_http.AsyncResponse],
+                  trace: Optional[scan_metrics.Trace] = None) -> _SCAN_RESULT_TYPE:
+        """Runs the enabled checks on a good response."""
+        if self.scan_software:
+            srv_type = self._server_software(resp)
+        else:
+            srv_type = WebSrvEnum.disabled
+        if trace is not None:
+            trace.lap('classify')
+        if self.scan_root:
+            root_listing = self._root_listing(resp)
+        else:
+            root_listing = DirListEnum.disabled
+        if trace is not None:
+            # The sync engine reads the body here, the async one already has.
+            trace.lap('body' if self.engine == 'sync' else 'classify')
+        return (ip, self._make_result(srv_type, root_listing, StatusEnum.good, None))
+
     def _format_and_validate_ip(self, ip) -> str:
         """Adds http to IP if needed. Raises ValueError if invalid IP."""
+        if isinstance(ip, targets.Target):
+            return ip if ip.startswith(('http://', 'https://')) else 'http://' + ip
         # requests expects an IP with http://
         if not ip.startswith(("http://", "https://")):
             logging.debug(f'{ip} did not start with http(s)://, adding.')
             ip = "http://" + ip
-        # Matches "http(s)://" prefix + IP address + optional port. No path.
-        pattern = r'^(https?://)\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?::\d{1,5})?$'
-        if not re.match(pattern, ip):
+        # "http(s)://" prefix + IPv4 address + optional port. No path.
+        address, sep, port = ip.split('://', 1)[1].partition(':')
+        try:
+            ipaddress.IPv4Address(address)
+            if sep:
+                targets.parse_port(port)
+        except ValueError:
             logging.error(f'{ip} is not valid.')
             raise ValueError(f'{ip} is not valid.')
         
         return ip
         
-    def _make_request(self, ip: str) -> requests.Response:
+    def _make_request(self, ip: str, path: str = '') -> requests.Response:
         """Sends GET HTTP request, return it and HTTP status code. Raises RequestException."""
+        url = ip + path
         try:
-            # Redirects disabled so that we can properly check root dir later.
-            logging.info(f'Sending GET request to {ip}.')
-            response = requests.get(ip, timeout=_REQUEST_TIMEOUT, allow_redirects=False)
+            # Redirects are only followed on the same host, so the root
+            # checked is the target's own.
+            # Streamed so only as much of the body as _root_listing needs is read.
+            for _ in range(self.follow_redirects + 1):
+                logging.info(f'Sending GET request to {url}.')
+                if self.scheduler is not None:
+                    time.sleep(self.scheduler.delay(ip))
+                response = self._session().get(url, timeout=self._request_timeout(),
+                                               allow_redirects=False, stream=True)
+                location = self._redirect_location(url, response)
+                if location is None:
+                    break
+                logging.debug(f'{url} redirected to {location}.')
+                self._release(response)
+                url = location
         except requests.exceptions.RequestException as e:
             logging.error(f'Got exception: {e}.')
             raise e
+        if self.scheduler is not None:
+            # requests only times up to the headers, connect included.
+            elapsed = response.elapsed.total_seconds()
+            self.scheduler.observe(elapsed, elapsed)
         if response.status_code != 200:
-            raise ValueError(f'Bad response code: {response.status_code}')
-        logging.debug(f'Sent request to {ip}, got status {response.status_code}.')
+            self._release(response)
+            raise BadStatusError(response.status_code)
+        logging.debug(f'Sent request to {url}, got status {response.status_code}.')
         
         return response
+
+    async def _make_request_async(self, ip: str, trace: Optional[scan_metrics.Trace] = None,
+                                  pool: Optional[async_http.ConnectionPool] = None,
+                                  path: str = '', read_body: Optional[bool] = None
+                                  ) -> async_http.AsyncResponse:
+        """Async version of _make_request. Raises async_http.RequestError or ValueError."""
+        url = ip + path
+        try:
+            for _ in range(self.follow_redirects + 1):
+                logging.info(f'Sending async GET request to {url}.')
+                timings = None if trace is None else trace.timings
+                if self.scheduler is not None:
+                    await asyncio.sleep(self.scheduler.delay(ip))
+                    # Connect and first byte times are needed to adapt timeouts.
+                    timings = {} if timings is None else timings
+                # Body is skipped entirely if root isn't checked.
+                response = await async_http.get(url, timeout=self._request_timeout(),
+                                                read_body=(self.scan_root if read_body is None
+                                                           else read_body),
+                                                max_body_bytes=self.max_body_bytes,
+                                                stop_at=_ROOT_LISTING_MARKER.encode('ascii'),
+                                                timings=timings, pool=pool)
+                location = self._redirect_location(url, response)
+                if location is None:
+                    break
+                logging.debug(f'{url} redirected to {location}.')
+                url = location
+        except async_http.RequestError as e:
+            logging.error(f'Got exception: {e}.')
+            raise e
+        if self.scheduler is not None:
+            # No connect time when a pooled connection was reused.
+            self.scheduler.observe(timings.get('connect'), timings['first_byte'])
+        if response.status_code != 200:
+            raise BadStatusError(response.status_code)
+        logging.debug(f'Sent request to {url}, got status {response.status_code}.')
+
+        return response
+
+    def _redirect_location(self, url: str,
+                           resp: Union[requests.Response, async_http.AsyncResponse]
+                           ) -> Optional[str]:
+        """Where resp redirects to, if it should be followed: on the same scheme, host and port."""
+        if not self.follow_redirects or resp.status_code not in _REDIRECT_STATUS_CODES:
+            return None
+        location = resp.headers.get('Location')
+        if not location:
+            return None
+        location = urljoin(url, location)
+        if self._origin(location) != self._origin(url):
+            logging.debug(f'Not following redirect from {url} to another host, {location}.')
+            return None
+        return location
+
+    def _origin(self, url: str) -> Optional[tuple[str, Optional[str], Optional[int]]]:
+        try:
+            parts = urlsplit(url)
+            return (parts.scheme, parts.hostname,
+                    parts.port or targets.DEFAULT_PORTS.get(parts.scheme))
+        except ValueError:
+            # Bad port in a Location header.
+            return None
+
+    def _session(self) -> requests.Session:
+        """This thread's requests session, pooling connections to pool_size per host."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_hosts,
+                                                    pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            if not self._reuse_connections():
+                session.headers['Connection'] = 'close'
+            self._local.session = session
+        return session
+
+    def _connection_pool(self) -> Optional[async_http.ConnectionPool]:
+        """A pool for one event loop, or None if connections aren't reused."""
+        if not self._reuse_connections():
+            return None
+        return async_http.ConnectionPool(self.pool_size, self.pool_hosts)
+
+    def _reuse_connections(self) -> bool:
+        """Only worth it when a target may get more than one request."""
+        return self.keep_alive and bool(self.probes or self.follow_redirects)
+
+    def _release(self, resp: requests.Response) -> None:
+        """Gives the connection back to the pool if the rest of the body is short, else closes it."""
+        length = resp.headers.get('Content-Length', '')
+        if self._reuse_connections() and length.isdigit() and int(length) <= _MAX_DRAIN_BYTES:
+            try:
+                resp.raw.drain_conn()
+                resp.raw.release_conn()
+                return
+            except (AttributeError, OSError):
+                pass
+        resp.close()
+        if not self._reuse_connections():
+            # A body read to the end gives its connection back to the pool, and
+            # a server needn't answer Connection: close in kind, so the next
+            # request could pick it up just as the server closes it.
+            self._session().close()
         
+    def _request_timeout(self) -> Union[float, tuple[float, float]]:
+        """Fixed, or (connect, read) from the scheduler."""
+        if self.scheduler is None:
+            return _REQUEST_TIMEOUT
+        return self.scheduler.timeout(self._retrying)
+
     def _server_software(self, resp: requests.Response) -> WebSrvEnum:
         """Checks HTTP header server field and return the applicable enum if available."""
         # Sometimes server fields are removed from headers
@@ -125,46 +958,51 @@ class WebServerScanner():
             return WebSrvEnum.none
         logging.debug(f'HTTP "server" header field is set to: {server_field}')
 
-        header_sw, header_ver = server_field.split('/')
-        # If software and software version supported, return it. Else return "other"
-        try:
-            software = WebSrvEnum[header_sw.lower()]
-            logging.debug(f'{header_sw} is flagged, checking version..')
-        except ValueError:
-            logging.debug(f'"{header_sw}" is not flagged.')
-            return WebSrvEnum.other
-
-        # Check version. If type (above) and ver are supported, return its enum. Else other.
-        # We only care about major, minor
-        header_ver_major_minor = '.'.join(header_ver.split('.')[:2])
-        logging.debug(f'Got {header_ver_major_minor} as version')
-        if header_ver_major_minor in get_flagged_versions()[software]:
-            logging.debug(f'Version flagged, returning {software}.')
-            return software
-        logging.debug(f'Version not flagged, returning {WebSrvEnum.other}')
-        return WebSrvEnum.other
+        # If software and software version flagged, return it. Else return "other"
+        software = self.rules.classify(server_field)
+        logging.debug(f'Rules classified "{server_field}" as {software}.')
+        return software
     
     def _root_listing(self, resp: requests.Response) -> DirListEnum:
         """Very rudimentary way of seeing if files are accessible at root."""
-        if 'Index of' in resp.text:
+        if self._body_contains(resp, _ROOT_LISTING_MARKER):
             logging.debug('Directory listing at root appears to be available.')
             return DirListEnum.available
         else:
             logging.debug('Directory listing at root appears to be unavailable.')
             return DirListEnum.unavailable
         
-    def _update_ip_map(self, ip: str, software: WebSrvEnum, root_listing: DirListEnum,
-                       status: StatusEnum, error_msg: Optional[str]) -> None:
-        """Updates the nested IP map."""
-        self.ip_map[ip]['WebServerSoftware'] = software
-        self.ip_map[ip]['RootListing'] = root_listing
-        self.ip_map[ip]['Status'] = status
-        self.ip_map[ip]['ErrorMsg'] = error_msg
+    def _body_contains(self, resp: requests.Response, marker: str) -> bool:
+        """Reads the body in chunks until marker is found or max_body_bytes are read."""
+        try:
+            decoder = codecs.getincrementaldecoder(resp.encoding or 'utf-8')(errors='replace')
+        except LookupError:
+            # Unknown charset given by the server.
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        bytes_read = 0
+        tail = ''
+        for chunk in resp.iter_content(_BODY_CHUNK_SIZE):
+            if self.max_body_bytes is not None:
+                chunk = chunk[:self.max_body_bytes - bytes_read]
+            bytes_read += len(chunk)
+            # Keep the end of the previous chunk in case the marker spans two.
+            text = tail + decoder.decode(chunk)
+            if marker in text:
+                return True
+            tail = text[-(len(marker) - 1):]
+            if self.max_body_bytes is not None and bytes_read >= self.max_body_bytes:
+                logging.debug(f'Stopped reading body after {bytes_read} bytes.')
+                break
+        return marker in tail + decoder.decode(b'', final=True)
+
+    def _update_ip_map(self, ip: str, result: RESULT_TYPE) -> None:
+        """Adds a result to the IP map, replacing any earlier one for ip."""
+        self.ip_map.add(ip, result)
 
     
-    def _log_scan_complete(self, ip: str, success: bool) -> None:
+    def _log_scan_complete(self, ip: str, result: RESULT_TYPE) -> None:
         """Logs what was scanned."""
-        if success == False:
-            logging.warning(f'Unsuccessful scan complete: {self.ip_map[ip]}.')
+        if result['Status'] != StatusEnum.good:
+            logging.warning(f'Unsuccessful scan complete: {ip}: {result}.')
         else:
-            logging.info(f'Successful scan complete: {self.ip_map[ip]}.')
\ No newline at end of file
+            logging.info(f'Successful scan complete: {ip}: {result}.')
\ No newline at end of file
@@ -0,0 +1,121 @@
+"Tests for scanner.async_http against a local HTTP server."
+import asyncio
+import http.server
+import threading
+import unittest
+
+from scanner import async_http
+
+_INDEX_PAGE = b'<head><title>Index of /</title></head>'
+_PADDING = b'x' * (1024 * 1024)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path in ('/', '/big'):
+            parts = [_INDEX_PAGE[:10], _INDEX_PAGE[10:]]
+            if self.path == '/big':
+                parts.append(_PADDING)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for part in parts:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(part), part))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    def version_string(self):
+        # Sent as the Server header.
+        return 'nginx/1.2.1'
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # The client hangs up early on purpose in some tests.
+        pass
+
+
+class AsyncHttpTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = _Server(('127.0.0.1', 0), _Handler)
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def test_get_chunked(self):
+        resp = asyncio.run(async_http.get(self.url, timeout=3))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['server'], 'nginx/1.2.1')
+        self.assertEqual(resp.text, _INDEX_PAGE.decode())
+
+    def test_get_stop_at(self):
+        """Reading stops once stop_at is in the body, even across chunks."""
+        resp = asyncio.run(async_http.get(self.url + '/big', timeout=3, stop_at=b'Index of'))
+        self.assertIn('Index of', resp.text)
+        self.assertLess(len(resp.content), len(_INDEX_PAGE) + len(_PADDING))
+
+    def test_get_max_body_bytes(self):
+        resp = asyncio.run(async_http.get(self.url, timeout=3, max_body_bytes=5))
+        self.assertEqual(resp.content, _INDEX_PAGE[:5])
+
+    def test_get_no_body(self):
+        resp = asyncio.run(async_http.get(self.url, timeout=3, read_body=False))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['server'], 'nginx/1.2.1')
+        self.assertEqual(resp.content, b'')
+
+    def test_get_content_length(self):
+        resp = asyncio.run(async_http.get(self.url + '/missing', timeout=3))
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.content, b'')
+
+    def test_get_timings(self):
+        timings = {}
+        asyncio.run(async_http.get(self.url, timeout=3, timings=timings))
+        self.assertListEqual(sorted(timings), ['body', 'connect', 'first_byte'])
+        self.assertTrue(all(seconds >= 0 for seconds in timings.values()))
+
+    def test_pool_reuses_connection(self):
+        """With a pool, requests to one host share a connection, even if the body was cut short."""
+        async def get_twice():
+            pool = async_http.ConnectionPool()
+            try:
+                first = await async_http.get(self.url, timeout=3, max_body_bytes=5, pool=pool)
+                second = await async_http.get(self.url + '/missing', timeout=3, pool=pool)
+                return first, second, pool.stats()
+            finally:
+                pool.close()
+        first, second, stats = asyncio.run(get_twice())
+        self.assertEqual(first.content, _INDEX_PAGE[:5])
+        self.assertEqual(second.status_code, 404)
+        self.assertDictEqual(stats, {'Opened': 1, 'Reused': 1})
+
+    def test_connection_refused(self):
+        # Bind then close to get a port nothing is listening on.
+        server = http.server.HTTPServer(('127.0.0.1', 0), _Handler)
+        port = server.server_port
+        server.server_close()
+        timings = {}
+        with self.assertRaises(async_http.ConnectError):
+            asyncio.run(async_http.get(f'http://127.0.0.1:{port}', timeout=3, timings=timings))
+        self.assertListEqual(list(timings), ['connect'])
+
+
+if __name__ == '__main__':
+    unittest.main()
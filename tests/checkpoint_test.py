@@ -0,0 +1,71 @@
+"Tests for scanner.checkpoint."
+import os
+import tempfile
+import unittest
+import unittest.mock
+import requests
+from mock_responses import create_mock_response
+from scanner import checkpoint, web_server_scanner
+from scanner.utils import WebSrvEnum, StatusEnum
+
+
+def mock_get(ip, **kwargs):
+    return create_mock_response(ip=ip, server_header='nginx/1.2.1')
+
+
+class CheckpointLogTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'scan.log')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def scan(self, ips, **kwargs):
+        scanner = web_server_scanner.WebServerScanner([], **kwargs)
+        with unittest.mock.patch.object(requests.Session, 'get', side_effect=mock_get) as get:
+            results = list(checkpoint.CheckpointLog(self.path).resume(scanner, ips))
+        return results, get.call_count
+
+    def test_resume(self):
+        """Targets in the log aren't scanned again, output matches a full run."""
+        ips = ['192.168.0.1', '192.168.0.2', 'bad', '192.168.0.3']
+        first, requests_made = self.scan(ips[:2], preserve_ips=False)
+        self.assertEqual(requests_made, 2)
+        second, requests_made = self.scan(ips, preserve_ips=False)
+        self.assertEqual(requests_made, 1)
+        self.assertListEqual([ip for ip, _ in second],
+                             ['http://192.168.0.1', 'http://192.168.0.2', 'bad',
+                              'http://192.168.0.3'])
+        self.assertListEqual(second[:2], first)
+        self.assertEqual(second[0][1]['WebServerSoftware'], WebSrvEnum.nginx)
+        self.assertEqual(second[2][1]['Status'], StatusEnum.bad_ip)
+        # Nothing left to do.
+        third, requests_made = self.scan(ips, preserve_ips=False)
+        self.assertEqual(requests_made, 0)
+        self.assertListEqual(third, second)
+
+    def test_partial_last_line(self):
+        """A line cut short by a crash is dropped and its target scanned again."""
+        self.scan(['192.168.0.1', '192.168.0.2'])
+        with open(self.path, 'rb+') as file:
+            file.truncate(os.path.getsize(self.path) - 5)
+        results, requests_made = self.scan(['192.168.0.1', '192.168.0.2'])
+        self.assertEqual(requests_made, 1)
+        self.assertEqual(len(results), 2)
+        with open(self.path) as file:
+            self.assertEqual(len(file.readlines()), 2)
+
+    def test_batched_fsync(self):
+        log = checkpoint.CheckpointLog(self.path, fsync_every=10, fsync_interval=3600)
+        result = {'WebServerSoftware': WebSrvEnum.nginx, 'Status': StatusEnum.good}
+        with unittest.mock.patch.object(os, 'fsync') as fsync:
+            for i in range(25):
+                log.append(str(i), result)
+            self.assertEqual(fsync.call_count, 2)
+            log.close()
+            self.assertEqual(fsync.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
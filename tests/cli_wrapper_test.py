@@ -0,0 +1,89 @@
+"Tests for scanner.cli.cli_wrapper, running main() on mocked scans."
+import contextlib
+import csv
+import io
+import json
+import sys
+import unittest
+import unittest.mock
+import requests
+from mock_responses import create_mock_response
+from scanner.cli import cli_wrapper
+from scanner.utils import WebSrvEnum, DirListEnum, StatusEnum
+
+_GOOD = {'WebServerSoftware': WebSrvEnum.nginx, 'RootListing': DirListEnum.available,
+         'Status': StatusEnum.good, 'ErrorMsg': None}
+_BAD_IP = {'WebServerSoftware': WebSrvEnum.err, 'RootListing': DirListEnum.err,
+           'Status': StatusEnum.bad_ip, 'ErrorMsg': 'Pass a valid IP.'}
+_IPS = ('192.168.0.1', '0192.168.0.2')
+# Without --preserve-ips valid IPs are output with their scheme.
+_EXPECTED = {'http://192.168.0.1': _GOOD, '0192.168.0.2': _BAD_IP}
+
+
+def mock_get(ip, **kwargs):
+    return create_mock_response(ip=ip, listing=True, server_header='nginx/1.2.1')
+
+
+def run_cli(*args: str) -> str:
+    """Runs the CLI on a mocked scan of args, returns what it wrote to stdout."""
+    out = io.StringIO()
+    with unittest.mock.patch.object(sys, 'argv', ['cli_wrapper.py', *args]), \
+            unittest.mock.patch.object(requests.Session, 'get', side_effect=mock_get), \
+            contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+        cli_wrapper.main()
+    return out.getvalue()
+
+
+class OutputTests(unittest.TestCase):
+    def test_human(self):
+        output = run_cli('--ips', *_IPS)
+        good, bad_ip = output.strip().split('\n\n')
+        self.assertIn('http://192.168.0.1', good)
+        self.assertIn(WebSrvEnum.nginx.value, good)
+        self.assertIn(DirListEnum.available.value, good)
+        self.assertNotIn('Error', good)
+        self.assertIn(StatusEnum.bad_ip.value, bad_ip)
+        self.assertIn('Pass a valid IP.', bad_ip)
+
+    def test_json(self):
+        output = run_cli('--ips', *_IPS, '--output-method', 'JSON')
+        self.assertEqual(output, json.dumps(_EXPECTED, indent=4) + '\n')
+
+    def test_json_repeats(self):
+        """A target given twice is written once, so the object has no duplicate keys."""
+        results = [('a', _GOOD), ('b', _GOOD), ('a', _BAD_IP)]
+        out = io.StringIO()
+        cli_wrapper._print_json(results, out)
+        self.assertEqual(out.getvalue(), json.dumps({'a': _GOOD, 'b': _GOOD}, indent=4) + '\n')
+
+    def test_ndjson(self):
+        output = run_cli('--ips', *_IPS, '--output-method', 'NDJSON')
+        self.assertListEqual([json.loads(line) for line in output.splitlines()],
+                             [{'Ip': ip, 'Result': json.loads(json.dumps(result))}
+                              for ip, result in _EXPECTED.items()])
+
+    def test_csv(self):
+        output = run_cli('--ips', *_IPS, '--output-method', 'CSV')
+        self.assertListEqual(list(csv.DictReader(io.StringIO(output))),
+                             [{'Ip': ip, **{name: '' if value is None
+                                            else getattr(value, 'value', value)
+                                            for name, value in result.items()}}
+                              for ip, result in _EXPECTED.items()])
+
+    def test_csv_probes(self):
+        """Results that never reached the probes, like bad IPs, have an empty Probes column."""
+        output = run_cli('--ips', *_IPS, '--probe', '/files/', '--output-method', 'CSV')
+        rows = list(csv.DictReader(io.StringIO(output)))
+        self.assertListEqual([row['Probes'] for row in rows],
+                             [f'/files/={DirListEnum.available.value}', ''])
+        self.assertEqual(rows[1]['Status'], StatusEnum.bad_ip.value)
+
+    def test_csv_extra_keys(self):
+        """Keys without a column, like Cached from a checkpoint replay, are left out."""
+        out = io.StringIO()
+        cli_wrapper._write_csv([('a', {**_GOOD, 'Cached': True})], out)
+        self.assertEqual(out.getvalue().splitlines()[1], 'a,nginx,Available,Good,')
+
+
+if __name__ == '__main__':
+    unittest.main()
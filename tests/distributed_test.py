@@ -0,0 +1,168 @@
+"Tests for scanner.distributed, with workers in local processes and threads."
+import os
+import socket
+import tempfile
+import threading
+import unittest
+import unittest.mock
+import requests
+from mock_responses import create_mock_response
+from scanner import distributed, result_cache, scan_metrics
+from scanner.utils import WebSrvEnum, DirListEnum, StatusEnum
+
+
+def _mock_get(ip, **kwargs):
+    # The body is streamed, so each request needs its own response.
+    return create_mock_response(ip=ip, listing=True, server_header='nginx/1.2.1')
+
+
+class _FakeWorker():
+    """Takes a lease and then does nothing with it."""
+    def __init__(self, address):
+        self.channel = distributed._Channel(socket.create_connection(address))
+        self.channel.send('hello', Worker='fake')
+        self.channel.receive()
+        self.channel.send('lease')
+        self.lease = self.channel.receive()
+
+    def close(self):
+        self.channel.close()
+
+
+class CoordinatorTests(unittest.TestCase):
+    def setUp(self):
+        patcher = unittest.mock.patch.object(requests.Session, 'get', side_effect=_mock_get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _worker_thread(self, address, **kwargs):
+        thread = threading.Thread(target=distributed.run_worker, args=(address,),
+                                  kwargs={'log_level': 'CRITICAL', **kwargs}, daemon=True)
+        thread.start()
+        return thread
+
+    def test_local_workers(self):
+        """Leases are scanned in worker processes and merged in input order."""
+        ips = [f'192.168.0.{i}' for i in range(1, 30)] + ['0192.168.0.30']
+        metrics = scan_metrics.ScanMetrics()
+        # Workers are forked inside the patch so they see it too.
+        coordinator = distributed.Coordinator(ips, lease_size=4, local_workers=2,
+                                              log_level='CRITICAL', metrics=metrics)
+        result = coordinator()
+
+        self.assertListEqual(list(result), ips)
+        for ip in ips[:-1]:
+            self.assertEqual(result[ip]['WebServerSoftware'], WebSrvEnum.nginx)
+            self.assertEqual(result[ip]['RootListing'], DirListEnum.available)
+            self.assertEqual(result[ip]['Status'], StatusEnum.good)
+        self.assertEqual(result[ips[-1]]['Status'], StatusEnum.bad_ip)
+        self.assertEqual(sum(stats['Hosts'] for stats in coordinator.worker_stats.values()),
+                         len(ips))
+        self.assertLessEqual(len(coordinator.worker_stats), 2)
+        self.assertEqual(coordinator.scan_stats['Hosts'], len(ips))
+        # Targets stolen part way may be scanned twice, only one result is kept.
+        self.assertGreaterEqual(sum(metrics.statuses.values()), len(ips))
+
+    def test_local_workers_cache(self):
+        """Local workers open the cache file themselves and share what they cache."""
+        ips = [f'192.168.2.{i}' for i in range(1, 11)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = result_cache.ResultCache(os.path.join(tmp_dir, 'cache.sqlite'))
+            self.addCleanup(cache.close)
+            first = distributed.Coordinator(ips, lease_size=5, local_workers=2,
+                                            log_level='CRITICAL', cache=cache)
+            first()
+            second = distributed.Coordinator(ips, lease_size=5, local_workers=2,
+                                             log_level='CRITICAL', cache=cache)
+            result = second()
+
+        self.assertGreaterEqual(first.cache_stats['Misses'], len(ips))
+        self.assertEqual(second.cache_stats['Misses'], 0)
+        self.assertGreaterEqual(second.cache_stats['Hits'], len(ips))
+        self.assertEqual(result['192.168.2.1']['WebServerSoftware'], WebSrvEnum.nginx)
+
+    def test_lost_worker(self):
+        """A worker disconnecting part way has its lease scanned by another."""
+        ips = [f'192.168.1.{i}' for i in range(1, 21)]
+        coordinator = distributed.Coordinator(ips, lease_size=5, log_level='CRITICAL')
+        results = coordinator.iter_scan(order='completion')
+        fake = _FakeWorker(coordinator.address)
+        self.assertEqual(fake.lease['Type'], 'lease')
+        fake.close()
+        thread = self._worker_thread(coordinator.address)
+        scanned = [ip for ip, _ in results]
+        thread.join(5)
+
+        self.assertCountEqual(scanned, ips)
+        self.assertGreaterEqual(coordinator.scan_stats['Requeued'], 1)
+        self.assertFalse(thread.is_alive())
+
+    def test_stalled_worker(self):
+        """An idle worker steals halves of a stalled worker's lease, the last is requeued."""
+        ips = [f'192.168.2.{i}' for i in range(1, 11)]
+        coordinator = distributed.Coordinator(ips, lease_size=10, lease_timeout=1,
+                                              log_level='CRITICAL')
+        results = coordinator.iter_scan(order='input')
+        fake = _FakeWorker(coordinator.address)
+        self.addCleanup(fake.close)
+        self._worker_thread(coordinator.address)
+        scanned = [ip for ip, _ in results]
+
+        self.assertListEqual(scanned, ips)
+        # 5 of 10 targets, then 3 of 5, then 1 of 2.
+        self.assertEqual(coordinator.scan_stats['Stolen'], 3)
+        self.assertEqual(coordinator.scan_stats['Requeued'], 1)
+        # The back half was revoked from the fake worker first.
+        self.assertEqual(fake.channel.receive(),
+                         {'Type': 'revoke', 'Lease': fake.lease['Lease'],
+                          'Indexes': list(range(5, 10))})
+
+    def test_unread_revoke(self):
+        """A stalled worker that stops reading doesn't hold up the one stealing from it."""
+        ips = [f'192.168.4.{i}' for i in range(1, 11)]
+        coordinator = distributed.Coordinator(ips, lease_size=10, lease_timeout=1,
+                                              log_level='CRITICAL')
+        results = coordinator.iter_scan(order='input')
+        fake = _FakeWorker(coordinator.address)
+        self.addCleanup(fake.close)
+        unblocked = threading.Event()
+        self.addCleanup(unblocked.set)
+        coordinator._workers[0].channel.send = lambda *args, **kwargs: unblocked.wait()
+        self._worker_thread(coordinator.address)
+
+        self.assertListEqual([ip for ip, _ in results], ips)
+        self.assertEqual(coordinator.scan_stats['Stolen'], 3)
+
+    def test_worker_metrics(self):
+        """A worker's own metrics get what it scanned, even if the coordinator's don't."""
+        ips = [f'192.168.5.{i}' for i in range(1, 6)]
+        coordinator = distributed.Coordinator(ips, log_level='CRITICAL')
+        results = coordinator.iter_scan()
+        metrics = scan_metrics.ScanMetrics()
+        thread = self._worker_thread(coordinator.address, metrics=metrics)
+        self.assertEqual(len(list(results)), len(ips))
+        thread.join(5)
+
+        self.assertIsNone(coordinator.metrics)
+        self.assertEqual(metrics.statuses['good'], len(ips))
+
+    def test_token(self):
+        coordinator = distributed.Coordinator(['192.168.3.1'], token='secret',
+                                              log_level='CRITICAL')
+        results = coordinator.iter_scan()
+        with self.assertRaises(ConnectionError):
+            distributed.run_worker(coordinator.address, token='wrong', log_level='CRITICAL')
+        self._worker_thread(coordinator.address, token='secret')
+        self.assertListEqual([ip for ip, _ in results], ['192.168.3.1'])
+
+    def test_invalid_args(self):
+        self.assertRaises(ValueError, distributed.Coordinator, [], lease_size=0)
+        self.assertRaises(ValueError, distributed.Coordinator, [], lease_timeout=0)
+        self.assertRaises(ValueError, distributed.Coordinator, [], local_workers=-1)
+        coordinator = distributed.Coordinator(['127.0.0.1'], scan_software=False,
+                                              scan_root=False)
+        self.assertRaises(ValueError, coordinator)
+
+
+if __name__ == '__main__':
+    unittest.main()
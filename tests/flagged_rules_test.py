@@ -0,0 +1,74 @@
+"Tests for scanner.flagged_rules."
+import json
+import os
+import pickle
+import tempfile
+import unittest
+from scanner import flagged_rules
+from scanner.utils import WebSrvEnum
+
+
+class RuleIndexTests(unittest.TestCase):
+    def test_default_rules(self):
+        index = flagged_rules.RuleIndex()
+        self.assertEqual(index.classify('nginx/1.2.1'), WebSrvEnum.nginx)
+        self.assertEqual(index.classify('Microsoft-IIS/7.0'), WebSrvEnum.iis)
+        self.assertEqual(index.classify('nginx/1.20.1'), WebSrvEnum.other)
+        self.assertEqual(index.classify('Microsoft-IIS/7.5'), WebSrvEnum.other)
+
+    def test_unusual_headers(self):
+        """Headers without a version or with extra tokens don't raise."""
+        index = flagged_rules.RuleIndex()
+        for header in ('nginx', 'Apache/2.4.1 (Unix)', 'nginx/', 'nginx/abc', ' ', 'a/b/c'):
+            self.assertEqual(index.classify(header), WebSrvEnum.other)
+        self.assertEqual(index.classify('nginx/1.2.9 (Ubuntu)'), WebSrvEnum.nginx)
+
+    def test_version_specs(self):
+        index = flagged_rules.RuleIndex([
+            {'product': 'nginx', 'flag_as': 'nginx', 'versions': ['1.2', '1.1[0-2].*']},
+            {'product': 'nginx', 'flag_as': 'nginx', 'versions': ['>=1.14,<1.16', '>1.20.0,<=1.21']},
+            {'product': 'Microsoft-IIS', 'flag_as': 'iis', 'versions': '==8.5'},
+        ])
+        flagged = ['nginx/1.2', 'nginx/1.2.0', 'nginx/1.11.3', 'nginx/1.14', 'nginx/1.15.9',
+                   'nginx/1.20.1', 'nginx/1.21.0', 'NGINX/1.14.0', 'Microsoft-IIS/8.5.0']
+        unflagged = ['nginx/1.20', 'nginx/1.16', 'nginx/1.13.9', 'nginx/1.13', 'nginx/1.21.1',
+                     'nginx/1.22', 'Microsoft-IIS/8.0', 'apache/1.2']
+        for header in flagged:
+            self.assertNotEqual(index.classify(header), WebSrvEnum.other, header)
+        for header in unflagged:
+            self.assertEqual(index.classify(header), WebSrvEnum.other, header)
+
+    def test_cached(self):
+        index = flagged_rules.RuleIndex()
+        for _ in range(3):
+            index.classify('nginx/1.2.1')
+        self.assertEqual(index.classify.cache_info().hits, 2)
+
+    def test_from_file_and_pickle(self):
+        rules = [{'product': 'lighttpd', 'flag_as': 'nginx', 'versions': ['1.4.*']}]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'rules.json')
+            with open(path, 'w') as file:
+                json.dump(rules, file)
+            index = pickle.loads(pickle.dumps(flagged_rules.RuleIndex.from_file(path)))
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.classify('lighttpd/1.4.59'), WebSrvEnum.nginx)
+        self.assertEqual(index.classify('nginx/1.2'), WebSrvEnum.other)
+
+    def test_invalid_rules(self):
+        invalid = [
+            [{'product': 'nginx', 'versions': ['1.2']}],
+            [{'product': 'nginx', 'flag_as': 'other', 'versions': ['1.2']}],
+            [{'product': 'nginx', 'flag_as': 'nginx', 'versions': ['abc']}],
+            [{'product': 'nginx', 'flag_as': 'nginx', 'versions': ['>=1.5,<1.2']}],
+            [{'product': 'nginx', 'flag_as': 'nginx', 'versions': [1.2]}],
+            [{'product': 'nginx', 'flag_as': 'nginx', 'versions': ['1.2']},
+             {'product': 'nginx', 'flag_as': 'iis', 'versions': ['1.3']}],
+            ['nginx'],
+        ]
+        for rules in invalid:
+            self.assertRaises(ValueError, flagged_rules.RuleIndex, rules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"Tests for scanner.job_queue."
+import threading
+import unittest
+from scanner import job_queue
+
+
+def gated_results(gate, count):
+    """Yields count results, the first only once gate is set."""
+    gate.wait()
+    for i in range(count):
+        yield f'10.0.0.{i}', {'Status': 'good'}
+
+
+class JobQueueTests(unittest.TestCase):
+    def test_job_runs_and_pages(self):
+        jobs = job_queue.JobQueue(workers=1, max_queued=2)
+        gate = threading.Event()
+        job = jobs.submit(gated_results(gate, 5), 5)
+        self.assertIs(jobs.get(job.id), job)
+        gate.set()
+        self.assertEqual(len(list(job.iter_results())), 5)
+        self.assertEqual(job.status, job_queue.DONE)
+
+        page = job.page(offset=1, limit=3)
+        self.assertEqual(list(page['Results']), ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+        self.assertEqual(page['NextOffset'], 4)
+        self.assertEqual(page['Completed'], 5)
+        self.assertIsNone(job.page(offset=4, limit=3)['NextOffset'])
+
+    def test_iter_results_streams_while_running(self):
+        jobs = job_queue.JobQueue(workers=1, max_queued=1)
+        gate = threading.Event()
+        job = jobs.submit(gated_results(gate, 3), 3)
+        results = job.iter_results(offset=1)
+        gate.set()
+        self.assertEqual([ip for ip, _ in results], ['10.0.0.1', '10.0.0.2'])
+
+    def test_full_queue_rejects(self):
+        jobs = job_queue.JobQueue(workers=1, max_queued=1)
+        gate = threading.Event()
+        try:
+            running = jobs.submit(gated_results(gate, 1), 1)
+            # Wait for the worker to take the first job off the queue.
+            while running.status == job_queue.QUEUED:
+                threading.Event().wait(0.01)
+            jobs.submit(gated_results(gate, 1), 1)
+            with self.assertRaises(job_queue.QueueFullError):
+                jobs.submit(gated_results(gate, 1), 1)
+            self.assertEqual(jobs.stats()['Queued'], 1)
+        finally:
+            gate.set()
+
+    def test_failed_job(self):
+        def broken():
+            yield '10.0.0.1', {}
+            raise RuntimeError('boom')
+
+        jobs = job_queue.JobQueue(workers=1)
+        job = jobs.submit(broken(), 2)
+        self.assertEqual(len(list(job.iter_results())), 1)
+        self.assertEqual(job.status, job_queue.FAILED)
+        self.assertEqual(job.error, 'boom')
+
+    def test_invalid_args(self):
+        with self.assertRaises(ValueError):
+            job_queue.JobQueue(workers=0)
+        with self.assertRaises(ValueError):
+            job_queue.JobQueue(max_queued=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+"Mock HTTP responses shared by the tests."
+import requests
+import requests_mock
+from typing import Optional
+
+FAKE_IP = 'http://127.0.0.1'
+
+
+def create_mock_response(
+    status_code: int = 200, ip: str = FAKE_IP,
+    listing: Optional[bool] = None, server_header: Optional[str] = None,
+    ) -> requests.Response:
+    header = {}
+    if server_header:
+       header['Server'] = server_header
+    text = ''
+    if listing:
+        text = '<head><title>Index of /</title></head>'
+    return requests_mock.create_response(
+        request=requests.Request('GET', ip),
+        text=text,
+        status_code=status_code,
+        headers=header,
+        )
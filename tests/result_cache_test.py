@@ -0,0 +1,64 @@
+"Tests for scanner.result_cache."
+import os
+import pickle
+import tempfile
+import unittest
+import unittest.mock
+from scanner import result_cache
+from scanner.utils import WebSrvEnum, DirListEnum, StatusEnum
+
+_GOOD = {'WebServerSoftware': WebSrvEnum.nginx, 'RootListing': DirListEnum.available,
+         'Status': StatusEnum.good, 'ErrorMsg': None}
+_ERR = {'WebServerSoftware': WebSrvEnum.err, 'RootListing': DirListEnum.err,
+        'Status': StatusEnum.response_err, 'ErrorMsg': 'Bad status... timed out'}
+
+
+class ResultCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_put(self):
+        cache = result_cache.ResultCache(self.path)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', _GOOD)
+        self.assertDictEqual(cache.get('a'), _GOOD)
+        self.assertDictEqual(cache.stats(), {'Hits': 1, 'Misses': 1})
+
+    def test_ttl_per_status(self):
+        cache = result_cache.ResultCache(self.path, {StatusEnum.good: 100,
+                                                     StatusEnum.response_err: 10})
+        with unittest.mock.patch('time.time', return_value=1000):
+            cache.put('good', _GOOD)
+            cache.put('err', _ERR)
+            cache.put('bad_ip', {**_ERR, 'Status': StatusEnum.bad_ip})
+        with unittest.mock.patch('time.time', return_value=1050):
+            self.assertIsNotNone(cache.get('good'))
+            self.assertIsNone(cache.get('err'))
+            self.assertIsNone(cache.get('bad_ip'))
+            self.assertEqual(cache.purge_expired(), 1)
+
+    def test_persisted(self):
+        """Evicted from the LRU or from an earlier run, results come from the file."""
+        cache = result_cache.ResultCache(self.path, max_entries=1)
+        cache.put('a', _GOOD)
+        cache.put('b', _ERR)
+        self.assertListEqual(list(cache._lru), ['b'])
+        self.assertDictEqual(cache.get('a'), _GOOD)
+        cache.close()
+        reopened = pickle.loads(pickle.dumps(result_cache.ResultCache(self.path)))
+        self.assertDictEqual(reopened.get('b'), _ERR)
+        self.assertEqual(reopened.get('b')['Status'], StatusEnum.response_err)
+
+    def test_returns_copy(self):
+        cache = result_cache.ResultCache()
+        cache.put('a', _GOOD)
+        cache.get('a')['Cached'] = True
+        self.assertNotIn('Cached', cache.get('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"Tests for scanner.result_store."
+import json
+import pickle
+import unittest
+from scanner import result_store
+from scanner.utils import WebSrvEnum, DirListEnum, StatusEnum
+
+
+def make_result(software=WebSrvEnum.nginx, status=StatusEnum.good, error_msg=None, **extra):
+    return {'WebServerSoftware': software, 'RootListing': DirListEnum.available,
+            'Status': status, 'ErrorMsg': error_msg, **extra}
+
+
+class ResultStoreTests(unittest.TestCase):
+    def test_reads_like_a_dict(self):
+        results = [('192.168.0.1', make_result()),
+                   ('http://10.0.0.1:8080', make_result(WebSrvEnum.other)),
+                   ('https://10.0.0.2', make_result(status=StatusEnum.response_err,
+                                                    error_msg='timed out')),
+                   ('0192.168.0.1', make_result(WebSrvEnum.err, StatusEnum.bad_ip,
+                                                'Pass a valid IP.'))]
+        store = result_store.ResultStore(results)
+        self.assertDictEqual(dict(store), dict(results))
+        self.assertListEqual(list(store), [ip for ip, _ in results])
+        self.assertEqual(store['https://10.0.0.2']['Status'], StatusEnum.response_err)
+        self.assertIn('0192.168.0.1', store)
+        self.assertNotIn('10.0.0.3', store)
+        self.assertRaises(KeyError, store.__getitem__, '10.0.0.3')
+        self.assertEqual(store, dict(results))
+        # A real dict, so it serializes without converting it first.
+        self.assertIsInstance(store, dict)
+        self.assertEqual(json.dumps(store), json.dumps(dict(results)))
+        self.assertEqual(json.dumps({'Results': store}, indent=4, sort_keys=True),
+                         json.dumps({'Results': dict(results)}, indent=4, sort_keys=True))
+        self.assertEqual(pickle.loads(pickle.dumps(store)), store)
+        self.assertEqual(json.dumps(result_store.ResultStore()), '{}')
+        self.assertEqual(store.get('10.0.0.3', 'missing'), 'missing')
+        self.assertListEqual(list(store.values()), [result for _, result in results])
+        # Reads are copies.
+        store['192.168.0.1']['Status'] = StatusEnum.bad_ip
+        self.assertEqual(store['192.168.0.1']['Status'], StatusEnum.good)
+
+    def test_add_again_replaces_in_place(self):
+        store = result_store.ResultStore()
+        store.add('10.0.0.1', make_result())
+        store.add('bad', make_result(WebSrvEnum.err, StatusEnum.bad_ip))
+        self.assertEqual(len(store), 2)
+        store.add('10.0.0.1', make_result(WebSrvEnum.iis, Cached=True))
+        store.add('10.0.0.2', make_result())
+        store.add('bad', make_result(WebSrvEnum.err, StatusEnum.bad_ip, 'again'))
+        self.assertListEqual(list(store), ['10.0.0.1', 'bad', '10.0.0.2'])
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store['10.0.0.1'], make_result(WebSrvEnum.iis, Cached=True))
+        self.assertEqual(store['bad']['ErrorMsg'], 'again')
+        self.assertNotIn('Cached', store['10.0.0.2'])
+        # Lookups between adds see every add, before and after they're indexed.
+        for i in range(3, 3000):
+            store.add(f'10.0.{i >> 8}.{i & 255}', make_result(error_msg=str(i)))
+            self.assertEqual(store[f'10.0.{i >> 8}.{i & 255}']['ErrorMsg'], str(i))
+        store.add('10.0.0.5', make_result(error_msg='again'))
+        self.assertEqual(store['10.0.0.5']['ErrorMsg'], 'again')
+        self.assertEqual(store['10.0.11.183']['ErrorMsg'], '2999')
+        self.assertEqual(len(store), 3000)
+        self.assertEqual(list(store)[5], '10.0.0.5')
+
+    def test_read_only(self):
+        store = result_store.ResultStore([('10.0.0.1', make_result())])
+        self.assertRaises(TypeError, store.__setitem__, '10.0.0.2', make_result())
+        self.assertRaises(TypeError, store.update, {'10.0.0.2': make_result()})
+        self.assertRaises(TypeError, store.pop, '10.0.0.1')
+        self.assertListEqual(list(store), ['10.0.0.1'])
+
+    def test_probes(self):
+        probes = {'/files/': DirListEnum.available, '/.git/': DirListEnum.err}
+        store = result_store.ResultStore([('10.0.0.1', make_result(Probes=probes)),
+                                          ('10.0.0.2', make_result(Probes=dict(probes))),
+                                          ('10.0.0.3', make_result())])
+        self.assertEqual(store['10.0.0.1'], make_result(Probes=probes))
+        self.assertListEqual(list(store['10.0.0.2']['Probes']), ['/files/', '/.git/'])
+        self.assertNotIn('Probes', store['10.0.0.3'])
+        # Stored once for both hosts.
+        self.assertEqual(len(store._probe_sets), 2)
+
+    def test_pack_key(self):
+        for ip in ('0.0.0.0', '255.255.255.255', 'http://1.2.3.4', 'https://1.2.3.4:65535',
+                   '10.0.0.1:1'):
+            packed = result_store.pack_key(ip)
+            self.assertIsNotNone(packed)
+            self.assertEqual(result_store.unpack_key(packed), ip)
+        # Anything that wouldn't round trip isn't packed.
+        for ip in ('010.0.0.1', '256.0.0.1', '1.2.3.4:080', '1.2.3.4:65536', '1.2.3.4:0',
+                   'ftp://1.2.3.4', '1.2.3', 'http://1.2.3.4/', ''):
+            self.assertIsNone(result_store.pack_key(ip), ip)
+
+
+if __name__ == '__main__':
+    unittest.main()
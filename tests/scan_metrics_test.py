@@ -0,0 +1,72 @@
+"Tests for scanner.scan_metrics."
+import pickle
+import unittest
+import unittest.mock
+import requests
+from mock_responses import create_mock_response
+from scanner import scan_metrics, web_server_scanner
+from scanner.utils import StatusEnum
+
+
+def mock_get(ip, **kwargs):
+    if ip.endswith(':8080'):
+        raise requests.exceptions.ConnectTimeout('timed out')
+    return create_mock_response(ip=ip, listing=True, server_header='nginx/1.2.1')
+
+
+class HistogramTests(unittest.TestCase):
+    def test_observe_and_percentile(self):
+        histogram = scan_metrics.Histogram((0.1, 1.0))
+        self.assertIsNone(histogram.percentile(0.5))
+        for seconds in (0.05, 0.1, 0.5, 5.0):
+            histogram.observe(seconds)
+        self.assertListEqual(histogram.buckets, [2, 1, 1])
+        self.assertEqual(histogram.percentile(0.5), 0.1)
+        self.assertEqual(histogram.percentile(0.75), 1.0)
+        self.assertEqual(histogram.percentile(0.99), float('inf'))
+        self.assertListEqual(histogram.cumulative(), [(0.1, 2), (1.0, 3), (float('inf'), 4)])
+        self.assertAlmostEqual(histogram.sum, 5.65)
+
+
+class ScanMetricsTests(unittest.TestCase):
+    def scan(self, metrics, ips):
+        scanner = web_server_scanner.WebServerScanner(ips, metrics=metrics)
+        with unittest.mock.patch.object(requests.Session, 'get', side_effect=mock_get):
+            return scanner()
+
+    def test_scanner_records_phases_and_counts(self):
+        metrics = scan_metrics.ScanMetrics()
+        self.scan(metrics, ['192.168.0.1', '192.168.0.2:8080', 'bad'])
+        snapshot = metrics.snapshot()
+        counts = {phase: stats['Count'] for phase, stats in snapshot['Phases'].items()}
+        self.assertDictEqual(counts, {'validate': 3, 'connect': 0, 'first_byte': 2, 'body': 1,
+                                      'classify': 1, 'total': 3})
+        self.assertDictEqual(snapshot['Statuses'], {'good': 1, 'response_err': 1, 'bad_ip': 1})
+        self.assertDictEqual(snapshot['Errors'], {'ConnectTimeout': 1})
+
+    def test_off_by_default(self):
+        with unittest.mock.patch.object(web_server_scanner.scan_metrics, 'Trace') as trace:
+            self.scan(None, ['192.168.0.1'])
+        trace.assert_not_called()
+
+    def test_merge_and_pickle(self):
+        metrics = scan_metrics.ScanMetrics()
+        self.scan(metrics, ['192.168.0.1'])
+        copy = pickle.loads(pickle.dumps(metrics))
+        copy.merge(metrics)
+        self.assertEqual(copy.phases['total'].count, 2)
+        self.assertEqual(copy.statuses[StatusEnum.good.name], 2)
+
+    def test_prometheus(self):
+        metrics = scan_metrics.ScanMetrics()
+        self.scan(metrics, ['192.168.0.1:8080'])
+        text = metrics.to_prometheus()
+        self.assertIn('# TYPE ip_scanner_phase_seconds histogram\n', text)
+        self.assertIn('ip_scanner_phase_seconds_bucket{phase="total",le="+Inf"} 1\n', text)
+        self.assertIn('ip_scanner_phase_seconds_count{phase="body"} 0\n', text)
+        self.assertIn('ip_scanner_results_total{status="response_err"} 1\n', text)
+        self.assertIn('ip_scanner_errors_total{type="ConnectTimeout"} 1\n', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"Tests for scanner.scan_scheduler."
+import pickle
+import unittest
+import unittest.mock
+import requests
+from mock_responses import create_mock_response
+from scanner import scan_scheduler, web_server_scanner
+from scanner.utils import StatusEnum
+
+
+class InterleaveTests(unittest.TestCase):
+    def test_round_robin_across_subnets(self):
+        ips = ['10.0.0.1', '10.0.0.2', 'http://10.0.1.1:80', '10.0.1.2', 'bad']
+        self.assertListEqual(list(scan_scheduler.interleave_subnets(ips)),
+                             ['10.0.0.1', 'http://10.0.1.1:80', 'bad', '10.0.0.2', '10.0.1.2'])
+        # Can't look ahead, so nothing to mix.
+        self.assertListEqual(list(scan_scheduler.interleave_subnets(ips, window=1)), ips)
+
+    def test_lazy(self):
+        pulled = []
+        def ips():
+            for i in range(100):
+                pulled.append(i)
+                yield f'10.0.{i % 2}.{i}'
+        interleaved = scan_scheduler.interleave_subnets(ips(), window=4)
+        self.assertListEqual([next(interleaved) for _ in range(2)], ['10.0.0.0', '10.0.1.1'])
+        self.assertLessEqual(len(pulled), 6)
+
+
+class RateLimiterTests(unittest.TestCase):
+    def test_global_and_subnet_buckets(self):
+        limiter = scan_scheduler.RateLimiter(rate=100, subnet_rate=10, burst=2)
+        with unittest.mock.patch.object(scan_scheduler.time, 'monotonic', return_value=100.0):
+            delays = [limiter.reserve('10.0.0.1') for _ in range(3)]
+            other_subnet = limiter.reserve('10.0.1.1')
+        self.assertListEqual(delays[:2], [0.0, 0.0])
+        self.assertAlmostEqual(delays[2], 0.1)
+        # Only waits on the global bucket, which has had 3 of its burst of 2.
+        self.assertAlmostEqual(other_subnet, 0.02)
+
+    def test_invalid_args(self):
+        self.assertRaises(ValueError, scan_scheduler.RateLimiter, rate=0)
+        self.assertRaises(ValueError, scan_scheduler.RateLimiter, burst=0)
+
+
+class AdaptiveTimeoutTests(unittest.TestCase):
+    def test_percentile_within_floor_and_ceiling(self):
+        timeouts = scan_scheduler.AdaptiveTimeout(floor=0.5, ceiling=3.0, multiplier=3.0)
+        self.assertEqual(timeouts.current(), (3.0, 3.0))
+        for _ in range(scan_scheduler._MIN_RTT_SAMPLES):
+            timeouts.observe(0.1, 0.4)
+        self.assertEqual(timeouts.current(), (0.5, 1.2000000000000002))
+        for _ in range(scan_scheduler._RECOMPUTE_EVERY):
+            timeouts.observe(2.0, 2.0)
+        self.assertEqual(timeouts.current(), (3.0, 3.0))
+        self.assertRaises(ValueError, scan_scheduler.AdaptiveTimeout, floor=2, ceiling=1)
+
+
+class SchedulerTests(unittest.TestCase):
+    def scan(self, scheduler, ips, fail_first):
+        """Scans ips, the first request to each of fail_first times out."""
+        failed = set()
+        def mock_get(ip, **kwargs):
+            if ip in fail_first and ip not in failed:
+                failed.add(ip)
+                raise requests.exceptions.ConnectTimeout('timed out')
+            if ip.endswith('.9'):
+                return create_mock_response(404, ip)
+            return create_mock_response(ip=ip, server_header='nginx/1.2.1')
+        scanner = web_server_scanner.WebServerScanner([], scheduler=scheduler)
+        with unittest.mock.patch.object(requests.Session, 'get', side_effect=mock_get) as get:
+            results = list(scanner.iter_scan(ips, order='input'))
+        return results, get
+
+    def test_retries_after_the_rest(self):
+        scheduler = scan_scheduler.Scheduler(retry_delay=0)
+        results, get = self.scan(scheduler, ['192.168.0.1', '192.168.1.1', '192.168.2.9'],
+                                 fail_first={'http://192.168.0.1'})
+        self.assertListEqual([ip for ip, _ in results],
+                             ['192.168.1.1', '192.168.2.9', '192.168.0.1'])
+        self.assertListEqual([result['Status'] for _, result in results],
+                             [StatusEnum.good, StatusEnum.response_err, StatusEnum.good])
+        self.assertEqual(get.call_count, 4)
+        self.assertEqual(scheduler.retried, 1)
+        # Retries use the ceiling.
+        self.assertEqual(get.call_args.kwargs['timeout'], (3.0, 3.0))
+
+    def test_no_budget_no_retries(self):
+        scheduler = scan_scheduler.Scheduler(retry_delay=0, retry_budget=0)
+        results, get = self.scan(scheduler, ['192.168.0.1'], fail_first={'http://192.168.0.1'})
+        self.assertEqual(results[0][1]['Status'], StatusEnum.response_err)
+        self.assertEqual(get.call_count, 1)
+
+    def test_no_retries(self):
+        """With max_retries=0 a retryable failure is output as it is."""
+        scheduler = scan_scheduler.Scheduler(retry_delay=0, max_retries=0)
+        results, get = self.scan(scheduler, ['192.168.0.1', '192.168.1.1'],
+                                 fail_first={'http://192.168.0.1'})
+        self.assertListEqual([ip for ip, _ in results], ['192.168.0.1', '192.168.1.1'])
+        self.assertEqual(results[0][1]['Status'], StatusEnum.response_err)
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(scheduler.retried, 0)
+
+    def test_pickle_and_split(self):
+        scheduler = scan_scheduler.Scheduler(rate=100, subnet_rate=10)
+        scheduler.count_scanned()
+        copy = pickle.loads(pickle.dumps(scheduler))
+        self.assertEqual(copy.scanned, 0)
+        half = scheduler.split(2)
+        self.assertEqual((half.limiter.rate, half.limiter.subnet_rate), (50, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
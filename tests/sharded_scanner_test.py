@@ -0,0 +1,60 @@
+"Tests for scanner.sharded_scanner."
+import unittest
+import unittest.mock
+import requests
+from mock_responses import create_mock_response
+from scanner import sharded_scanner
+from scanner.utils import WebSrvEnum, DirListEnum, StatusEnum
+
+
+class ShardedScannerTests(unittest.TestCase):
+    def test_sharded_scanner(self):
+        """Shards are scanned in worker processes and merged in input order."""
+        ips = [f'192.168.0.{i}' for i in range(1, 8)] + ['0192.168.0.8']
+        # The body is streamed, so each request needs its own response.
+        def mock_get(ip, **kwargs):
+            return create_mock_response(ip=ip, listing=True, server_header='nginx/1.2.1')
+        # Workers are forked inside the patch so they see it too.
+        with unittest.mock.patch.object(requests.Session, 'get', side_effect=mock_get):
+            scanner = sharded_scanner.ShardedScanner(ips, workers=2, shard_size=3)
+            result = scanner()
+
+        self.assertListEqual(list(result), ips)
+        for ip in ips[:-1]:
+            self.assertEqual(result[ip]['WebServerSoftware'], WebSrvEnum.nginx)
+            self.assertEqual(result[ip]['RootListing'], DirListEnum.available)
+            self.assertEqual(result[ip]['Status'], StatusEnum.good)
+        self.assertEqual(result[ips[-1]]['Status'], StatusEnum.bad_ip)
+        self.assertEqual(sum(stats['Hosts'] for stats in scanner.worker_stats.values()),
+                         len(ips))
+        self.assertLessEqual(len(scanner.worker_stats), 2)
+
+    def test_reads_input_lazily(self):
+        """Shards are only read from the input as earlier ones are yielded."""
+        read = []
+        def ips():
+            for i in range(1, 41):
+                read.append(i)
+                yield f'0192.168.1.{i}'
+        scanner = sharded_scanner.ShardedScanner([], workers=1, shard_size=2)
+        for order in ('input', 'completion'):
+            read.clear()
+            results = scanner.iter_scan(ips(), order=order)
+            next(results)
+            # Two shards in flight, plus one submitted when the first was yielded.
+            self.assertLessEqual(len(read), 3 * 2)
+            self.assertEqual(len(list(results)), 39)
+            self.assertEqual(len(read), 40)
+
+    def test_nothing_to_scan(self):
+        scanner = sharded_scanner.ShardedScanner(['127.0.0.1'], workers=2,
+                                                 scan_software=False, scan_root=False)
+        self.assertRaises(ValueError, scanner)
+
+    def test_invalid_args(self):
+        self.assertRaises(ValueError, sharded_scanner.ShardedScanner, [], workers=0)
+        self.assertRaises(ValueError, sharded_scanner.ShardedScanner, [], shard_size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"Tests for scanner.snapshot."
+import os
+import tempfile
+import unittest
+import unittest.mock
+import requests
+from mock_responses import create_mock_response
+from scanner import snapshot, web_server_scanner
+from scanner.utils import WebSrvEnum, DirListEnum, StatusEnum
+
+_GOOD = {'WebServerSoftware': WebSrvEnum.nginx, 'RootListing': DirListEnum.available,
+         'Status': StatusEnum.good, 'ErrorMsg': None}
+
+
+def mock_get(servers):
+    """Session.get answering with the Server header in servers, by URL."""
+    def get(ip, **kwargs):
+        return create_mock_response(ip=ip, server_header=servers[ip])
+    return get
+
+
+class SnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'snapshot.sqlite')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def scan(self, servers, now, **kwargs):
+        scanner = web_server_scanner.WebServerScanner([], preserve_ips=True, scan_root=False)
+        baseline = snapshot.Snapshot(self.path)
+        with unittest.mock.patch.object(requests.Session, 'get',
+                                        side_effect=mock_get(servers)) as get, \
+                unittest.mock.patch('time.time', return_value=now):
+            results = list(baseline.scan(scanner, servers, **kwargs))
+        baseline.close()
+        return results, get.call_count, baseline.stats
+
+    def test_record(self):
+        baseline = snapshot.Snapshot()
+        with_probes = {**_GOOD, 'Probes': {'/files/': DirListEnum.unavailable}}
+        self.assertEqual(baseline.record('a', with_probes, now=10), (None, True))
+        previous, changed = baseline.record('a', {**with_probes, 'ErrorMsg': 'ignored'}, now=20)
+        self.assertDictEqual(previous, {'Result': with_probes, 'Changed': 10, 'Scanned': 10,
+                                        'Stable': 1})
+        self.assertFalse(changed)
+        self.assertDictEqual(baseline.get('a'), {'Result': {**with_probes, 'ErrorMsg': 'ignored'},
+                                                 'Changed': 10, 'Scanned': 20, 'Stable': 2})
+        _, changed = baseline.record('a', _GOOD, now=30)
+        self.assertTrue(changed)
+        self.assertEqual(baseline.get('a')['Stable'], 1)
+        self.assertEqual(len(baseline), 1)
+
+    def test_diff(self):
+        """Only new and changed targets are output, with what they were before."""
+        servers = {'http://192.168.0.1': 'nginx/1.2.1', 'http://192.168.0.2': 'nginx/1.2.1'}
+        results, _, stats = self.scan(servers, 1000)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(stats['New'], 2)
+
+        servers = {**servers, 'http://192.168.0.2': 'nginx/1.25.0', 'http://192.168.0.3': 'x'}
+        results, _, stats = self.scan(servers, 2000, diff=True)
+        self.assertListEqual([ip for ip, _ in results],
+                             ['http://192.168.0.2', 'http://192.168.0.3'])
+        self.assertEqual(results[0][1]['WebServerSoftware'], WebSrvEnum.other)
+        self.assertEqual(results[0][1]['Previous']['WebServerSoftware'], WebSrvEnum.nginx)
+        self.assertIsNone(results[1][1]['Previous'])
+        self.assertDictEqual(stats, {'Scanned': 3, 'New': 1, 'Changed': 1, 'Skipped': 0,
+                                     'Deferred': 0})
+
+        results, _, _ = self.scan(servers, 3000, diff=True)
+        self.assertListEqual(results, [])
+
+    def test_policy(self):
+        """Stable targets are skipped until due, and with defer scanned last."""
+        servers = {'http://192.168.0.1': 'nginx/1.2.1', 'http://192.168.0.2': 'nginx/1.2.1'}
+        self.scan(servers, 1000)
+        self.scan({'http://192.168.0.1': 'nginx/1.2.1'}, 1100)
+        policy = snapshot.RescanPolicy({StatusEnum.good: 500}, stable_after=2)
+        _, requests_made, stats = self.scan(servers, 1200, policy=policy)
+        self.assertEqual(requests_made, 1)
+        self.assertEqual(stats['Skipped'], 1)
+
+        # 192.168.0.1 is due, 192.168.0.2 was last scanned too recently.
+        servers = {**servers, 'http://192.168.0.3': 'nginx/1.2.1'}
+        policy = snapshot.RescanPolicy({StatusEnum.good: 500}, stable_after=2, defer=True)
+        results, requests_made, stats = self.scan(servers, 1650, policy=policy)
+        self.assertListEqual([ip for ip, _ in results],
+                             ['http://192.168.0.3', 'http://192.168.0.1'])
+        self.assertDictEqual(stats, {'Scanned': 2, 'New': 1, 'Changed': 0, 'Skipped': 1,
+                                     'Deferred': 1})
+
+    def test_invalid_policy(self):
+        self.assertRaises(ValueError, snapshot.RescanPolicy, stable_after=0)
+        self.assertRaises(ValueError, snapshot.RescanPolicy, {StatusEnum.good: -1})
+
+
+if __name__ == '__main__':
+    unittest.main()
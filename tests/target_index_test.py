@@ -0,0 +1,77 @@
+"Tests for scanner.target_index."
+import unittest
+from scanner import target_index
+from scanner.result_store import pack_key
+from scanner.utils import WebSrvEnum, DirListEnum, StatusEnum
+
+
+class TargetIndexTests(unittest.TestCase):
+    def test_get_and_set(self):
+        index = target_index.TargetIndex(capacity=4)
+        keys = [pack_key(f'http://10.0.{i // 256}.{i % 256}:80') for i in range(5000)]
+        for i, key in enumerate(keys):
+            index[key] = i
+        # Grown from 4 slots, everything still there.
+        self.assertEqual(len(index), len(keys))
+        self.assertListEqual([index.get(key) for key in keys], list(range(len(keys))))
+        index[keys[0]] = 7
+        self.assertEqual(index.get(keys[0]), 7)
+        self.assertFalse(index.add(keys[1], 7))
+        self.assertEqual(index.get(keys[1]), 1)
+        self.assertEqual(len(index), len(keys))
+        # 0 is a valid key and value, not a free slot.
+        self.assertTrue(index.add(0, 0))
+        self.assertIn(0, index)
+        self.assertEqual(index.get(0), 0)
+        self.assertNotIn(pack_key('https://10.0.0.1:443'), index)
+        self.assertIsNone(index.get(pack_key('https://10.0.0.1:443')))
+
+
+class ResultTableTests(unittest.TestCase):
+    def test_results_stored_once(self):
+        table = target_index.ResultTable()
+        good = {'WebServerSoftware': WebSrvEnum.nginx, 'RootListing': DirListEnum.available,
+                'Status': StatusEnum.good, 'ErrorMsg': None,
+                'Probes': {'/files/': DirListEnum.unavailable}}
+        bad = {**good, 'Status': StatusEnum.response_err, 'ErrorMsg': 'timed out'}
+        numbers = [table.add(good), table.add(bad), table.add(dict(good))]
+        self.assertListEqual(numbers, [0, 1, 0])
+        self.assertEqual(len(table), 2)
+        self.assertDictEqual(table.get(0), good)
+        self.assertDictEqual(table.get(1), bad)
+        # Copies, changing one doesn't change the table.
+        table.get(0)['Probes']['/'] = DirListEnum.available
+        self.assertDictEqual(table.get(0), good)
+
+    def test_error_messages_shared(self):
+        """Hosts failing alike share a result, each read back with its own host and port."""
+        table = target_index.ResultTable()
+        messages = {
+            'http://10.0.0.1': "Bad status... HTTPConnectionPool(host='10.0.0.1', port=80): Max "
+                               "retries exceeded (Caused by ConnectTimeoutError(<urllib3."
+                               "connection.HTTPConnection object at 0x7f01>, 'Connection to "
+                               "10.0.0.1 timed out. (connect timeout=3)'))",
+            '10.0.0.10:8080': "Bad status... HTTPConnectionPool(host='10.0.0.10', port=8080): "
+                              "Max retries exceeded (Caused by ConnectTimeoutError(<urllib3."
+                              "connection.HTTPConnection object at 0x7f02>, 'Connection to "
+                              "10.0.0.10 timed out. (connect timeout=3)'))",
+            'https://10.0.0.2': 'Bad status... 10.0.0.2:443: Connect timed out. (timeout=3)',
+            'https://10.0.0.3': 'Bad status... 10.0.0.3:443: Connect timed out. (timeout=3)',
+        }
+        numbers = {ip: table.add({'Status': StatusEnum.response_err, 'ErrorMsg': message}, ip)
+                   for ip, message in messages.items()}
+        self.assertEqual(len(table), 2)
+        self.assertEqual(numbers['http://10.0.0.1'], numbers['10.0.0.10:8080'])
+        for ip, message in messages.items():
+            if ip != '10.0.0.10:8080':
+                self.assertEqual(table.get(numbers[ip], ip)['ErrorMsg'], message)
+        # Read back with the object address of the first with its message.
+        self.assertEqual(table.get(numbers['10.0.0.10:8080'], '10.0.0.10:8080')['ErrorMsg'],
+                         messages['10.0.0.10:8080'].replace('0x7f02', '0x7f01'))
+        # Kept as it is if it has a character used to mark the host.
+        marked = {'Status': StatusEnum.response_err, 'ErrorMsg': 'Bad response: \x00 10.0.0.4'}
+        self.assertDictEqual(table.get(table.add(marked, '10.0.0.4'), '10.0.0.4'), marked)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"Tests for scanner.targets."
+import itertools
+import unittest
+from scanner import targets
+
+
+class TargetsTests(unittest.TestCase):
+    def test_plain_ips_unchanged(self):
+        specs = ['127.0.0.1', 'http://127.0.0.1:8080', '0127.0.0.1', 'example.com']
+        self.assertListEqual(list(targets.expand_targets(specs)), specs)
+
+    def test_cidr(self):
+        result = list(targets.expand_target('http://10.0.0.0/30'))
+        self.assertListEqual(result, ['http://10.0.0.1', 'http://10.0.0.2'])
+
+    def test_cidr_with_ports(self):
+        result = list(targets.expand_target('10.0.0.0/30:80,8080-8081'))
+        self.assertListEqual(result, ['10.0.0.1:80', '10.0.0.1:8080', '10.0.0.1:8081',
+                                      '10.0.0.2:80', '10.0.0.2:8080', '10.0.0.2:8081'])
+
+    def test_ranges(self):
+        self.assertListEqual(list(targets.expand_target('10.0.0.254-10.0.1.1')),
+                             ['10.0.0.254', '10.0.0.255', '10.0.1.0', '10.0.1.1'])
+        self.assertListEqual(list(targets.expand_target('https://10.0.0.1-3:443')),
+                             ['https://10.0.0.1:443', 'https://10.0.0.2:443',
+                              'https://10.0.0.3:443'])
+
+    def test_lazy(self):
+        """A /8 yields straight away without building the list."""
+        first = list(itertools.islice(targets.expand_target('10.0.0.0/8:80,443'), 3))
+        self.assertListEqual(first, ['10.0.0.1:80', '10.0.0.1:443', '10.0.0.2:80'])
+
+    def test_invalid_passed_through(self):
+        specs = ['10.0.0.5-10.0.0.1', '10.0.0.0/33', '10.0.0.1:80,70000', '10.0.0.1-x']
+        self.assertListEqual(list(targets.expand_targets(specs)), specs)
+
+    def test_blank_skipped(self):
+        self.assertListEqual(list(targets.expand_targets(['', ' 127.0.0.1 \n'])),
+                             ['127.0.0.1'])
+
+    def test_parse_port(self):
+        self.assertEqual(targets.parse_port('8080'), 8080)
+        for port in ('0', '65536', '-1', '+80', ' 80', '８０'):
+            self.assertRaises(ValueError, targets.parse_port, port)
+
+    def test_normalize(self):
+        for formatted in ('10.0.0.1', 'http://10.0.0.1', 'http://10.0.0.1:80',
+                          'http://10.0.0.1:080'):
+            self.assertEqual(targets.normalize(formatted), 'http://10.0.0.1:80')
+        self.assertEqual(targets.normalize('https://10.0.0.1'), 'https://10.0.0.1:443')
+        self.assertEqual(targets.normalize('https://10.0.0.1:8443'), 'https://10.0.0.1:8443')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"Tests for scanner.tcp_sweep and the scanner's TCP sweep stage, against local ports."
+import http.server
+import socket
+import threading
+import time
+import unittest
+import unittest.mock
+
+from scanner import tcp_sweep, web_server_scanner
+from scanner.utils import WebSrvEnum, DirListEnum, StatusEnum
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b'<title>Index of /</title>'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def version_string(self):
+        return 'nginx/1.2.1'
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Swept connections are reset without a request.
+        pass
+
+
+def _closed_port() -> int:
+    # Bind then close to get a port nothing is listening on.
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TcpSweepTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = _Server(('127.0.0.1', 0), _Handler)
+        cls.open_port = cls.server.server_port
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.closed_port = _closed_port()
+        # Never accepts, so once its backlog is full further connects get no answer.
+        cls.black_hole = socket.socket()
+        cls.black_hole.bind(('127.0.0.1', 0))
+        cls.black_hole.listen(0)
+        cls.filtered_port = cls.black_hole.getsockname()[1]
+        cls.backlog = []
+        for _ in range(3):
+            sock = socket.socket()
+            sock.setblocking(False)
+            sock.connect_ex(('127.0.0.1', cls.filtered_port))
+            cls.backlog.append(sock)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        for sock in cls.backlog + [cls.black_hole]:
+            sock.close()
+        super().tearDownClass()
+
+    def test_sweep_states(self):
+        sweeper = tcp_sweep.TcpSweeper(timeout=0.2, max_in_flight=2)
+        targets = [('open', '127.0.0.1', self.open_port),
+                   ('refused', '127.0.0.1', self.closed_port),
+                   ('filtered', '127.0.0.1', self.filtered_port), None,
+                   ('open again', '127.0.0.1', self.open_port)]
+        states = {tag: state for tag, state, _ in sweeper.sweep(targets)}
+        self.assertDictEqual(states, {'open': tcp_sweep.OPEN, 'refused': tcp_sweep.REFUSED,
+                                      'filtered': tcp_sweep.FILTERED,
+                                      'open again': tcp_sweep.OPEN})
+
+    def test_invalid_args(self):
+        with self.assertRaises(ValueError):
+            tcp_sweep.TcpSweeper(timeout=0)
+        with self.assertRaises(ValueError):
+            tcp_sweep.TcpSweeper(max_in_flight=0)
+
+    def test_scanner_pipeline(self):
+        """Only the open port gets an HTTP request, the rest get the sweep's statuses."""
+        ips = [f'127.0.0.1:{self.closed_port}', f'127.0.0.1:{self.open_port}', 'not an ip',
+               f'127.0.0.1:{self.filtered_port}', f'http://127.0.0.1:{self.open_port}']
+        expected = [StatusEnum.refused, StatusEnum.good, StatusEnum.bad_ip, StatusEnum.filtered,
+                    StatusEnum.good]
+        for engine in web_server_scanner.ENGINES:
+            for order in web_server_scanner.ORDERS:
+                with self.subTest(engine=engine, order=order):
+                    scanner = web_server_scanner.WebServerScanner(
+                        [], log_level='CRITICAL', engine=engine, max_in_flight=2,
+                        sweeper=tcp_sweep.TcpSweeper(timeout=0.2))
+                    results = list(scanner.iter_scan(ips, order=order, reorder_buffer=2))
+                    if order == 'input':
+                        self.assertListEqual([ip for ip, _ in results], ips)
+                    statuses = dict((ip, result['Status']) for ip, result in results)
+                    self.assertDictEqual(statuses, dict(zip(ips, expected)))
+                    good = dict(results)[ips[1]]
+                    self.assertEqual(good['WebServerSoftware'], WebSrvEnum.nginx)
+                    self.assertEqual(good['RootListing'], DirListEnum.available)
+
+    def test_scanner_dedup(self):
+        """Repeats of a target aren't swept again, but still get its result."""
+        ips = [f'127.0.0.1:{self.closed_port}', f'127.0.0.1:{self.open_port}',
+               f'http://127.0.0.1:{self.closed_port}', f'http://127.0.0.1:{self.open_port}']
+        scanner = web_server_scanner.WebServerScanner(
+            [], log_level='CRITICAL', sweeper=tcp_sweep.TcpSweeper(timeout=0.2), dedup=True)
+        swept = []
+        sweep = scanner.sweeper.sweep
+        scanner.sweeper.sweep = lambda targets: sweep(
+            target for target in targets if target is None or not swept.append(target))
+        results = list(scanner.iter_scan(ips, order='input'))
+        self.assertEqual(len(swept), 2)
+        self.assertListEqual([ip for ip, _ in results], ips)
+        self.assertListEqual([result['Status'] for _, result in results],
+                             [StatusEnum.refused, StatusEnum.good] * 2)
+
+    def test_scanner_rate_limited(self):
+        """Connects wait for the scheduler's per /24 limit like requests do."""
+        ips = [f'127.0.0.1:{self.closed_port}'] * 4
+        scheduler = web_server_scanner.scan_scheduler.Scheduler(subnet_rate=10, burst=1)
+        scanner = web_server_scanner.WebServerScanner(
+            [], log_level='CRITICAL', scheduler=scheduler,
+            sweeper=tcp_sweep.TcpSweeper(timeout=0.2))
+        start = time.monotonic()
+        with unittest.mock.patch.object(scheduler, 'delay', wraps=scheduler.delay) as delay:
+            results = list(scanner.iter_scan(ips))
+        self.assertEqual(delay.call_count, 4)
+        # A token at once, then one every 0.1s.
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        self.assertListEqual([result['Status'] for _, result in results],
+                             [StatusEnum.refused] * 4)
+
+    def test_scanner_stops_early(self):
+        """Closing the generator part way leaves no threads stuck."""
+        ips = [f'127.0.0.1:{self.open_port}'] * 20
+        for engine in web_server_scanner.ENGINES:
+            with self.subTest(engine=engine):
+                scanner = web_server_scanner.WebServerScanner(
+                    [], log_level='CRITICAL', engine=engine,
+                    sweeper=tcp_sweep.TcpSweeper(timeout=0.2))
+                results = scanner.iter_scan(ips)
+                next(results)
+                results.close()
@@ -1,14 +1,19 @@
 "Tests for scanner.web_server_scanner."
+import asyncio
+import http.server
+import threading
 import unittest
 import unittest.mock
-import requests_mock
 import requests
+from mock_responses import FAKE_IP as _FAKE_IP, create_mock_response
+from requests.structures import CaseInsensitiveDict
 from scanner import web_server_scanner
 from scanner.utils import WebSrvEnum, get_flagged_versions, DirListEnum, StatusEnum
 from typing import Optional
 import logging
 
-_FAKE_IP = 'http://127.0.0.1'
+# Use the module the scanner imported so patches and exception types line up.
+async_http = web_server_scanner.async_http
 
 logging.basicConfig(level='DEBUG')
 
@@ -17,22 +22,15 @@ class WebServerScannerNoInit(web_server_scanner.WebServerScanner):
     def __init__(self):
         pass
     
-def create_mock_response(
+def create_async_response(
     status_code: int = 200, ip: str = _FAKE_IP,
     listing: Optional[bool] = None, server_header: Optional[str] = None,
-    ) -> requests.Response:
-    header = {}
+    ) -> async_http.AsyncResponse:
+    header = CaseInsensitiveDict()
     if server_header:
        header['Server'] = server_header
-    text = ''
-    if listing:
-        text = '<head><title>Index of /</title></head>'
-    return requests_mock.create_response(
-        request=requests.Request('GET', ip),
-        text=text,
-        status_code=status_code,
-        headers=header,
-        )
+    content = b'<head><title>Index of /</title></head>' if listing else b''
+    return async_http.AsyncResponse(ip, status_code, header, content)
 
 class WebServerScannerTests(unittest.TestCase):
     maxDiff = None
@@ -65,7 +63,7 @@ class WebServerScannerTests(unittest.TestCase):
         }
         expected_result = {ips[0]: expected_1, ips[1]: expected_2}
 
-        with unittest.mock.patch.object(requests, 'get', side_effect=responses):
+        with unittest.mock.patch.object(requests.Session, 'get', side_effect=responses):
             # Use the real WebServerScanner in this one.
             result = web_server_scanner.WebServerScanner(ips, preserve_ips=True)()
             self.assertDictEqual(dict(result), expected_result)
@@ -91,16 +89,199 @@ class WebServerScannerTests(unittest.TestCase):
         }
         expected_result = {ips[0]: expected_1, ips[1]: expected_2}
 
-        with unittest.mock.patch.object(requests, 'get', side_effect=mock_resp):
+        with unittest.mock.patch.object(requests.Session, 'get', side_effect=mock_resp):
             # Use the real WebServerScanner in this one.
             result = web_server_scanner.WebServerScanner(ips, preserve_ips=True)()
             self.assertDictEqual(dict(result), expected_result)
 
+    def test_scanner_async(self):
+        """Test the async engine gives the same ip_map, in input order."""
+        ips = ['http://192.168.0.1:8080', '192.168.0.2', '0192.168.0.3', '192.168.0.4']
+        responses = {
+            'http://192.168.0.1:8080': create_async_response(listing=True,
+                                                             server_header=self.flagged_srv),
+            'http://192.168.0.2': create_async_response(status_code=404),
+        }
+        async def fake_get(url, timeout, **kwargs):
+            if url not in responses:
+                raise async_http.RequestError('timed out')
+            return responses[url]
+        expected_result = {
+            ips[0]: {'WebServerSoftware': WebSrvEnum.nginx,
+                     'RootListing': DirListEnum.available,
+                     'Status': StatusEnum.good,
+                     'ErrorMsg': None},
+            ips[1]: {'WebServerSoftware': WebSrvEnum.err,
+                     'RootListing': DirListEnum.err,
+                     'Status': StatusEnum.response_err,
+                     'ErrorMsg': web_server_scanner._ERROR_STATUS_MSG.format('Bad response code: 404')},
+            ips[2]: {'WebServerSoftware': WebSrvEnum.err,
+                     'RootListing': DirListEnum.err,
+                     'Status': StatusEnum.bad_ip,
+                     'ErrorMsg': 'Pass a valid IP.'},
+            ips[3]: {'WebServerSoftware': WebSrvEnum.err,
+                     'RootListing': DirListEnum.err,
+                     'Status': StatusEnum.response_err,
+                     'ErrorMsg': web_server_scanner._ERROR_STATUS_MSG.format('timed out')},
+        }
+
+        with unittest.mock.patch.object(async_http, 'get', side_effect=fake_get):
+            result = web_server_scanner.WebServerScanner(ips, preserve_ips=True, engine='async',
+                                                         max_in_flight=2)()
+        self.assertDictEqual(dict(result), expected_result)
+        self.assertListEqual(list(result), ips)
+
+    def test_iter_scan_lazy(self):
+        """iter_scan pulls IPs from a generator only as it needs them."""
+        pulled = []
+        def ips():
+            for i in range(1, 4):
+                pulled.append(i)
+                yield f'192.168.0.{i}'
+        with unittest.mock.patch.object(requests.Session, 'get',
+                                        side_effect=lambda *args, **kwargs: create_mock_response()):
+            results = web_server_scanner.WebServerScanner([]).iter_scan(ips())
+            ip, result = next(results)
+            self.assertEqual(ip, '192.168.0.1')
+            self.assertEqual(result['Status'], StatusEnum.good)
+            self.assertListEqual(pulled, [1])
+            self.assertListEqual([ip for ip, _ in results], ['192.168.0.2', '192.168.0.3'])
+
+    def test_iter_scan_async_order(self):
+        """Completion order yields fast hosts first, input order doesn't."""
+        ips = ['192.168.0.1', '192.168.0.2', '192.168.0.3']
+        async def fake_get(url, timeout, **kwargs):
+            # .1 is the slowest to answer.
+            await asyncio.sleep(0.05 if url.endswith('.1') else 0)
+            return create_async_response()
+        scanner = web_server_scanner.WebServerScanner([], engine='async')
+        with unittest.mock.patch.object(async_http, 'get', side_effect=fake_get):
+            completion = [ip for ip, _ in scanner.iter_scan(ips)]
+            in_order = [ip for ip, _ in scanner.iter_scan(ips, order='input', reorder_buffer=2)]
+        self.assertEqual(completion[-1], '192.168.0.1')
+        self.assertCountEqual(completion, ips)
+        self.assertListEqual(in_order, ips)
+
+    def test_iter_scan_async_close_early(self):
+        """Closing the generator stops the scan without hanging."""
+        async def fake_get(url, timeout, **kwargs):
+            return create_async_response()
+        scanner = web_server_scanner.WebServerScanner([], engine='async', max_in_flight=2)
+        ips = (f'10.0.{i // 256}.{i % 256}' for i in range(10000))
+        with unittest.mock.patch.object(async_http, 'get', side_effect=fake_get):
+            results = scanner.iter_scan(ips)
+            next(results)
+            results.close()
+        self.assertIsNotNone(next(ips, None))
+
+    def test_iter_scan_invalid_args(self):
+        scanner = web_server_scanner.WebServerScanner([])
+        self.assertRaises(ValueError, scanner.iter_scan, order='random')
+        self.assertRaises(ValueError, scanner.iter_scan, reorder_buffer=0)
+        scanner = web_server_scanner.WebServerScanner([], scan_software=False, scan_root=False)
+        self.assertRaises(ValueError, scanner.iter_scan)
+
+    def test_scanner_cache(self):
+        """A cached result is returned without a request and marked as cached."""
+        cache = web_server_scanner.result_cache.ResultCache()
+        ips = ['192.168.0.1', 'http://192.168.0.1:80', '192.168.0.1:8080']
+        mock_get = unittest.mock.Mock(side_effect=lambda *args, **kwargs: create_mock_response(
+            listing=True, server_header=self.flagged_srv))
+        with unittest.mock.patch.object(requests.Session, 'get', mock_get):
+            first = dict(web_server_scanner.WebServerScanner(ips[:1], cache=cache)())
+            second = dict(web_server_scanner.WebServerScanner(ips, cache=cache)())
+        # .1 and .1:80 are the same target, :8080 isn't.
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertFalse(first[ips[0]]['Cached'])
+        self.assertListEqual([second[ip]['Cached'] for ip in ips], [True, True, False])
+        self.assertEqual(second[ips[1]]['WebServerSoftware'], WebSrvEnum.nginx)
+        self.assertDictEqual(cache.stats(), {'Hits': 2, 'Misses': 2})
+        with unittest.mock.patch.object(requests.Session, 'get', mock_get):
+            web_server_scanner.WebServerScanner(ips[:1], scan_root=False, cache=cache)()
+        # Different options, different key.
+        self.assertEqual(mock_get.call_count, 3)
+        rules = web_server_scanner.flagged_rules.RuleIndex(
+            [{'product': 'nginx', 'flag_as': 'nginx', 'versions': ['>=1.20']}])
+        with unittest.mock.patch.object(requests.Session, 'get', mock_get):
+            result = web_server_scanner.WebServerScanner(ips[:1], cache=cache, rules=rules)()
+        # Different rules too, so it isn't flagged from the cache.
+        self.assertEqual(mock_get.call_count, 4)
+        self.assertEqual(result[ips[0]]['WebServerSoftware'], WebSrvEnum.other)
+
+    def test_dedup(self):
+        """Each target is scanned once and its result fanned out to every spelling."""
+        ips = ['192.168.0.1', 'http://192.168.0.1', '192.168.0.2', '192.168.0.1:080',
+               'https://192.168.0.1', 'bad', 'bad', '192.168.0.2:80']
+        async def fake_get(url, timeout, **kwargs):
+            # The first target answers last, so repeats of it are read while in flight.
+            await asyncio.sleep(0.05 if url == 'http://192.168.0.1' else 0)
+            return create_async_response(server_header=self.flagged_srv)
+        for engine in web_server_scanner.ENGINES:
+            for order in web_server_scanner.ORDERS:
+                with self.subTest(engine=engine, order=order):
+                    scanner = web_server_scanner.WebServerScanner([], engine=engine,
+                                                                  dedup=True)
+                    sync_get = unittest.mock.Mock(side_effect=lambda *args, **kwargs:
+                                                  create_mock_response(
+                                                      server_header=self.flagged_srv))
+                    async_get = unittest.mock.AsyncMock(side_effect=fake_get)
+                    with unittest.mock.patch.object(requests.Session, 'get', sync_get), \
+                         unittest.mock.patch.object(async_http, 'get', async_get):
+                        results = list(scanner.iter_scan(ips, order=order))
+                    # .1 over http and https, and .2.
+                    self.assertEqual(sync_get.call_count + async_get.call_count, 3)
+                    if order == 'input' or engine == 'sync':
+                        self.assertListEqual([ip for ip, _ in results], ips)
+                    self.assertCountEqual([ip for ip, _ in results], ips)
+                    statuses = {ip: result['Status'] for ip, result in results}
+                    self.assertEqual(statuses.pop('bad'), StatusEnum.bad_ip)
+                    self.assertEqual(set(statuses.values()), {StatusEnum.good})
+
+    def test_dedup_without_preserve_ips(self):
+        """Each target is yielded once, under its canonical spelling."""
+        ips = ['192.168.0.1', 'http://192.168.0.1:80', '192.168.0.1:8080', 'bad']
+        mock_get = unittest.mock.Mock(side_effect=lambda *args, **kwargs: create_mock_response())
+        scanner = web_server_scanner.WebServerScanner([], preserve_ips=False, dedup=True)
+        with unittest.mock.patch.object(requests.Session, 'get', mock_get):
+            results = list(scanner.iter_scan(ips))
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertListEqual([ip for ip, _ in results],
+                             ['http://192.168.0.1:80', 'http://192.168.0.1:8080', 'bad'])
+        self.assertListEqual([scanner.output_key(ip) for ip in ips],
+                             ['http://192.168.0.1:80', 'http://192.168.0.1:80',
+                              'http://192.168.0.1:8080', 'bad'])
+
+    def test_dedup_with_retries(self):
+        """Repeats of a target being retried get its result after the retry."""
+        scheduler = web_server_scanner.scan_scheduler.Scheduler(max_retries=1, retry_budget=1,
+                                                                retry_delay=0)
+        responses = [requests.exceptions.ConnectTimeout('timed out'), create_mock_response()]
+        mock_get = unittest.mock.Mock(side_effect=responses)
+        scanner = web_server_scanner.WebServerScanner([], scheduler=scheduler, dedup=True)
+        ips = ['192.168.0.1', 'http://192.168.0.1']
+        with unittest.mock.patch.object(requests.Session, 'get', mock_get):
+            results = list(scanner.iter_scan(ips))
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertListEqual([ip for ip, _ in results], ips)
+        self.assertEqual([result['Status'] for _, result in results], [StatusEnum.good] * 2)
+
+    def test_invalid_engine(self):
+        self.assertRaises(ValueError, web_server_scanner.WebServerScanner, [], engine='threads')
+        self.assertRaises(ValueError, web_server_scanner.WebServerScanner, [], engine='async',
+                          max_in_flight=0)
             
     def test_format_ip(self):
         unformatted_ip = '127.0.0.1'
         result = WebServerScannerNoInit()._format_and_validate_ip(unformatted_ip)
         self.assertEqual(result, _FAKE_IP)
+
+    def test_format_expanded_ip(self):
+        """Targets from expand_target are already valid and aren't parsed again."""
+        expanded = list(web_server_scanner.targets.expand_target('127.0.0.1-2:80'))
+        with unittest.mock.patch.object(web_server_scanner.ipaddress, 'IPv4Address') as parse:
+            result = [WebServerScannerNoInit()._format_and_validate_ip(ip) for ip in expanded]
+        self.assertListEqual(result, ['http://127.0.0.1:80', 'http://127.0.0.2:80'])
+        parse.assert_not_called()
         
     def test_invalid_ip(self):
         invalid_ip = '0127.0.0.1'
@@ -109,16 +290,20 @@ class WebServerScannerTests(unittest.TestCase):
                           WebServerScannerNoInit()._format_and_validate_ip, invalid_ip)
         self.assertRaises(ValueError,
                           WebServerScannerNoInit()._format_and_validate_ip, invalid_host)
+        for invalid in ('256.0.0.1', '127.0.0.1:0', '127.0.0.1:99999', 'http://127.0.0.1/',
+                        '127.0.0.1:80/path'):
+            self.assertRaises(ValueError,
+                              WebServerScannerNoInit()._format_and_validate_ip, invalid)
         
     def test_make_request_good_resp(self):
         mock_resp = create_mock_response()
-        with unittest.mock.patch.object(requests, 'get', return_value=mock_resp):
+        with unittest.mock.patch.object(requests.Session, 'get', return_value=mock_resp):
             resp = WebServerScannerNoInit()._make_request(_FAKE_IP)
         self.assertEqual(resp.text, '')
         
     def test_make_request_bad_resp(self):
         mock_resp = create_mock_response(404)
-        with unittest.mock.patch.object(requests, 'get', return_value=mock_resp):
+        with unittest.mock.patch.object(requests.Session, 'get', return_value=mock_resp):
             self.assertRaises(ValueError,
                               WebServerScannerNoInit()._make_request, _FAKE_IP)
         
@@ -132,6 +317,21 @@ class WebServerScannerTests(unittest.TestCase):
         self.assertEqual(WebServerScannerNoInit()._server_software(mock_resp),
                          WebSrvEnum.other)
         
+    def test_server_software_unusual_header(self):
+        for header in ('nginx', 'Apache/2.4.1 (Unix)'):
+            mock_resp = create_mock_response(server_header=header)
+            self.assertEqual(WebServerScannerNoInit()._server_software(mock_resp),
+                             WebSrvEnum.other)
+
+    def test_server_software_custom_rules(self):
+        rules = web_server_scanner.flagged_rules.RuleIndex(
+            [{'product': 'nginx', 'flag_as': 'nginx', 'versions': ['>=1.20']}])
+        scanner = web_server_scanner.WebServerScanner([], rules=rules)
+        self.assertEqual(scanner._server_software(create_mock_response(server_header='nginx/1.21.3')),
+                         WebSrvEnum.nginx)
+        self.assertEqual(scanner._server_software(create_mock_response(server_header=self.flagged_srv)),
+                         WebSrvEnum.other)
+        
     def test_root_listing_avail(self):
         mock_resp = create_mock_response(listing=True)
         self.assertEqual(WebServerScannerNoInit()._root_listing(mock_resp),
@@ -141,7 +341,133 @@ class WebServerScannerTests(unittest.TestCase):
         mock_resp = create_mock_response(listing=False)
         self.assertEqual(WebServerScannerNoInit()._root_listing(mock_resp),
                          DirListEnum.unavailable)
+
+    def test_root_listing_across_chunks(self):
+        """Marker split over two chunks is still found."""
+        mock_resp = create_mock_response(listing=True)
+        marker_end = mock_resp.text.index('Index of') + 4
+        chunks = [mock_resp.content[:marker_end], mock_resp.content[marker_end:]]
+        with unittest.mock.patch.object(mock_resp, 'iter_content', return_value=iter(chunks)):
+            self.assertEqual(WebServerScannerNoInit()._root_listing(mock_resp),
+                             DirListEnum.available)
+
+    def test_root_listing_body_limit(self):
+        """Listing past max_body_bytes is not seen, and the rest isn't read."""
+        mock_resp = create_mock_response(listing=True)
+        scanner = WebServerScannerNoInit()
+        scanner.max_body_bytes = mock_resp.text.index('Index of') + 4
+        chunks_read = []
+        def chunks(chunk_size):
+            for chunk in (mock_resp.content, b'x' * 10):
+                chunks_read.append(chunk)
+                yield chunk
+        with unittest.mock.patch.object(mock_resp, 'iter_content', side_effect=chunks):
+            self.assertEqual(scanner._root_listing(mock_resp), DirListEnum.unavailable)
+        self.assertEqual(len(chunks_read), 1)
+
+    def test_scanner_no_root_skips_body(self):
+        """With scan_root=False the streamed body is never read."""
+        mock_resp = create_mock_response(listing=True, server_header=self.flagged_srv)
+        with unittest.mock.patch.object(requests.Session, 'get', return_value=mock_resp) as mock_get, \
+             unittest.mock.patch.object(mock_resp, 'iter_content') as mock_iter:
+            result = web_server_scanner.WebServerScanner(['192.168.0.1'], scan_root=False)()
+        self.assertTrue(mock_get.call_args.kwargs['stream'])
+        mock_iter.assert_not_called()
+        self.assertEqual(result['192.168.0.1']['RootListing'], DirListEnum.disabled)
         
 
+class _ProbeHandler(http.server.BaseHTTPRequestHandler):
+    """/ redirects to /home/, which like /files/ has a listing. Anything else is a 404."""
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+
+    def do_GET(self):
+        body = b''
+        if self.path == '/':
+            self.send_response(302)
+            self.send_header('Location', '/home/')
+        elif self.path in ('/home/', '/files/'):
+            self.send_response(200)
+            body = b'<head><title>Index of /</title></head>'
+        else:
+            self.send_response(404)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def version_string(self):
+        return 'nginx/1.2.1'
+
+    def log_message(self, *args):
+        pass
+
+
+class ProbeTests(unittest.TestCase):
+    """Probes and redirects against a local keep-alive server."""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _ProbeHandler)
+        cls.ip = f'127.0.0.1:{cls.server.server_port}'
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def scan(self, **kwargs):
+        _ProbeHandler.connections = 0
+        scanner = web_server_scanner.WebServerScanner([self.ip], log_level='CRITICAL',
+                                                      probes=['/files/', '/missing/'],
+                                                      follow_redirects=1, **kwargs)
+        return scanner()[self.ip], _ProbeHandler.connections
+
+    def test_probes_share_a_connection(self):
+        for engine in web_server_scanner.ENGINES:
+            with self.subTest(engine=engine):
+                result, connections = self.scan(engine=engine)
+                self.assertEqual(result['Status'], StatusEnum.good)
+                self.assertEqual(result['WebServerSoftware'], WebSrvEnum.nginx)
+                # Listed at /home/, where / redirected.
+                self.assertEqual(result['RootListing'], DirListEnum.available)
+                self.assertDictEqual(result['Probes'], {'/files/': DirListEnum.available,
+                                                        '/missing/': DirListEnum.unavailable})
+                self.assertEqual(connections, 1)
+                # One per request without keep-alive: /, /home/ and each probe.
+                result, connections = self.scan(engine=engine, keep_alive=False)
+                self.assertEqual(connections, 4)
+                self.assertEqual(result['Probes']['/files/'], DirListEnum.available)
+
+    def test_redirects_not_followed(self):
+        result = web_server_scanner.WebServerScanner([self.ip], log_level='CRITICAL')()[self.ip]
+        self.assertEqual(result['Status'], StatusEnum.response_err)
+        self.assertNotIn('Probes', result)
+
+    def test_redirect_location(self):
+        scanner = WebServerScannerNoInit()
+        scanner.follow_redirects = 1
+        url = 'http://10.0.0.1'
+        for location, expected in (('/a', 'http://10.0.0.1/a'),
+                                   ('http://10.0.0.1:80/b', 'http://10.0.0.1:80/b'),
+                                   ('https://10.0.0.1/', None), ('http://10.0.0.2/', None),
+                                   ('http://10.0.0.1:bad/', None)):
+            resp = create_mock_response(status_code=301)
+            resp.headers['Location'] = location
+            self.assertEqual(scanner._redirect_location(url, resp), expected, location)
+
+    def test_invalid_probes(self):
+        self.assertRaises(ValueError, web_server_scanner.WebServerScanner, [], probes=['files'])
+        self.assertRaises(ValueError, web_server_scanner.WebServerScanner, [], probes=['/a/'],
+                          cache=web_server_scanner.result_cache.ResultCache())
+        self.assertRaises(ValueError, web_server_scanner.WebServerScanner, [], pool_size=0)
+
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file